@@ -0,0 +1,158 @@
+"""Daily activity rollups for the admin analytics page.
+
+`rollup` counts one UTC day's messages, posters, active users, likes,
+follows and DMs into daily_stats, and its top posters into
+daily_top_posters. `flask rollup-analytics`, run on a schedule, rolls up
+each finished day after the last one done, so every day is read once,
+and `dashboard` reads a fixed number of rollup rows however long the
+history gets.
+
+Messages and DMs are counted from their own tables by id range (ids are
+time-ordered; see ids.py). Likes and follows are counted from the outbox
+(see outbox.py), also by id range, so the job has to run at least once
+every OUTBOX_RETENTION_HOURS. Active users are those who posted, sent a
+DM, liked or followed.
+
+So history only starts once the outbox does: likes and follows from
+before it weren't recorded, and messages and DMs from before snowflake
+ids keep their serial ids (and timestamps that are only worker start
+times; see migrations/0001_snowflake_ids.sql), so can't be put on a day.
+`pending` never backfills past the first full day the outbox covers,
+rather than filling earlier days with zeros.
+"""
+
+from datetime import datetime, time, timedelta
+
+from sqlalchemy.dialects.postgresql import insert
+
+from ids import id_for_time, time_of
+from models import db, DailyStats, DailyTopPoster, DirectMessage, Message
+from models import OutboxEvent
+
+TOP_POSTERS = 10
+
+# A day is rolled up once it's been over this long, so writes that were
+# still committing at midnight are counted.
+SETTLE = timedelta(minutes=10)
+
+
+def id_range(model, day):
+    """Condition for `model` rows (or outbox events) created on `day`."""
+
+    start = datetime.combine(day, time.min)
+    return db.and_(model.id >= id_for_time(start),
+                   model.id < id_for_time(start + timedelta(days=1)))
+
+
+def outbox_actors(day, kind, key):
+    """Query for the user in `key` of each `kind` outbox event on `day`."""
+
+    return (db.select([OutboxEvent.data[key].astext.cast(db.Integer)])
+            .where(db.and_(id_range(OutboxEvent, day),
+                           OutboxEvent.kind == kind)))
+
+
+def rollup(day):
+    """Roll up `day` (a date), replacing any earlier rollup of it."""
+
+    messages, posters = (db.session
+                         .query(db.func.count(),
+                                db.func.count(Message.user_id.distinct()))
+                         .filter(id_range(Message, day))
+                         .one())
+
+    dms = (DirectMessage.query
+           .filter(id_range(DirectMessage, day))
+           .count())
+
+    events = dict(db.session
+                  .query(OutboxEvent.kind, db.func.count())
+                  .filter(id_range(OutboxEvent, day),
+                          OutboxEvent.kind.in_(['like.added',
+                                                'follow.added']))
+                  .group_by(OutboxEvent.kind))
+
+    actors = db.union(
+        db.select([Message.user_id]).where(id_range(Message, day)),
+        db.select([DirectMessage.user_from_id])
+        .where(id_range(DirectMessage, day)),
+        outbox_actors(day, 'like.added', 'user_id'),
+        outbox_actors(day, 'follow.added', 'follower_id'),
+    ).alias('actors')
+    active_users = db.session.query(db.func.count()).select_from(
+        actors).scalar()
+
+    stats = dict(day=day, messages=messages, posters=posters,
+                 active_users=active_users,
+                 likes=events.get('like.added', 0),
+                 follows=events.get('follow.added', 0), dms=dms)
+    db.session.execute(insert(DailyStats.__table__)
+                       .values(stats)
+                       .on_conflict_do_update(index_elements=['day'],
+                                              set_=stats))
+
+    DailyTopPoster.query.filter_by(day=day).delete()
+    count = db.func.count().label('messages')
+    top = (db.session
+           .query(db.literal(day, db.Date), Message.user_id, count)
+           .filter(id_range(Message, day))
+           .group_by(Message.user_id)
+           .order_by(count.desc(), Message.user_id)
+           .limit(TOP_POSTERS))
+    db.session.execute(insert(DailyTopPoster.__table__).from_select(
+        ['day', 'user_id', 'messages'], top.statement))
+
+
+def first_day():
+    """The first full day the outbox covers, or None while it's empty."""
+
+    first = db.session.query(db.func.min(OutboxEvent.id)).scalar()
+    if first is None:
+        return None
+    return time_of(first).date() + timedelta(days=1)
+
+
+def pending(now, backfill_days):
+    """The finished days not rolled up yet, oldest first.
+
+    With nothing rolled up, starts `backfill_days` before `now`, or on
+    `first_day` if that's later.
+    """
+
+    last = db.session.query(db.func.max(DailyStats.day)).scalar()
+    today = (now - SETTLE).date()
+
+    if last:
+        start = last + timedelta(days=1)
+    else:
+        start = first_day()
+        if start is None:
+            return []
+        start = max(start, today - timedelta(days=backfill_days))
+
+    return [start + timedelta(days=n) for n in range((today - start).days)]
+
+
+def dashboard(days):
+    """The last `days` rolled up days, newest first, and their top posters.
+
+    Top posters are (user id, messages) pairs, from the days' top lists.
+    """
+
+    stats = (DailyStats.query
+             .order_by(DailyStats.day.desc())
+             .limit(days)
+             .all())
+    if not stats:
+        return [], []
+
+    total = db.func.sum(DailyTopPoster.messages).label('messages')
+    top = (db.session
+           .query(DailyTopPoster.user_id, total)
+           .filter(DailyTopPoster.day >= stats[-1].day)
+           .group_by(DailyTopPoster.user_id)
+           .order_by(total.desc(), DailyTopPoster.user_id)
+           .limit(TOP_POSTERS)
+           .all())
+
+    return stats, top
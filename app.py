@@ -1,17 +1,77 @@
+import hashlib
+import hmac
 import os
+import tempfile
+import time
+from datetime import datetime, timedelta
 
+import click
 from flask import Flask, render_template, request
-from flask import flash, redirect, session, g, url_for
+from flask import flash, redirect, session, g, url_for, jsonify, abort
+from flask import send_file, Response, has_request_context
 from flask_debugtoolbar import DebugToolbarExtension
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from functools import wraps
 
+from assets import Assets, build
+from breaker import CircuitBreaker
+from cache import LRUStore, ObjectCache
+from cards import UserCards
+from exports import Exporter
+from groupcommit import GroupCommitWriter
+from ids import next_id
+from images import ImageProxy, ImageCache, ImageError, SIZES
+from images import DEFAULT_IMAGES, fetch_url, resized, sign
+from migrate import migrate
+from profiler import Profiler
 from forms import UserAddForm, LoginForm, MessageForm, UserEditForm
-from models import db, connect_db, User, Message, Likes, DirectMessage
+from models import db, connect_db, User, Message, Likes, Follows
+from models import DirectMessage, Notification, OutboxEvent, RequestProfile
+from models import DataExport
+from streaming import GzipMiddleware, stream_template
+from suggestions import FollowGraph, SuggestionEngine
+from timeline import TimelineEngine
+import analytics
+import outbox
+import tags
+from templating import BytecodeCache, preload
+from trending import Trending
 from sqlalchemy import or_, and_
 
 CURR_USER_KEY = "curr_user"
 
+# Most ids the batch like/follow endpoints will take in one request.
+MAX_BATCH_IDS = 500
+
+# Rows fetched per round trip by the streamed list pages.
+STREAM_BATCH_SIZE = 500
+
+# Messages per page of the home timeline and of a DM conversation.
+TIMELINE_PAGE_SIZE = 100
+DM_PAGE_SIZE = 50
+NOTIFICATIONS_PAGE_SIZE = 50
+FOLLOWS_PAGE_SIZE = 60
+PROFILES_PAGE_SIZE = 50
+
+# Messages indexed per transaction by `flask index-tags`.
+TAG_BACKFILL_BATCH_SIZE = 1000
+
+# Deleted messages removed per transaction by `flask purge-messages`.
+PURGE_BATCH_SIZE = 500
+
+# Days shown on the admin analytics page.
+ANALYTICS_DAYS = 30
+
+# Statement timeout for the hot read pages, which should never need long.
+READ_TIMEOUT_MS = 1000
+
+# Rows fetched per round trip by `flask export-data`, and exports listed
+# on a user's exports page.
+EXPORT_BATCH_SIZE = 1000
+EXPORTS_SHOWN = 10
+
 app = Flask(__name__)
 
 # Get DB_URI from environ variable (useful for production/testing) or,
@@ -23,12 +83,333 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+# bcrypt work factor for new password hashes (the test suite lowers it).
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+
+# The "who to follow" follow-graph index is built by `flask
+# build-follow-graph` (with --loop, every SUGGESTIONS_MAX_AGE seconds) and
+# saved at SUGGESTIONS_GRAPH_PATH, on /dev/shm where there is one, for
+# every worker on the host to map in (see suggestions.py). The Procfile
+# runs the loop beside gunicorn, as it must be on the same host. A follow
+# shows in other workers' suggestions after the next build.
+app.config['SUGGESTIONS_MAX_AGE'] = int(
+    os.environ.get('SUGGESTIONS_MAX_AGE', 300))
+app.config['SUGGESTIONS_GRAPH_PATH'] = os.environ.get(
+    'SUGGESTIONS_GRAPH_PATH',
+    os.path.join('/dev/shm' if os.path.isdir('/dev/shm')
+                 else tempfile.gettempdir(),
+                 'warbler-follow-graph-' + hashlib.sha1(
+                     app.config['SQLALCHEMY_DATABASE_URI'].encode('utf-8')
+                 ).hexdigest()[:8]))
 toolbar = DebugToolbarExtension(app)
 
+app.wsgi_app = GzipMiddleware(app.wsgi_app)
+
+# Trending warbles: likes are counted per TRENDING_BUCKET_MINUTES bucket,
+# buckets older than TRENDING_WINDOW_HOURS are ignored (and dropped by
+# `flask prune-trending`), and each bucket's weight halves every
+# TRENDING_HALF_LIFE_HOURS.
+app.config['TRENDING_WINDOW_HOURS'] = int(
+    os.environ.get('TRENDING_WINDOW_HOURS', 24))
+app.config['TRENDING_BUCKET_MINUTES'] = int(
+    os.environ.get('TRENDING_BUCKET_MINUTES', 60))
+app.config['TRENDING_HALF_LIFE_HOURS'] = int(
+    os.environ.get('TRENDING_HALF_LIFE_HOURS', 6))
+app.config['TRENDING_SIZE'] = int(os.environ.get('TRENDING_SIZE', 50))
+
+# Resized avatars and headers are cached here, up to IMAGE_CACHE_MAX_BYTES.
+# IMAGE_FETCHER (a function from URL to bytes) can replace the HTTP fetcher.
+app.config['IMAGE_CACHE_DIR'] = os.environ.get(
+    'IMAGE_CACHE_DIR', os.path.join(app.instance_path, 'image-cache'))
+app.config['IMAGE_CACHE_MAX_BYTES'] = int(
+    os.environ.get('IMAGE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+app.config['IMAGE_FETCHER'] = None
+
+# Single users and messages are cached for OBJECT_CACHE_TTL seconds, up to
+# OBJECT_CACHE_SIZE per worker. Invalidations reach every worker on the
+# host through a table of versions at OBJECT_CACHE_VERSIONS_PATH (on
+# /dev/shm where there is one). Set OBJECT_CACHE_DIR (e.g. somewhere
+# under /dev/shm) to share the cached rows between workers too.
+app.config['OBJECT_CACHE_SIZE'] = int(
+    os.environ.get('OBJECT_CACHE_SIZE', 10000))
+app.config['OBJECT_CACHE_TTL'] = int(os.environ.get('OBJECT_CACHE_TTL', 300))
+app.config['OBJECT_CACHE_DIR'] = os.environ.get('OBJECT_CACHE_DIR')
+app.config['OBJECT_CACHE_VERSIONS_PATH'] = os.environ.get(
+    'OBJECT_CACHE_VERSIONS_PATH',
+    os.path.join('/dev/shm' if os.path.isdir('/dev/shm')
+                 else tempfile.gettempdir(),
+                 'warbler-versions-' + hashlib.sha1(
+                     app.config['SQLALCHEMY_DATABASE_URI'].encode('utf-8')
+                 ).hexdigest()[:8]))
+
+# User cards (username, avatar and counts) are kept in a table in a file
+# that every worker on the host maps into memory (see cards.py), one per
+# database, on /dev/shm where there is one.
+app.config['USER_CARDS_PATH'] = os.environ.get(
+    'USER_CARDS_PATH',
+    os.path.join('/dev/shm' if os.path.isdir('/dev/shm')
+                 else tempfile.gettempdir(),
+                 'warbler-cards-' + hashlib.sha1(
+                     app.config['SQLALCHEMY_DATABASE_URI'].encode('utf-8')
+                 ).hexdigest()[:8]))
+app.config['USER_CARDS_SLOTS'] = int(os.environ.get('USER_CARDS_SLOTS', 32768))
+app.config['USER_CARDS_TTL'] = int(os.environ.get('USER_CARDS_TTL', 60))
+
+# With GROUP_COMMIT=1, new messages and DMs from concurrent requests are
+# committed together, waiting up to GROUP_COMMIT_WINDOW_MS to gather a
+# batch (see groupcommit.py).
+app.config['GROUP_COMMIT'] = os.environ.get('GROUP_COMMIT') == '1'
+app.config['GROUP_COMMIT_WINDOW_MS'] = float(
+    os.environ.get('GROUP_COMMIT_WINDOW_MS', 2))
+app.config['GROUP_COMMIT_MAX_BATCH'] = int(
+    os.environ.get('GROUP_COMMIT_MAX_BATCH', 200))
+
+# Home timelines are merged from the newest TIMELINE_BUFFER_SIZE message ids
+# of each of up to TIMELINE_MAX_AUTHORS recently needed authors, refreshed
+# from the database every TIMELINE_MAX_AGE seconds (see timeline.py).
+app.config['TIMELINE_BUFFER_SIZE'] = int(
+    os.environ.get('TIMELINE_BUFFER_SIZE', TIMELINE_PAGE_SIZE))
+app.config['TIMELINE_MAX_AUTHORS'] = int(
+    os.environ.get('TIMELINE_MAX_AUTHORS', 20000))
+app.config['TIMELINE_MAX_AGE'] = int(os.environ.get('TIMELINE_MAX_AGE', 10))
+
+# Admins can profile a request by adding ?profile=1 or an X-Profile: 1
+# header; its stack is sampled every PROFILE_INTERVAL_MS.
+app.config['PROFILE_INTERVAL_MS'] = float(
+    os.environ.get('PROFILE_INTERVAL_MS', 2))
+
+# Deleted messages stay in the database, hidden, for PURGE_AFTER_HOURS
+# before `flask purge-messages` (run off-peak) removes them.
+app.config['PURGE_AFTER_HOURS'] = int(
+    os.environ.get('PURGE_AFTER_HOURS', 24))
+
+# The first `flask rollup-analytics` rolls up this many days of history,
+# or back to when the outbox started, if that's sooner (see analytics.py).
+app.config['ANALYTICS_BACKFILL_DAYS'] = int(
+    os.environ.get('ANALYTICS_BACKFILL_DAYS', 90))
+
+# Outbox events (see outbox.py) are delivered by `flask dispatch-events`
+# (the Procfile's events process) and kept OUTBOX_RETENTION_HOURS after
+# every consumer has had them, so a consumer can be reset and rebuilt.
+app.config['OUTBOX_RETENTION_HOURS'] = int(
+    os.environ.get('OUTBOX_RETENTION_HOURS', 168))
+
+# Data exports (see exports.py) are written here by `flask export-data`
+# (the Procfile's exports process) and downloaded from here by the web
+# process, so both need it: storage they share, if they run on different
+# hosts. They're kept for EXPORT_RETENTION_HOURS.
+app.config['EXPORT_DIR'] = os.environ.get(
+    'EXPORT_DIR', os.path.join(app.instance_path, 'exports'))
+app.config['EXPORT_RETENTION_HOURS'] = int(
+    os.environ.get('EXPORT_RETENTION_HOURS', 168))
+
+# Compiled templates are kept here and shared by every worker; `flask
+# build-templates` fills it ahead of a deploy (see templating.py).
+app.config['TEMPLATE_CACHE_DIR'] = os.environ.get(
+    'TEMPLATE_CACHE_DIR', os.path.join(app.instance_path, 'template-cache'))
+
+# Requests' statements are cancelled after DB_STATEMENT_TIMEOUT_MS (routes
+# can set their own with @statement_timeout), and give up waiting for a
+# pooled connection after DB_POOL_TIMEOUT seconds. After
+# DB_BREAKER_THRESHOLD database failures in a row, requests stop trying
+# the database for DB_BREAKER_RESET_SECONDS (see breaker.py); meanwhile
+# the pages in STALE_ROUTES are served from their last good render, kept
+# for up to STALE_MAX_AGE seconds, for up to STALE_CACHE_SIZE pages.
+app.config['DB_STATEMENT_TIMEOUT_MS'] = int(
+    os.environ.get('DB_STATEMENT_TIMEOUT_MS', 5000))
+app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', 2))
+app.config['DB_BREAKER_THRESHOLD'] = int(
+    os.environ.get('DB_BREAKER_THRESHOLD', 5))
+app.config['DB_BREAKER_RESET_SECONDS'] = int(
+    os.environ.get('DB_BREAKER_RESET_SECONDS', 10))
+app.config['STALE_MAX_AGE'] = int(os.environ.get('STALE_MAX_AGE', 3600))
+app.config['STALE_CACHE_SIZE'] = int(os.environ.get('STALE_CACHE_SIZE', 1000))
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_timeout': app.config['DB_POOL_TIMEOUT'],
+    'connect_args': {
+        'connect_timeout': max(1, round(app.config['DB_POOL_TIMEOUT'])),
+    },
+}
+
 connect_db(app)
 
 db.create_all()
 
+suggestion_engine = SuggestionEngine(app.config['SUGGESTIONS_GRAPH_PATH'])
+
+image_proxy_cache = ImageCache(app.config['IMAGE_CACHE_DIR'],
+                               app.config['IMAGE_CACHE_MAX_BYTES'])
+
+app.jinja_env.bytecode_cache = BytecodeCache(app.config['TEMPLATE_CACHE_DIR'])
+
+exporter = Exporter(app.config['EXPORT_DIR'],
+                    batch_size=EXPORT_BATCH_SIZE,
+                    retention_hours=app.config['EXPORT_RETENTION_HOURS'])
+
+app.add_template_global(resized)
+
+assets = Assets(app.static_folder)
+app.add_template_global(assets.url, 'asset_url')
+
+trending = Trending(
+    window_hours=app.config['TRENDING_WINDOW_HOURS'],
+    bucket_minutes=app.config['TRENDING_BUCKET_MINUTES'],
+    half_life_hours=app.config['TRENDING_HALF_LIFE_HOURS'],
+    size=app.config['TRENDING_SIZE'])
+
+object_cache = ObjectCache(db.session,
+                           max_entries=app.config['OBJECT_CACHE_SIZE'],
+                           ttl=app.config['OBJECT_CACHE_TTL'],
+                           shared_dir=app.config['OBJECT_CACHE_DIR'],
+                           versions_path=app.config[
+                               'OBJECT_CACHE_VERSIONS_PATH'])
+
+
+def cached_user(user_id):
+    """User `user_id` (with their profile columns) from the cache, or None."""
+
+    return object_cache.get(User, user_id, groups=('profile',))
+
+
+def cached_message(message_id):
+    """Message `message_id` from the cache, or None."""
+
+    return object_cache.get(Message, message_id)
+
+
+user_cards = UserCards(app.config['USER_CARDS_PATH'],
+                       slots=app.config['USER_CARDS_SLOTS'],
+                       ttl=app.config['USER_CARDS_TTL'])
+
+# Templates call user_card(msg.user_id) rather than using msg.user; routes
+# that render many messages fetch their authors' cards up front with
+# user_cards.get_many, so the template's calls are all hits.
+app.add_template_global(user_cards.get, 'user_card')
+
+timelines = TimelineEngine(buffer_size=app.config['TIMELINE_BUFFER_SIZE'],
+                           max_authors=app.config['TIMELINE_MAX_AUTHORS'],
+                           max_age=app.config['TIMELINE_MAX_AGE'])
+
+db_breaker = CircuitBreaker(
+    threshold=app.config['DB_BREAKER_THRESHOLD'],
+    reset_after=app.config['DB_BREAKER_RESET_SECONDS'])
+
+# Routes that hardly ever touch the database, and so never need refusing.
+NO_DATABASE_ROUTES = {'static', 'static_asset', 'image_proxy'}
+
+# Read pages served from their last good render while the database is down.
+STALE_ROUTES = {'homepage', 'users_show', 'messages_show'}
+stale_pages = LRUStore(app.config['STALE_CACHE_SIZE'])
+
+
+@event.listens_for(db.engine, 'after_cursor_execute')
+def database_used(conn, cursor, statement, parameters, context,
+                  executemany):
+    # The breaker hears how the request went as a whole, in
+    # database_worked; setting the timeout proves nothing either way.
+    if (has_request_context() and
+            not context.execution_options.get('breaker_ignore')):
+        g.database_used = True
+
+
+@event.listens_for(db.engine, 'handle_error')
+def database_failed(context):
+    # Timeouts and lost connections, not e.g. constraint violations.
+    if isinstance(context.sqlalchemy_exception, OperationalError):
+        db_breaker.failure()
+        if has_request_context():
+            g.database_failed = True
+
+
+@event.listens_for(db.session, 'after_begin')
+def set_statement_timeout(session, transaction, connection):
+    """Apply the request's statement timeout to each transaction."""
+
+    if has_request_context():
+        ms = g.get('statement_timeout', app.config['DB_STATEMENT_TIMEOUT_MS'])
+        connection.execution_options(breaker_ignore=True).execute(
+            f"SET LOCAL statement_timeout = {int(ms)}")
+
+
+def statement_timeout(ms):
+    """Decorator giving a route its own statement timeout."""
+
+    def decorator(f):
+        f.statement_timeout = ms
+        return f
+    return decorator
+
+
+def stale_key():
+    """Cache key for this page as this user sees it."""
+
+    return f"{session.get(CURR_USER_KEY)}:{request.full_path}"
+
+
+def database_unavailable():
+    """The response to give while the database can't be used.
+
+    The last good render of a read page if there is one, marked stale
+    with a Warning header; otherwise a 503.
+    """
+
+    if request.method == 'GET' and request.endpoint in STALE_ROUTES:
+        page = stale_pages.get(stale_key())
+        if page is not None:
+            body, mimetype, rendered_at = page
+            response = Response(body, mimetype=mimetype)
+            response.headers['Warning'] = '110 - "Response is Stale"'
+            response.headers['Age'] = str(int(time.time() - rendered_at))
+            return response
+
+    response = Response("The database is unavailable. Try again shortly.",
+                        status=503, mimetype='text/plain')
+    response.retry_after = app.config['DB_BREAKER_RESET_SECONDS']
+    return response
+
+
+group_commit = GroupCommitWriter(
+    app,
+    window=app.config['GROUP_COMMIT_WINDOW_MS'] / 1000,
+    max_batch=app.config['GROUP_COMMIT_MAX_BATCH'])
+
+
+##############################################################################
+# Database failures
+
+
+@app.before_request
+def check_database():
+    """Skip the database entirely while the breaker is open."""
+
+    view = app.view_functions.get(request.endpoint)
+    g.statement_timeout = getattr(view, 'statement_timeout',
+                                  app.config['DB_STATEMENT_TIMEOUT_MS'])
+
+    if request.endpoint not in NO_DATABASE_ROUTES and not db_breaker.allow():
+        return database_unavailable()
+
+
+@app.errorhandler(OperationalError)
+@app.errorhandler(PoolTimeoutError)
+def database_error(exc):
+    """Answer for a request the database timed out or failed on."""
+
+    # Statement errors are counted by database_failed.
+    if isinstance(exc, PoolTimeoutError):
+        db_breaker.failure()
+        g.database_failed = True
+    db.session.rollback()
+    return database_unavailable()
+
+
+@app.teardown_request
+def database_worked(exc):
+    """Close the breaker after a request whose queries all worked."""
+
+    if g.get('database_used') and not g.get('database_failed'):
+        db_breaker.success()
+
 
 ##############################################################################
 # User signup/login/logout
@@ -39,12 +420,50 @@ def add_user_to_g():
     """If we're logged in, add curr user to Flask global."""
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = cached_user(session[CURR_USER_KEY])
 
     else:
         g.user = None
 
 
+@app.before_request
+def start_profiling():
+    """Profile this request if an admin asked for it."""
+
+    if (g.user and g.user.admin and
+            (request.args.get('profile') or request.headers.get('X-Profile'))):
+        g.profile_id = next_id()
+        g.profiler = Profiler(
+            interval=app.config['PROFILE_INTERVAL_MS'] / 1000).start()
+
+
+@app.teardown_request
+def save_profile(exc):
+    """Store the profile of this request, if there is one."""
+
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return
+
+    profiler.stop()
+    # Whatever the request left uncommitted is discarded anyway.
+    db.session.rollback()
+    db.session.add(RequestProfile(
+        id=g.profile_id,
+        user_id=g.user.id,
+        method=request.method,
+        path=request.full_path.rstrip('?'),
+        status=g.get('profile_status', 500 if exc else None),
+        duration_ms=profiler.duration * 1000,
+        db_ms=profiler.seconds('db') * 1000,
+        template_ms=profiler.seconds('template') * 1000,
+        python_ms=profiler.seconds('python') * 1000,
+        samples=profiler.samples,
+        collapsed=profiler.collapsed(),
+    ))
+    db.session.commit()
+
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -93,6 +512,7 @@ def signup():
             db.session.commit()
 
         except IntegrityError:
+            db.session.rollback()
             flash("Username already taken", 'danger')
             return render_template('users/signup.html', form=form)
 
@@ -148,19 +568,22 @@ def list_users():
 
     search = request.args.get('q')
 
-    if not search:
-        users = User.query.all()
-    else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+    users = User.cards(g.user and g.user.id).order_by(User.id)
+    if search:
+        users = users.filter(User.username.like(f"%{search}%"))
 
-    return render_template('users/index.html', users=users)
+    return stream_template('users/index.html',
+                           users=users.yield_per(STREAM_BATCH_SIZE))
 
 
 @app.route('/users/<int:user_id>')
+@statement_timeout(READ_TIMEOUT_MS)
 def users_show(user_id):
     """Show user profile."""
 
-    user = User.query.get_or_404(user_id)
+    user = cached_user(user_id)
+    if user is None:
+        abort(404)
 
     return render_template('users/show.html', user=user)
 
@@ -176,13 +599,44 @@ def show_likes(user_id):
                            user=user, messages=messages)
 
 
+def follows_page(user_id, followers):
+    """The user and one page of who they follow (or their followers).
+
+    The page is a list of card rows with followed_at and viewer_follows
+    (whether the current user follows them) columns, and the cursor for
+    the next page is None on the last one.
+    """
+
+    user = cached_user(user_id)
+    if user is None:
+        abort(404)
+
+    # The previous page's cursor: "<followed_at>_<user id>".
+    before = request.args.get('before')
+    if before:
+        try:
+            followed_at, id = before.rsplit('_', 1)
+            before = (datetime.fromisoformat(followed_at), int(id))
+        except ValueError:
+            abort(400)
+
+    rows = Follows.page(user_id, g.user.id, followers=followers,
+                        before=before, limit=FOLLOWS_PAGE_SIZE)
+    older = (f"{rows[-1].followed_at.isoformat()}_{rows[-1].id}"
+             if len(rows) == FOLLOWS_PAGE_SIZE else None)
+
+    return user, rows, older
+
+
 @app.route('/users/<int:user_id>/following')
 @login_required
 def show_following(user_id):
     """Show list of people this user is following."""
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    user, followed_users, older = follows_page(user_id, followers=False)
+
+    return render_template('users/following.html', user=user,
+                           followed_users=followed_users, older=older)
 
 
 @app.route('/users/<int:user_id>/followers')
@@ -190,8 +644,10 @@ def show_following(user_id):
 def users_followers(user_id):
     """Show list of followers of this user."""
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    user, followers, older = follows_page(user_id, followers=True)
+
+    return render_template('users/followers.html', user=user,
+                           followers=followers, older=older)
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -199,9 +655,16 @@ def users_followers(user_id):
 def add_follow(follow_id):
     """Add a follow for the currently-logged-in user."""
 
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
+    followed = Follows.follow(g.user.id, [follow_id])
+    notified = notify_followed(followed)
     db.session.commit()
+    invalidate_users(notified)
+    user_cards.invalidate([g.user.id, *followed])
+
+    if followed:
+        suggestion_engine.follow_added(g.user.id, follow_id)
+    else:
+        flash("You can't follow that user.", "warning")
 
     return redirect(url_for('show_following', user_id=g.user.id))
 
@@ -211,13 +674,28 @@ def add_follow(follow_id):
 def stop_following(follow_id):
     """Have currently-logged-in-user stop following this user."""
 
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
+    unfollowed = Follows.unfollow(g.user.id, [follow_id])
     db.session.commit()
+    user_cards.invalidate([g.user.id, *unfollowed])
+
+    if unfollowed:
+        suggestion_engine.follow_removed(g.user.id, follow_id)
+    else:
+        flash("You weren't following that user.", "warning")
 
     return redirect(url_for('show_following', user_id=g.user.id))
 
 
+def who_to_follow(limit=5):
+    """Return (user, mutual follows) pairs suggested for the current user."""
+
+    suggested = suggestion_engine.suggest(g.user.id, limit)
+    users = User.query.filter(User.id.in_([id for id, _ in suggested])).all()
+    users = {user.id: user for user in users}
+
+    return [(users[id], mutual) for id, mutual in suggested if id in users]
+
+
 @app.route('/users/profile', methods=["GET", "POST"])
 @login_required
 def profile():
@@ -239,19 +717,71 @@ def profile():
         user.bio = form.bio.data
 
         db.session.commit()
+        object_cache.invalidate(User, user.id)
+        user_cards.invalidate([user.id])
         return redirect(url_for('users_show', user_id=g.user.id))
 
     return render_template("users/edit.html", form=form)
 
 
+@app.route('/users/<int:user_id>/exports', methods=["GET", "POST"])
+@login_required
+def user_exports(user_id):
+    """List a user's data exports; POST asks for a new one."""
+
+    if g.user.id != user_id and not g.user.admin:
+        flash("unauthorized access", "danger")
+        return redirect(url_for('homepage'))
+
+    user = cached_user(user_id)
+    if user is None:
+        abort(404)
+
+    exports = DataExport.query.filter_by(user_id=user_id)
+
+    if request.method == 'POST':
+        # One at a time: another would only repeat the same work.
+        if not exports.filter(
+                DataExport.status.in_(['pending', 'running'])).count():
+            db.session.add(DataExport(user_id=user_id,
+                                      requested_by=g.user.id))
+            db.session.commit()
+        flash("Your export is being prepared.", "success")
+        return redirect(url_for('user_exports', user_id=user_id))
+
+    exports = exports.order_by(DataExport.id.desc()).limit(EXPORTS_SHOWN)
+    return render_template('users/exports.html', user=user,
+                           exports=exports.all())
+
+
+@app.route('/exports/<int:export_id>')
+@login_required
+def download_export(export_id):
+    """Download a finished data export."""
+
+    export = DataExport.query.get_or_404(export_id)
+    if g.user.id != export.user_id and not g.user.admin:
+        abort(404)
+    if export.status != 'done':
+        abort(404)
+
+    name = f"warbler-{export.user_id}-{export.created_at:%Y%m%d}.zip"
+    return send_file(exporter.path(export.id), mimetype='application/zip',
+                     as_attachment=True, attachment_filename=name,
+                     conditional=True)
+
+
 @app.route('/users/delete', methods=["POST"])
 def delete_user():
     """Delete user."""
 
     do_logout()
 
-    db.session.delete(g.user)
+    user_id = g.user.id
+    User.delete(user_id)
     db.session.commit()
+    object_cache.invalidate(User, user_id)
+    user_cards.invalidate([user_id])
     flash("Account Successfully Deleted", "success")
 
     return redirect(url_for('homepage'))
@@ -271,9 +801,19 @@ def messages_add():
     form = MessageForm()
 
     if form.validate_on_submit():
-        msg = Message(text=form.text.data)
-        g.user.messages.append(msg)
-        db.session.commit()
+        if app.config['GROUP_COMMIT']:
+            msg_id = group_commit.post_message(g.user.id, form.text.data)
+        else:
+            msg = Message(text=form.text.data)
+            g.user.messages.append(msg)
+            db.session.flush()
+            tags.index([(msg.id, msg.text)])
+            OutboxEvent.emit('message.created',
+                             [{"id": msg.id, "user_id": msg.user_id}])
+            db.session.commit()
+            msg_id = msg.id
+        user_cards.invalidate([g.user.id])
+        timelines.add(g.user.id, msg_id)
 
         return redirect(url_for('users_show', user_id=g.user.id))
 
@@ -281,10 +821,16 @@ def messages_add():
 
 
 @app.route('/messages/<int:message_id>', methods=["GET"])
+@statement_timeout(READ_TIMEOUT_MS)
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get(message_id)
+    msg = cached_message(message_id)
+    # Also puts the author in the session, so msg.user needs no query.
+    if (msg is None or msg.deleted_at is not None or
+            cached_user(msg.user_id) is None):
+        abort(404)
+
     return render_template('messages/show.html', message=msg)
 
 
@@ -293,9 +839,13 @@ def messages_show(message_id):
 def messages_destroy(message_id):
     """Delete a message."""
 
-    msg = Message.query.get(message_id)
-    db.session.delete(msg)
+    author_id = Message.soft_delete(message_id)
+    if author_id is None:
+        abort(404)
     db.session.commit()
+    object_cache.invalidate(Message, message_id)
+    user_cards.invalidate([author_id])
+    timelines.remove(author_id, message_id)
 
     return redirect(url_for('users_show', user_id=g.user.id))
 
@@ -305,31 +855,176 @@ def messages_destroy(message_id):
 def messages_like(message_id):
     """Likes a message."""
 
-    msg = Message.query.get_or_404(message_id)
-    if msg.user_id != g.user.id:
-        g.user.liked_messages.append(msg)
-
-        db.session.commit()
-
-    route = request.referrer
+    liked = Likes.like(g.user.id, [message_id])
+    trending.record(liked)
+    notified = notify_liked(liked)
+    db.session.commit()
+    invalidate_users(notified)
+    user_cards.invalidate([g.user.id])
 
-    return redirect(f'{route}')
+    return redirect(request.referrer or url_for('homepage'))
 
 
 @app.route('/messages/<int:message_id>/unlike', methods=["POST"])
 @login_required
 def messages_unlike(message_id):
-    """Likes a message."""
+    """Unlikes a message."""
+
+    trending.record(Likes.unlike(g.user.id, [message_id]), delta=-1)
+    db.session.commit()
+    user_cards.invalidate([g.user.id])
 
-    msg = Message.query.get_or_404(message_id)
-    if msg.user_id != g.user.id:
-        g.user.liked_messages.remove(msg)
+    return redirect(request.referrer or url_for('homepage'))
 
+
+def liked_message_ids(messages):
+    """Ids of the given messages that the current user has liked."""
+
+    ids = [msg.id for msg in messages]
+    if not g.user or not ids:
+        return set()
+
+    return {id for id, in db.session
+            .query(Likes.message_id)
+            .filter(Likes.user_id == g.user.id, Likes.message_id.in_(ids))}
+
+
+def trending_messages(limit=None):
+    """Return (message, score) pairs for the top trending messages."""
+
+    scores = trending.top(limit)
+    messages = (Message
+                .query
+                .filter(Message.id.in_([id for id, _ in scores]),
+                        Message.deleted_at.is_(None))
+                .all())
+    user_cards.get_many(msg.user_id for msg in messages)
+    messages = {msg.id: msg for msg in messages}
+
+    return [(messages[id], score) for id, score in scores if id in messages]
+
+
+@app.route('/messages/trending')
+def messages_trending():
+    """Show the messages getting the most likes lately."""
+
+    top = trending_messages()
+
+    return render_template('messages/trending.html', trending=top,
+                           liked=liked_message_ids([msg for msg, _ in top]))
+
+
+def message_feed(title, messages):
+    """Render one page of `messages`, a newest-first feed query."""
+
+    messages = messages.limit(TIMELINE_PAGE_SIZE).all()
+    older = messages[-1].id if len(messages) == TIMELINE_PAGE_SIZE else None
+    user_cards.get_many(msg.user_id for msg in messages)
+
+    return render_template('messages/feed.html', title=title,
+                           messages=messages, older=older,
+                           liked=liked_message_ids(messages))
+
+
+@app.route('/tags/<tag>')
+def messages_tagged(tag):
+    """Show messages with hashtag `tag`, newest first."""
+
+    before = request.args.get('before', type=int)
+
+    return message_feed(f"#{tag.lower()}", tags.tagged(tag, before))
+
+
+@app.route('/users/<int:user_id>/mentions')
+def users_mentions(user_id):
+    """Show messages that @mention this user, newest first."""
+
+    user = cached_user(user_id)
+    if user is None:
+        abort(404)
+    before = request.args.get('before', type=int)
+
+    return message_feed(f"Mentioning @{user.username}",
+                        tags.mentioning(user_id, before))
+
+
+@app.cli.command('index-tags')
+def index_tags():
+    """Index the hashtags and mentions of every existing message."""
+
+    last_id = 0
+    indexed = 0
+    while True:
+        batch = (db.session
+                 .query(Message.id, Message.text)
+                 .filter(Message.id > last_id)
+                 .order_by(Message.id)
+                 .limit(TAG_BACKFILL_BATCH_SIZE)
+                 .all())
+        if not batch:
+            break
+
+        tags.index(batch)
         db.session.commit()
 
-    route = request.referrer
+        last_id = batch[-1].id
+        indexed += len(batch)
+
+    print(f"Indexed {indexed} messages.")
+
+
+@app.cli.command('purge-messages')
+def purge_messages():
+    """Remove messages deleted more than PURGE_AFTER_HOURS ago.
+
+    Goes in batches of PURGE_BATCH_SIZE, one transaction each, so it
+    never holds many locks at once. Schedule it for quiet hours.
+    """
+
+    deleted_before = (datetime.utcnow() -
+                      timedelta(hours=app.config['PURGE_AFTER_HOURS']))
+    purged = 0
+    while True:
+        ids = Message.purge(deleted_before, PURGE_BATCH_SIZE)
+        db.session.commit()
+        if not ids:
+            break
+        purged += len(ids)
+
+    print(f"Purged {purged} messages.")
+
+
+@app.cli.command('prune-trending')
+def prune_trending():
+    """Delete trending like counts older than TRENDING_WINDOW_HOURS.
+
+    Lookups already ignore them; this just keeps the table small.
+    Schedule it at least every TRENDING_BUCKET_MINUTES.
+    """
+
+    pruned = trending.prune()
+    db.session.commit()
+
+    print(f"Pruned {pruned} trending buckets.")
+
+
+@app.route('/api/messages/trending')
+def api_messages_trending():
+    """The messages getting the most likes lately, as JSON."""
 
-    return redirect(f'{route}')
+    limit = request.args.get('limit', type=int)
+
+    return jsonify(trending=[
+        {
+            # Message ids need 64 bits, more than JavaScript numbers hold.
+            "id": str(msg.id),
+            "text": msg.text,
+            "user_id": msg.user_id,
+            "timestamp": msg.timestamp.isoformat(),
+            "score": round(score, 3),
+        }
+        for msg, score in trending_messages(limit)
+    ])
 
 
 @app.route('/direct_messages', methods=["GET"])
@@ -348,7 +1043,7 @@ def direct_message():
         else:
             dm_list.append(msg.user_to_id)
 
-    users = User.query.filter(User.id.in_(dm_list)).all()
+    users = User.cards().filter(User.id.in_(dm_list)).all()
 
     return render_template("direct_messages/all_dms.html", dm_list=users, user=g.user)
 
@@ -360,6 +1055,18 @@ def direct_messages(other_user_id):
 
     form = MessageForm()
 
+    if form.validate_on_submit():
+        if app.config['GROUP_COMMIT']:
+            group_commit.send_dm(g.user.id, other_user_id, form.text.data)
+        else:
+            g.user.send_dm(other_user=other_user_id, msg=form.text.data)
+            db.session.commit()
+        invalidate_users([other_user_id])
+
+        route = request.referrer
+
+        return redirect(f'{route}')
+
     msgs = DirectMessage.query.filter(
         or_(
         (and_(
@@ -368,49 +1075,359 @@ def direct_messages(other_user_id):
         (and_(
            DirectMessage.user_to_id == other_user_id,
            DirectMessage.user_from_id == g.user.id))
-    )).order_by(DirectMessage.timestamp.desc()).all()
-
-    if form.validate_on_submit():
-        new_dm = g.user.send_dm(other_user=other_user_id, msg=form.text.data)
-        db.session.commit()
+    ))
 
-        route = request.referrer
+    before = request.args.get('before', type=int)
+    if before:
+        msgs = msgs.filter(DirectMessage.id < before)
 
-        return redirect(f'{route}')
+    msgs = msgs.order_by(DirectMessage.id.desc()).limit(DM_PAGE_SIZE).all()
 
+    mark_read(['dm'], actor_id=other_user_id)
 
     return render_template(
         "direct_messages/show_dm.html",
         messages=msgs,
+        older=msgs[-1].id if len(msgs) == DM_PAGE_SIZE else None,
         form=form,
         user=g.user
     )
+
+##############################################################################
+# Notifications:
+#
+# Notifications are written in the same transaction as the DM, like or
+# follow, along with the recipient's unread counter. The counters are
+# columns on users, so the navbar badges come from the cached g.user; the
+# recipients' cache entries are invalidated once the change is committed.
+
+
+def notify_liked(message_ids):
+    """Notify the authors of newly liked messages. Returns who was notified."""
+
+    if not message_ids:
+        return []
+
+    return Notification.notify(
+        'like', g.user.id,
+        db.select([Message.user_id, Message.id])
+        .where(Message.id.in_(message_ids)))
+
+
+def notify_followed(user_ids):
+    """Notify newly followed users. Returns who was notified."""
+
+    if not user_ids:
+        return []
+
+    return Notification.notify(
+        'follow', g.user.id,
+        db.select([User.id, db.cast(db.null(), db.BigInteger)])
+        .where(User.id.in_(user_ids)))
+
+
+def invalidate_users(user_ids):
+    """Drop cached copies of users whose columns (e.g. counters) changed."""
+
+    for user_id in user_ids:
+        object_cache.invalidate(User, user_id)
+
+
+def mark_read(kinds, actor_id=None):
+    """Mark the current user's unread notifications of `kinds` read."""
+
+    if Notification.mark_read(g.user.id, kinds, actor_id):
+        db.session.commit()
+        invalidate_users([g.user.id])
+        # The badges on this page should already show them as read.
+        db.session.expire(g.user, ['unread_dms', 'unread_notifications'])
+
+
+@app.route('/notifications')
+@login_required
+def notifications():
+    """Show the current user's likes and follows, newest first.
+
+    Marks them all read.
+    """
+
+    shown = (Notification
+             .query
+             .options(db.joinedload(Notification.actor)
+                      .load_only('id', 'username', 'image_url'),
+                      db.joinedload(Notification.message)
+                      .load_only('id', 'text'))
+             .filter(Notification.user_id == g.user.id,
+                     Notification.kind != 'dm'))
+
+    before = request.args.get('before', type=int)
+    if before:
+        shown = shown.filter(Notification.id < before)
+
+    shown = (shown
+             .order_by(Notification.id.desc())
+             .limit(NOTIFICATIONS_PAGE_SIZE)
+             .all())
+    older = shown[-1].id if len(shown) == NOTIFICATIONS_PAGE_SIZE else None
+
+    mark_read(['like', 'follow'])
+
+    return render_template('users/notifications.html',
+                           notifications=shown, older=older)
+
+
+##############################################################################
+# Batch API:
+#
+# Each endpoint takes {"ids": [...]} as JSON (or repeated `ids` form fields)
+# and answers with how many rows actually changed.
+
+
+def requested_ids():
+    """Return the list of integer ids posted to a batch endpoint."""
+
+    data = request.get_json(silent=True)
+    ids = data.get('ids') if isinstance(data, dict) else request.form.getlist('ids')
+
+    if not isinstance(ids, list) or len(ids) > MAX_BATCH_IDS:
+        abort(400)
+
+    try:
+        return [int(id) for id in ids]
+    except (TypeError, ValueError):
+        abort(400)
+
+
+@app.route('/api/messages/like', methods=["POST"])
+@login_required
+def api_messages_like():
+    """Like many messages at once."""
+
+    liked = Likes.like(g.user.id, requested_ids())
+    trending.record(liked)
+    notified = notify_liked(liked)
+    db.session.commit()
+    invalidate_users(notified)
+    user_cards.invalidate([g.user.id])
+
+    return jsonify(liked=len(liked))
+
+
+@app.route('/api/messages/unlike', methods=["POST"])
+@login_required
+def api_messages_unlike():
+    """Unlike many messages at once."""
+
+    unliked = Likes.unlike(g.user.id, requested_ids())
+    trending.record(unliked, delta=-1)
+    db.session.commit()
+    user_cards.invalidate([g.user.id])
+
+    return jsonify(unliked=len(unliked))
+
+
+@app.route('/api/users/follow', methods=["POST"])
+@login_required
+def api_add_follows():
+    """Follow many users at once."""
+
+    followed = Follows.follow(g.user.id, requested_ids())
+    notified = notify_followed(followed)
+    db.session.commit()
+    invalidate_users(notified)
+    user_cards.invalidate([g.user.id, *followed])
+
+    for user_id in followed:
+        suggestion_engine.follow_added(g.user.id, user_id)
+
+    return jsonify(followed=len(followed))
+
+
+@app.route('/api/users/stop-following', methods=["POST"])
+@login_required
+def api_stop_following():
+    """Stop following many users at once."""
+
+    unfollowed = Follows.unfollow(g.user.id, requested_ids())
+    db.session.commit()
+    user_cards.invalidate([g.user.id, *unfollowed])
+
+    for user_id in unfollowed:
+        suggestion_engine.follow_removed(g.user.id, user_id)
+
+    return jsonify(unfollowed=len(unfollowed))
+
+
+@app.route('/api/users/suggestions')
+@login_required
+def api_suggestions():
+    """Users the current user might want to follow."""
+
+    return jsonify(suggestions=[
+        {
+            "id": user.id,
+            "username": user.username,
+            "image_url": user.image_url,
+            "mutual_follows": mutual,
+        }
+        for user, mutual in who_to_follow(limit=10)
+    ])
+
+
 ##############################################################################
 # Homepage and error pages
 
 
 @app.route('/')
+@statement_timeout(READ_TIMEOUT_MS)
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: 100 most recent messages of followed_users, or the 100
+      before message id `before` if given
     """
 
     if g.user:
-        following = [user_being_followed.id for user_being_followed in g.user.following]
+        following = [id for id, in db.session
+                     .query(Follows.user_being_followed_id)
+                     .filter(Follows.user_following_id == g.user.id)]
         following.append(g.user.id)
+
+        page = timelines.timeline(following,
+                                  before=request.args.get('before', type=int),
+                                  limit=TIMELINE_PAGE_SIZE)
         messages = (Message
                     .query
-                    .filter(Message.user_id.in_(following))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
+                    .filter(Message.id.in_([id for id, _ in page]),
+                            Message.deleted_at.is_(None))
+                    .order_by(Message.id.desc())
                     .all())
+        # Messages deleted by another worker may still be buffered.
+        found = {msg.id for msg in messages}
+        for id, author_id in page:
+            if id not in found:
+                timelines.remove(author_id, id)
+
+        older = page[-1][0] if len(page) == TIMELINE_PAGE_SIZE else None
+        user_cards.get_many([g.user.id] + [msg.user_id for msg in messages])
 
-        return render_template('home.html', messages=messages)
+        return render_template('home.html', messages=messages, older=older,
+                               liked=liked_message_ids(messages),
+                               suggestions=who_to_follow())
 
     else:
         return render_template('home-anon.html')
+##############################################################################
+# Images and static assets
+
+
+@app.route('/images/<size>')
+def image_proxy(size):
+    """Serve a user's image shrunk to one of the template sizes.
+
+    If the original can't be fetched, serves the default image briefly
+    instead, so a broken link gets retried later.
+    """
+
+    url = request.args.get('url', '')
+    if (size not in SIZES or not url or
+            not hmac.compare_digest(request.args.get('sig', ''), sign(url))):
+        abort(404)
+
+    proxy = ImageProxy(image_proxy_cache,
+                       fetcher=app.config['IMAGE_FETCHER'] or fetch_url,
+                       static_folder=app.static_folder)
+    max_age = 365 * 24 * 60 * 60
+
+    try:
+        path, mimetype = proxy.get(url, size)
+    except ImageError:
+        path, mimetype = proxy.get(DEFAULT_IMAGES[size.split('-')[0]], size)
+        max_age = 5 * 60
+
+    response = send_file(path, mimetype=mimetype, conditional=True)
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    response.cache_control.immutable = max_age > 5 * 60
+    return response
+
+
+@app.route('/static/dist/<path:filename>')
+def static_asset(filename):
+    """Serve a fingerprinted static file; see assets.py."""
+
+    return assets.send(filename)
+
+
+@app.cli.command('build-assets')
+def build_assets():
+    """Fingerprint and precompress static files into static/dist/."""
+
+    manifest = build(app.static_folder)
+    assets.load()
+    print(f"Built {len(manifest)} assets.")
+
+
+@app.cli.command('build-templates')
+def build_templates():
+    """Compile every template into the template cache directory."""
+
+    print(f"Compiled {preload(app.jinja_env)} templates.")
+
+
+@app.cli.command('dispatch-events')
+def dispatch_events():
+    """Send outbox events to their consumers as they're committed."""
+
+    outbox.Dispatcher(
+        retention_hours=app.config['OUTBOX_RETENTION_HOURS']).run()
+
+
+@app.cli.command('reset-consumer')
+@click.argument('name')
+def reset_consumer(name):
+    """Have outbox consumer NAME start again from the oldest event."""
+
+    outbox.reset(name)
+    print(f"Reset {name}.")
+
+
+@app.cli.command('export-data')
+def export_data():
+    """Make the data exports users have asked for, as they're asked."""
+
+    exporter.run()
+
+
+@app.cli.command('build-follow-graph')
+@click.option('--loop', is_flag=True,
+              help="Rebuild every SUGGESTIONS_MAX_AGE seconds, forever.")
+@click.option('--wait', is_flag=True,
+              help="Wait SUGGESTIONS_MAX_AGE seconds before the first build.")
+def build_follow_graph(loop, wait):
+    """Build the follow-graph index for "who to follow" suggestions."""
+
+    if wait:
+        time.sleep(app.config['SUGGESTIONS_MAX_AGE'])
+    while True:
+        graph = FollowGraph.load()
+        db.session.rollback()
+        graph.save(app.config['SUGGESTIONS_GRAPH_PATH'])
+        print(f"Built the follow graph: {len(graph):,} follows.")
+        if not loop:
+            break
+        time.sleep(app.config['SUGGESTIONS_MAX_AGE'])
+
+
+@app.cli.command('migrate')
+def migrate_db():
+    """Apply the SQL files in migrations/ not yet applied to the database."""
+
+    for name in migrate(db.engine):
+        print(f"Applied {name}.")
+
+
 ##############################################################################
 # Admin Pages
 
@@ -422,9 +1439,69 @@ def admin():
         flash("You're not an admin!", "danger")
         return redirect('/')
 
-    users = User.query.all()
+    users = User.cards().order_by(User.id).yield_per(STREAM_BATCH_SIZE)
+
+    return stream_template('admin/all_users.html', users=users)
+
+
+@app.route('/admin/analytics')
+def admin_analytics():
+    """ daily activity, from the rollups """
+    if not g.user.admin:
+        flash("You're not an admin!", "danger")
+        return redirect('/')
+
+    days, top = analytics.dashboard(ANALYTICS_DAYS)
+    user_cards.get_many(user_id for user_id, _ in top)
+    return render_template('admin/analytics.html', days=days, top=top)
+
+
+@app.cli.command('rollup-analytics')
+def rollup_analytics():
+    """Roll up every finished day since the last one, for /admin/analytics."""
+
+    for day in analytics.pending(datetime.utcnow(),
+                                 app.config['ANALYTICS_BACKFILL_DAYS']):
+        analytics.rollup(day)
+        db.session.commit()
+        print(f"Rolled up {day}.")
 
-    return render_template('admin/all_users.html', users=users)
+
+@app.route('/admin/profiles')
+def admin_profiles():
+    """ list recent request profiles """
+    if not g.user.admin:
+        flash("You're not an admin!", "danger")
+        return redirect('/')
+
+    profiles = (RequestProfile
+                .query
+                .order_by(RequestProfile.id.desc())
+                .limit(PROFILES_PAGE_SIZE)
+                .all())
+    return render_template('admin/profiles.html', profiles=profiles)
+
+
+@app.route('/admin/profiles/<int:profile_id>')
+def admin_show_profile(profile_id):
+    """ show one request profile """
+    if not g.user.admin:
+        flash("You're not an admin!", "danger")
+        return redirect('/')
+
+    profile = RequestProfile.query.get_or_404(profile_id)
+    return render_template('admin/profile.html', profile=profile)
+
+
+@app.route('/admin/profiles/<int:profile_id>/collapsed')
+def admin_profile_collapsed(profile_id):
+    """ a profile's collapsed stacks, for flamegraph.pl or speedscope """
+    if not g.user.admin:
+        flash("You're not an admin!", "danger")
+        return redirect('/')
+
+    profile = RequestProfile.query.get_or_404(profile_id)
+    return Response(profile.collapsed + '\n', mimetype='text/plain')
 
 
 @app.route('/admin/users/<int:user_id>')
@@ -462,6 +1539,8 @@ def admin_edit_user(user_id):
     if form.validate_on_submit():
         form.populate_obj(user_to_edit)
         db.session.commit()
+        object_cache.invalidate(User, user_id)
+        user_cards.invalidate([user_id])
         return redirect(url_for('admin_show_user', user_id=user_to_edit.id))
 
     return render_template('admin/edit_user.html', user=user_to_edit, form=form)
@@ -473,9 +1552,11 @@ def admin_delete_user(user_id):
     if not g.user.admin:
         return redirect('/')
 
-    user_to_delete = User.query.get_or_404(user_id)
-    db.session.delete(user_to_delete)
+    if not User.delete(user_id):
+        abort(404)
     db.session.commit()
+    object_cache.invalidate(User, user_id)
+    user_cards.invalidate([user_id])
     return redirect(url_for('admin'))
 
 
@@ -485,10 +1566,14 @@ def admin_delete_message(message_id):
     if not g.user.admin:
         return redirect('/')
 
-    message_to_delete = Message.query.get_or_404(message_id)
-    db.session.delete(message_to_delete)
+    author_id = Message.soft_delete(message_id)
+    if author_id is None:
+        abort(404)
     db.session.commit()
-    return redirect(url_for('admin_show_user', user_id=message_to_delete.user_id))
+    object_cache.invalidate(Message, message_id)
+    user_cards.invalidate([author_id])
+    timelines.remove(author_id, message_id)
+    return redirect(url_for('admin_show_user', user_id=author_id))
 
 ##############################################################################
 # Turn off all caching in Flask
@@ -497,10 +1582,29 @@ def admin_delete_message(message_id):
 #
 # https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
 
+@app.after_request
+def keep_stale_copy(response):
+    """Keep the pages in STALE_ROUTES, to serve if the database goes down."""
+
+    if (request.method == 'GET' and request.endpoint in STALE_ROUTES and
+            response.status_code == 200 and not response.is_streamed and
+            'Warning' not in response.headers):
+        stale_pages.set(stale_key(),
+                        (response.get_data(), response.mimetype, time.time()),
+                        app.config['STALE_MAX_AGE'])
+    return response
+
+
 @app.after_request
 def add_header(response):
-    """Add non-caching headers on every request."""
+    """Add non-caching headers to every response that didn't set its own."""
 
     # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Cache-Control
-    response.cache_control.no_store = True
+    if response.cache_control.max_age is None:
+        response.cache_control.no_store = True
+
+    if 'profiler' in g:
+        g.profile_status = response.status_code
+        response.headers['X-Profile-URL'] = url_for('admin_show_profile',
+                                                profile_id=g.profile_id)
     return response
@@ -0,0 +1,141 @@
+"""Fingerprinted, precompressed copies of the files in static/.
+
+`build` copies every static file into static/dist/ under a name that
+includes a hash of its contents (style.css -> style.3f2a9c1b04de.css),
+rewrites the /static/ references inside stylesheets to match, and writes
+gzip (and, if the `brotli` package is installed, brotli) versions of text
+files next to them. A manifest maps original names to fingerprinted ones.
+
+Because a fingerprinted file can never change, `Assets` serves them with
+year-long immutable cache headers. Templates link assets through
+`asset_url`, which falls back to the plain /static/ URL for files that
+haven't been built (e.g. in development).
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+from flask import request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+
+# Text types worth precompressing; images are already compressed.
+COMPRESSIBLE = {'.css', '.js', '.svg', '.ico', '.json', '.txt'}
+
+STATIC_URL = re.compile(r"""url\((['"]?)/static/([^'")]+)\1\)""")
+
+
+def fingerprint(path, data):
+    """`path` with a hash of `data` before its extension."""
+
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def build(static_folder):
+    """Build static/dist/ and its manifest. Returns the manifest."""
+
+    dist = os.path.join(static_folder, DIST)
+
+    sources = []
+    for root, dirs, files in os.walk(static_folder):
+        if os.path.abspath(root) == os.path.abspath(static_folder):
+            dirs[:] = [d for d in dirs if d != DIST]
+        for name in files:
+            path = os.path.join(root, name)
+            sources.append(os.path.relpath(path, static_folder).replace(
+                os.sep, '/'))
+
+    # Stylesheets go last so the files they reference are already named.
+    sources.sort(key=lambda name: (name.endswith('.css'), name))
+
+    manifest = {}
+    for name in sources:
+        with open(os.path.join(static_folder, name), 'rb') as f:
+            data = f.read()
+
+        if name.endswith('.css'):
+            data = STATIC_URL.sub(
+                lambda m: 'url({0}/static/{1}/{2}{0})'.format(
+                    m.group(1), DIST, manifest.get(m.group(2), m.group(2))),
+                data.decode('utf-8')).encode('utf-8')
+
+        hashed = fingerprint(name, data)
+        manifest[name] = hashed
+        write(os.path.join(dist, hashed), data)
+
+        if os.path.splitext(name)[1] in COMPRESSIBLE:
+            gzipped = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(gzipped) < len(data):
+                write(os.path.join(dist, hashed + '.gz'), gzipped)
+            if brotli is not None:
+                compressed = brotli.compress(data)
+                if len(compressed) < len(data):
+                    write(os.path.join(dist, hashed + '.br'), compressed)
+
+    write(os.path.join(dist, MANIFEST),
+          json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+
+    return manifest
+
+
+class Assets:
+    """Serves built assets and links templates to them."""
+
+    def __init__(self, static_folder):
+        self.dist = os.path.join(static_folder, DIST)
+        self.load()
+
+    def load(self):
+        """(Re)read the manifest written by `build`."""
+
+        try:
+            with open(os.path.join(self.dist, MANIFEST)) as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            self.manifest = {}
+
+    def url(self, filename):
+        """URL for static file `filename`, fingerprinted if it was built."""
+
+        if filename in self.manifest:
+            return url_for('static_asset', filename=self.manifest[filename])
+        return url_for('static', filename=filename)
+
+    def send(self, filename):
+        """Response for a fingerprinted file, precompressed if accepted."""
+
+        mimetype = mimetypes.guess_type(filename)[0]
+        served, encoding = filename, None
+
+        for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if (request.accept_encodings[candidate] and
+                    os.path.isfile(os.path.join(self.dist, filename + suffix))):
+                served, encoding = filename + suffix, candidate
+                break
+
+        response = send_from_directory(self.dist, served, mimetype=mimetype,
+                                       conditional=True)
+        if encoding:
+            response.content_encoding = encoding
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 60 * 60
+        response.cache_control.immutable = True
+        return response
@@ -0,0 +1,133 @@
+"""Benchmark a data export of one big account: streamed vs loaded.
+
+Seeds one user with `messages` messages, `likes` likes, `follows`
+follows and as many followers, and `dms` DMs sent and as many received
+(about 2.5 million rows with the defaults), then exports them with
+exports.write, reporting the time, the rows per second, the zip's size
+and the peak Python memory. For comparison, it then loads the same rows
+through User.messages, liked_messages, following, followers and DM
+queries, as an export written that way would.
+
+Needs Postgres: uses BENCH_DATABASE_URL, or postgresql:///warbler-bench
+(which must exist; the benchmark creates and drops its tables).
+
+run like:
+
+    python -m benchmarks.export [messages] [likes] [follows] [dms]
+"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from flask import Flask
+
+from exports import write
+from models import db, connect_db, DirectMessage, User
+
+BATCH_SIZE = 1000
+
+USER_ID = 1
+
+
+def seed(messages, likes, follows, dms):
+    """The exported user is user 1; users 2... are everyone else."""
+
+    others = max(follows, 1000)
+    db.session.execute(f"""
+        INSERT INTO users (id, username, email, password, admin)
+        SELECT g, 'user' || g, 'user' || g || '@example.com', 'x', false
+        FROM generate_series(1, {others + 1}) g;
+
+        INSERT INTO messages (id, user_id, text)
+        SELECT g, 1, 'warble ' || g
+        FROM generate_series(1, {messages}) g;
+
+        INSERT INTO messages (id, user_id, text)
+        SELECT {messages} + g, 2 + g % {others}, 'warble ' || g
+        FROM generate_series(1, {likes}) g;
+
+        INSERT INTO likes (user_id, message_id)
+        SELECT 1, {messages} + g
+        FROM generate_series(1, {likes}) g;
+
+        INSERT INTO follows (user_following_id, user_being_followed_id)
+        SELECT 1, 1 + g FROM generate_series(1, {follows}) g;
+
+        INSERT INTO follows (user_following_id, user_being_followed_id)
+        SELECT 1 + g, 1 FROM generate_series(1, {follows}) g;
+
+        INSERT INTO direct_messages (id, user_from_id, user_to_id, msg)
+        SELECT g, 1, 2 + g % {others}, 'dm ' || g
+        FROM generate_series(1, {dms}) g;
+
+        INSERT INTO direct_messages (id, user_from_id, user_to_id, msg)
+        SELECT {dms} + g, 2 + g % {others}, 1, 'dm ' || g
+        FROM generate_series(1, {dms}) g;
+
+        ANALYZE;
+    """)
+    db.session.commit()
+
+
+def load():
+    """Every row an export needs, loaded through the ORM."""
+
+    user = User.query.get(USER_ID)
+    return (user.messages, user.liked_messages, user.following,
+            user.followers,
+            DirectMessage.query.filter_by(user_from_id=USER_ID).all(),
+            DirectMessage.query.filter_by(user_to_id=USER_ID).all())
+
+
+def measure(fn):
+    """Peak traced memory (bytes), seconds taken and result of `fn()`."""
+
+    db.session.expunge_all()
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    result = fn()
+
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    db.session.rollback()
+    return peak, elapsed, result
+
+
+def main(messages=1_000_000, likes=500_000, follows=100_000, dms=250_000):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+        'BENCH_DATABASE_URL', 'postgresql:///warbler-bench')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    connect_db(app)
+
+    with app.app_context(), tempfile.TemporaryDirectory() as tmp:
+        db.drop_all()
+        db.create_all()
+        seed(messages, likes, follows, dms)
+
+        path = os.path.join(tmp, 'export.zip')
+        peak, elapsed, counts = measure(
+            lambda: write(USER_ID, path, BATCH_SIZE))
+        rows = sum(counts.values())
+        print(f"rows: {rows:,}")
+        print(f"streamed   {elapsed:7.1f}s  {rows / elapsed:9,.0f} rows/s  "
+              f"peak {peak / 2**20:8.1f}MB  "
+              f"zip {os.path.getsize(path) / 2**20:.1f}MB")
+
+        peak, elapsed, loaded = measure(load)
+        assert sum(map(len, loaded)) == rows - 1
+        del loaded
+        print(f"ORM loaded {elapsed:7.1f}s  {'':15}  "
+              f"peak {peak / 2**20:8.1f}MB")
+
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,97 @@
+"""Benchmark posting messages: a commit per request vs group commit.
+
+Runs `threads` concurrent posters, each posting `posts` messages, first
+committing every message itself (what messages_add does by default) and
+then through a GroupCommitWriter, and reports throughput and latency.
+The difference depends mostly on how long the database takes to flush
+its WAL, so run it against a Postgres like production's, with
+synchronous_commit on.
+
+Needs Postgres: uses BENCH_DATABASE_URL, or postgresql:///warbler-bench
+(which must exist; the benchmark creates and drops its tables).
+
+run like:
+
+    python -m benchmarks.group_commit [threads] [posts per thread]
+"""
+
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+from flask import Flask
+
+import tags
+from groupcommit import GroupCommitWriter
+from models import db, connect_db, User, Message
+
+
+def run(threads, posts, post):
+    """Messages per second, and latencies (ms), of `post()` from threads."""
+
+    timings = [[] for _ in range(threads)]
+
+    def poster(i):
+        for _ in range(posts):
+            start = time.perf_counter()
+            post()
+            timings[i].append(time.perf_counter() - start)
+
+    workers = [threading.Thread(target=poster, args=(i,))
+               for i in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    return threads * posts / elapsed, np.concatenate(timings) * 1000
+
+
+def main(threads=32, posts=200):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+        'BENCH_DATABASE_URL', 'postgresql:///warbler-bench')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_POOL_SIZE'] = threads + 1
+    connect_db(app)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        user = User(username="poster", email="poster@example.com",
+                    password="x")
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+    def commit_each():
+        with app.app_context():
+            msg = Message(text="hello #bench", user_id=user_id)
+            db.session.add(msg)
+            db.session.flush()
+            tags.index([(msg.id, msg.text)])
+            db.session.commit()
+
+    writer = GroupCommitWriter(app)
+
+    def group_commit():
+        writer.post_message(user_id, "hello #bench")
+
+    print(f"threads: {threads}, posts per thread: {posts}")
+    for name, post in [("commit each", commit_each),
+                       ("group commit", group_commit)]:
+        rate, timings = run(threads, posts, post)
+        print(f"{name:12}  {rate:8.0f} msg/s  "
+              f"p50 {np.percentile(timings, 50):6.2f}ms  "
+              f"p99 {np.percentile(timings, 99):6.2f}ms")
+
+    with app.app_context():
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
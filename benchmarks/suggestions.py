@@ -0,0 +1,60 @@
+"""Benchmark the "who to follow" follow-graph index.
+
+Builds a synthetic follow graph (no database needed) and reports the
+index's memory per edge and how long suggestion lookups take.
+
+run like:
+
+    python -m benchmarks.suggestions [users] [follows per user]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from suggestions import FollowGraph, SuggestionEngine
+
+
+def synthetic_edges(users, follows_per_user, seed=0):
+    """Follower/followed id arrays with a skewed (popular-heavy) in-degree."""
+
+    rng = np.random.default_rng(seed)
+    followers = np.repeat(np.arange(1, users + 1), follows_per_user)
+    followed = (rng.zipf(1.3, len(followers)) % users) + 1
+
+    keep = followers != followed
+    edges = np.unique(np.stack([followers[keep], followed[keep]], axis=1),
+                      axis=0)
+    return edges[:, 0], edges[:, 1]
+
+
+def main(users=100_000, follows_per_user=20, lookups=1000):
+    followers, followed = synthetic_edges(users, follows_per_user)
+
+    start = time.perf_counter()
+    graph = FollowGraph.from_edges(followers, followed)
+    build = time.perf_counter() - start
+
+    engine = SuggestionEngine()
+    engine.graph = graph
+
+    rng = np.random.default_rng(1)
+    timings = []
+    for user_id in rng.integers(1, users + 1, lookups).tolist():
+        start = time.perf_counter()
+        engine.suggest(user_id)
+        timings.append(time.perf_counter() - start)
+
+    timings = np.array(timings) * 1000
+    print(f"users:            {users:,}")
+    print(f"edges:            {len(graph):,}")
+    print(f"build:            {build:.2f}s")
+    print(f"index size:       {graph.nbytes / 2**20:.1f} MiB")
+    print(f"bytes per edge:   {graph.nbytes / len(graph):.2f}")
+    print(f"suggest p50:      {np.percentile(timings, 50):.2f}ms")
+    print(f"suggest p99:      {np.percentile(timings, 99):.2f}ms")
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,114 @@
+"""Benchmark home timeline pages: IN (...) ORDER BY vs the timeline engine.
+
+Seeds `authors` authors with `messages` messages each, then times the
+first page of a timeline following 1,000 and 10,000 of them four ways:
+the old single query (user_id IN (...) ORDER BY id DESC LIMIT 100), the
+per-author SQL the engine falls back on, the engine from cold (loading
+every buffer) and the engine warm.
+
+Needs Postgres: uses BENCH_DATABASE_URL, or postgresql:///warbler-bench
+(which must exist; the benchmark creates and drops its tables).
+
+run like:
+
+    python -m benchmarks.timeline [authors] [messages per author]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+from flask import Flask
+
+from models import db, connect_db, Message
+from timeline import TimelineEngine, page_from_sql
+
+PAGE_SIZE = 100
+
+
+def seed(authors, messages):
+    db.session.execute(f"""
+        INSERT INTO users (id, username, email, password, admin)
+        SELECT g, 'user' || g, 'user' || g || '@example.com', 'x', false
+        FROM generate_series(1, {authors}) g;
+
+        INSERT INTO messages (id, user_id, text)
+        SELECT g, 1 + g % {authors}, 'warble ' || g
+        FROM generate_series(1, {authors * messages}) g;
+
+        ANALYZE users;
+        ANALYZE messages;
+    """)
+    db.session.commit()
+
+
+def in_query(following):
+    return [(id, user_id) for id, user_id in db.session
+            .query(Message.id, Message.user_id)
+            .filter(Message.user_id.in_(following))
+            .order_by(Message.id.desc())
+            .limit(PAGE_SIZE)]
+
+
+def timed(fn, runs):
+    """Milliseconds per run of `fn()`, and its last result."""
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return np.array(timings) * 1000, result
+
+
+def main(authors=20000, messages=20, runs=20):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+        'BENCH_DATABASE_URL', 'postgresql:///warbler-bench')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    connect_db(app)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(authors, messages)
+
+        print(f"authors: {authors:,}, messages: {authors * messages:,}")
+        rng = np.random.default_rng(0)
+        for follows in (1000, 10000):
+            if follows > authors:
+                break
+            following = (rng.choice(authors, follows, replace=False) + 1
+                         ).tolist()
+
+            cold_engines = [TimelineEngine() for _ in range(runs)]
+            warm = TimelineEngine()
+            warm.timeline(following, limit=PAGE_SIZE)
+
+            results = {
+                "IN (...) ORDER BY": timed(lambda: in_query(following),
+                                           runs),
+                "per-author SQL": timed(
+                    lambda: page_from_sql(following, limit=PAGE_SIZE), runs),
+                "engine, cold": timed(
+                    lambda: cold_engines.pop().timeline(following,
+                                                        limit=PAGE_SIZE),
+                    runs),
+                "engine, warm": timed(
+                    lambda: warm.timeline(following, limit=PAGE_SIZE), runs),
+            }
+
+            expected = in_query(following)
+            print(f"\nfollowing {follows:,}")
+            for name, (timings, page) in results.items():
+                assert page == expected, name
+                print(f"{name:18}  p50 {np.percentile(timings, 50):7.2f}ms  "
+                      f"p99 {np.percentile(timings, 99):7.2f}ms")
+
+        db.session.commit()
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,87 @@
+"""Benchmark memory used by a user listing: User instances vs card rows.
+
+Loads every user as User instances with every column (what list pages
+used to do), as User instances with the deferred columns left out, and
+through User.cards(), and reports the peak Python memory of each.
+
+Uses an in-memory SQLite database unless BENCH_DATABASE_URL is set.
+
+run like:
+
+    python -m benchmarks.user_projection [users]
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+from flask import Flask
+
+from models import db, connect_db, User
+
+
+def seed(count):
+    """Insert `count` users with realistic column sizes."""
+
+    db.session.bulk_insert_mappings(User, [
+        {
+            "username": f"user{i}",
+            "email": f"user{i}@example.com",
+            "password": "$2b$12$" + "x" * 53,
+            "image_url": f"https://randomuser.me/api/portraits/men/{i % 100}.jpg",
+            "header_image_url": "/static/images/warbler-hero.jpg",
+            "bio": "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 2,
+            "location": "San Francisco, CA",
+        }
+        for i in range(count)
+    ])
+    db.session.commit()
+
+
+def measure(load):
+    """Peak traced memory (bytes) and seconds taken by `load()`."""
+
+    db.session.expunge_all()
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    rows = load()
+
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    del rows
+    return peak, elapsed
+
+
+def main(count=100_000):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+        'BENCH_DATABASE_URL', 'sqlite://')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    connect_db(app)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(count)
+
+        results = {
+            "all columns": measure(
+                lambda: User.query.options(db.undefer('*')).all()),
+            "deferred": measure(lambda: User.query.all()),
+            "User.cards()": measure(lambda: User.cards().all()),
+        }
+
+        print(f"users: {count:,}")
+        for name, (peak, elapsed) in results.items():
+            print(f"{name:13} peak {peak / 2**20:7.1f} MiB  "
+                  f"{peak / count:6.0f} B/row  {elapsed:5.2f}s")
+
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,67 @@
+"""A circuit breaker for the database.
+
+While Postgres is healthy the breaker is closed and does nothing but
+count. After `threshold` failures in a row (statement timeouts, lost
+connections, no pool connection free in time) it opens: for the next
+`reset_after` seconds `allow` says no, so requests give up at once
+rather than each tying up a worker until it times out too. Then it lets
+a single request through to try the database (half open). If that works
+the breaker closes again; if not, it stays open another `reset_after`.
+
+app.py counts a failure for each statement that times out or loses its
+connection, and a success for each request whose queries all worked
+(see `database_worked`). While the breaker is open, app.py serves the
+read pages from their last good render (see `database_unavailable`) and
+fails everything else fast with a 503.
+"""
+
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker:
+    """Counts consecutive failures and decides whether to try at all."""
+
+    def __init__(self, threshold=5, reset_after=10, clock=time.monotonic):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.clock = clock
+
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """Whether to use the database now.
+
+        Once `reset_after` has passed, the first caller gets to try; the
+        rest are refused until it reports back (or, if it never does,
+        for another `reset_after`).
+        """
+
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.clock() - self.opened_at >= self.reset_after:
+                self.state = HALF_OPEN
+                # Measure the next wait from this trial.
+                self.opened_at = self.clock()
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            self.state = CLOSED
+            self.failures = 0
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.threshold:
+                self.state = OPEN
+                self.opened_at = self.clock()
@@ -0,0 +1,352 @@
+"""Read-through cache for single User and Message lookups.
+
+`ObjectCache.get(Model, id)` returns the row from the cache when it can
+and from the database when it can't, caching what it loaded. Only column
+values are cached (never relationships, and never deferred groups you
+don't ask for, so password hashes stay out). Hits are rebuilt into
+instances attached to the session without a query, so relationships
+still lazy-load as usual.
+
+Entries live in an in-process LRU and, if a `shared_dir` is given, in
+files under it that every worker on the host can read. Put `shared_dir`
+on a tmpfs like /dev/shm so those reads never touch a disk.
+
+Keys are versioned: each object has a version number, and the cache key
+includes it. `invalidate` bumps the version, so no worker reads the old
+entry again; it just ages out of the LRU. Versions are kept where every
+worker on the host sees them: in the shared store when there is one,
+otherwise in a `VersionTable` at `versions_path`. (With neither, they're
+per process, which only suits a single worker.) Entries also expire
+after `ttl` seconds, which bounds how stale anything changed without an
+`invalidate` can get.
+
+Concurrent misses on the same key are coalesced: the first one loads
+the row while the others (threads in this process and, with a shared
+store, other workers) wait for it and then read what it cached.
+"""
+
+import fcntl
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+
+from sqlalchemy.orm import make_transient_to_detached
+
+# Locks are striped over this many slots rather than made per key.
+LOCK_STRIPES = 64
+
+# Sweep expired shared entries every this many writes.
+SWEEP_EVERY = 1000
+
+VERSION = struct.Struct('<I')
+
+
+def stripe(key):
+    return int(hashlib.sha1(key.encode('utf-8')).hexdigest()[:8], 16) % LOCK_STRIPES
+
+
+class LRUStore:
+    """In-process store of the `max_entries` most recently used entries."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """The unexpired value for `key`, or None."""
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (time.time() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class SharedStore:
+    """Entries and versions kept in files shared by every local worker."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.writes = 0
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def path(self, prefix, key):
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f"{prefix}-{name}")
+
+    def read(self, path):
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, path, data):
+        # Write then rename, so readers never see half a file.
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def get(self, key):
+        """The unexpired value for `key`, or None."""
+
+        data = self.read(self.path('e', key))
+        if data is None:
+            return None
+        expires, value = pickle.loads(data)
+        if expires < time.time():
+            return None
+        return value
+
+    def set(self, key, value, ttl):
+        self.write(self.path('e', key),
+                   pickle.dumps((time.time() + ttl, value)))
+
+        self.writes += 1
+        if self.writes % SWEEP_EVERY == 0:
+            self.sweep()
+
+    def sweep(self):
+        """Remove expired entries."""
+
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not name.startswith('e-') or '.' in name:
+                continue
+            path = os.path.join(self.directory, name)
+            data = self.read(path)
+            if data is not None and pickle.loads(data)[0] < now:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def version(self, key):
+        data = self.read(self.path('v', key))
+        return int(data) if data else 0
+
+    def bump(self, key):
+        with self.lock(key):
+            version = self.version(key) + 1
+            self.write(self.path('v', key), str(version).encode('ascii'))
+
+    @contextmanager
+    def lock(self, key):
+        """Hold an exclusive lock on `key`'s stripe across processes."""
+
+        path = os.path.join(self.directory, f"lock-{stripe(key)}")
+        with open(path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.startswith('e-'):
+                os.remove(os.path.join(self.directory, name))
+
+
+class LocalVersions:
+    """Versions for a single process."""
+
+    def __init__(self):
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    def version(self, key):
+        return self.versions.get(key, 0)
+
+    def bump(self, key):
+        with self.lock:
+            self.versions[key] = self.versions.get(key, 0) + 1
+
+
+class VersionTable:
+    """Version counters in a file every local worker maps into memory.
+
+    Keys hash into `slots` counters, so bumping one also bumps the few
+    other keys sharing it, which only costs them a miss. Put `path` on a
+    tmpfs like /dev/shm.
+    """
+
+    def __init__(self, path, slots=65536):
+        self.path = path
+        self.slots = slots
+        self.size = slots * VERSION.size
+
+        self.fd = self.open()
+        self.mm = mmap.mmap(self.fd, self.size)
+        self.lock = threading.Lock()
+
+    def open(self):
+        """Open the table's file, creating it if it's missing or resized."""
+
+        with open(f"{self.path}.lock", 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    fd = os.open(self.path, os.O_RDWR)
+                except FileNotFoundError:
+                    fd = None
+                if fd is not None and os.fstat(fd).st_size == self.size:
+                    return fd
+                if fd is not None:
+                    os.close(fd)
+
+                tmp = f"{self.path}.{os.getpid()}"
+                fd = os.open(tmp, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+                os.ftruncate(fd, self.size)
+                os.replace(tmp, self.path)
+                return fd
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def offset(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).digest()
+        return int.from_bytes(digest[:8], 'little') % self.slots * VERSION.size
+
+    def version(self, key):
+        return VERSION.unpack_from(self.mm, self.offset(key))[0]
+
+    def bump(self, key):
+        offset = self.offset(key)
+        # Record locks are per process, so threads also take self.lock.
+        with self.lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, VERSION.size, offset)
+            try:
+                version = VERSION.unpack_from(self.mm, offset)[0]
+                VERSION.pack_into(self.mm, offset,
+                                  (version + 1) & 0xffffffff)
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, VERSION.size, offset)
+
+
+class ObjectCache:
+    """Read-through cache of model rows by primary key."""
+
+    def __init__(self, session, max_entries=10000, ttl=300, shared_dir=None,
+                 versions_path=None):
+        self.session = session
+        self.ttl = ttl
+        self.local = LRUStore(max_entries)
+        self.shared = SharedStore(shared_dir) if shared_dir else None
+
+        if self.shared is not None:
+            self.versions = self.shared
+        elif versions_path:
+            self.versions = VersionTable(versions_path)
+        else:
+            self.versions = LocalVersions()
+        self.locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+    def version(self, key):
+        return self.versions.version(key)
+
+    def invalidate(self, model, id):
+        """Make every worker reload `model` `id` next time it's asked for.
+
+        Call after the change is committed.
+        """
+
+        self.versions.bump(f"{model.__tablename__}:{id}")
+
+    def clear(self):
+        """Drop every entry. Versions are kept."""
+
+        self.local.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def fetch(self, key, load):
+        """The cached value for `key`, calling `load()` on a miss.
+
+        A None from `load` (nothing found) isn't cached.
+        """
+
+        value = self.lookup(key)
+        if value is not None:
+            return value
+
+        with self.locks[stripe(key)], self.shared_lock(key):
+            # Someone else may have loaded it while we waited.
+            value = self.lookup(key)
+            if value is None:
+                value = load()
+                if value is not None:
+                    self.local.set(key, value, self.ttl)
+                    if self.shared is not None:
+                        self.shared.set(key, value, self.ttl)
+
+        return value
+
+    def lookup(self, key):
+        value = self.local.get(key)
+        if value is None and self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.local.set(key, value, self.ttl)
+        return value
+
+    def shared_lock(self, key):
+        if self.shared is None:
+            return nullcontext()
+        return self.shared.lock(key)
+
+    def get(self, model, id, groups=()):
+        """`model` `id`, attached to the session, or None if there's none.
+
+        Loads the model's undeferred columns plus the deferred column
+        `groups` named.
+        """
+
+        props = [prop for prop in model.__mapper__.column_attrs
+                 if not prop.deferred or prop.group in groups]
+        columns = [prop.key for prop in props]
+
+        base = f"{model.__tablename__}:{id}"
+        # Column names are in the key, so a deploy that changes them
+        # doesn't read entries written by the old code.
+        shape = hashlib.sha1(','.join(columns).encode('utf-8')).hexdigest()[:8]
+        key = f"{base}:{self.version(base)}:{shape}"
+
+        def load():
+            row = (self.session.query(*[prop.columns[0] for prop in props])
+                   .filter(model.__mapper__.primary_key[0] == id)
+                   .first())
+            return None if row is None else tuple(row)
+
+        row = self.fetch(key, load)
+        if row is None:
+            return None
+
+        obj = model(**dict(zip(columns, row)))
+        # Mark it as loaded from the database, with anything not cached
+        # expired, and attach it to the session without a query.
+        make_transient_to_detached(obj)
+        return self.session.merge(obj, load=False)
@@ -0,0 +1,278 @@
+"""User cards kept in shared memory, read by every worker on the host.
+
+A card is what's shown wherever a user appears next to their messages:
+their username and avatar, plus their message, following, follower and
+like counts. `UserCards.get_many(ids)` returns cards from the table when
+it can, and loads the rest in one query, storing them for every worker.
+
+The table is a file (on /dev/shm by default, so it's never written to
+disk) that each worker maps into memory. It holds a fixed number of
+fixed-size slots, grouped into buckets of WAYS slots; a user's card can
+only live in the bucket its id hashes to. Storing a card in a full
+bucket evicts the least recently read card in it, so the table never
+grows. Usernames and image URLs longer than a slot holds aren't stored.
+
+Reads take no locks. Each slot starts with a sequence number that a
+writer makes odd before changing the slot and even again afterwards, and
+a reader copies the slot and only uses the copy if the sequence number
+was the same even number before and after. Writers lock their bucket
+(with an fcntl record lock, which also covers other processes).
+
+Each card is stored with the version its user had when it was loaded.
+`invalidate` bumps the version, after which no worker uses the old card.
+Versions are kept in a table of counters, also in the file, that user
+ids hash into, so an invalidation also misses the few other users that
+share its counter. Cards also expire after `ttl` seconds.
+"""
+
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from models import db, User, Message, Follows, Likes
+
+UserCard = namedtuple('UserCard', ['id', 'username', 'image_url', 'messages',
+                                   'following', 'followers', 'likes'])
+
+# A file with a different layout (from an older deploy) is replaced.
+MAGIC = b'WBCARDS1'
+HEADER = struct.Struct('<8sIII')
+
+# Sequence number, user id, version, expiry time, time last read, the four
+# counts, then username and image URL as length-prefixed bytes.
+SLOT = struct.Struct('<IqIdd4IH64sH256s')
+SLOT_SIZE = 384
+USED_OFFSET = 24
+
+SEQUENCE = struct.Struct('<I')
+VERSION = struct.Struct('<I')
+USED = struct.Struct('<d')
+
+WAYS = 8
+VERSIONS_OFFSET = 64
+
+# Give up on (and treat as a miss) a slot that's being rewritten this
+# many times in a row.
+READ_RETRIES = 100
+
+
+class CardTable:
+    """Fixed-size table of user cards in a memory-mapped file."""
+
+    def __init__(self, path, slots=32768, ttl=60):
+        self.path = path
+        self.buckets = max(1, slots // WAYS)
+        self.slots = self.buckets * WAYS
+        self.ttl = ttl
+
+        self.slots_offset = VERSIONS_OFFSET + self.slots * VERSION.size
+        self.size = self.slots_offset + self.slots * SLOT_SIZE
+
+        self.fd = self.open()
+        self.mm = mmap.mmap(self.fd, self.size)
+        self.lock = threading.Lock()
+
+    def open(self):
+        """Open the table's file, creating it if it's missing or stale."""
+
+        header = HEADER.pack(MAGIC, SLOT_SIZE, self.slots, WAYS)
+
+        with open(f"{self.path}.lock", 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    fd = os.open(self.path, os.O_RDWR)
+                except FileNotFoundError:
+                    fd = None
+                if (fd is not None and
+                        os.pread(fd, HEADER.size, 0) == header and
+                        os.fstat(fd).st_size == self.size):
+                    return fd
+                if fd is not None:
+                    os.close(fd)
+
+                # Workers still mapping the old file keep it until they
+                # restart; they don't see writes to the new one meanwhile.
+                tmp = f"{self.path}.{os.getpid()}"
+                fd = os.open(tmp, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+                os.ftruncate(fd, self.size)
+                os.pwrite(fd, header, 0)
+                os.replace(tmp, self.path)
+                return fd
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def version_offset(self, user_id):
+        return VERSIONS_OFFSET + (user_id % self.slots) * VERSION.size
+
+    def bucket_offset(self, user_id):
+        return self.slots_offset + (user_id % self.buckets) * WAYS * SLOT_SIZE
+
+    def version(self, user_id):
+        return VERSION.unpack_from(self.mm, self.version_offset(user_id))[0]
+
+    def invalidate(self, user_id):
+        offset = self.version_offset(user_id)
+        with self.locked(offset, VERSION.size):
+            version = VERSION.unpack_from(self.mm, offset)[0]
+            VERSION.pack_into(self.mm, offset, (version + 1) & 0xffffffff)
+
+    def read(self, offset):
+        """A consistent copy of the slot at `offset`, unpacked, or None."""
+
+        for _ in range(READ_RETRIES):
+            sequence = SEQUENCE.unpack_from(self.mm, offset)[0]
+            if sequence & 1:
+                continue
+            data = self.mm[offset:offset + SLOT.size]
+            if SEQUENCE.unpack_from(self.mm, offset)[0] == sequence:
+                return SLOT.unpack(data)
+        return None
+
+    def get(self, user_id):
+        """User `user_id`'s current card, or None."""
+
+        version = self.version(user_id)
+        now = time.time()
+
+        base = self.bucket_offset(user_id)
+        for offset in range(base, base + WAYS * SLOT_SIZE, SLOT_SIZE):
+            slot = self.read(offset)
+            if slot is None or slot[1] != user_id:
+                continue
+
+            (_, id, slot_version, expires, _, messages, following,
+             followers, likes, username_length, username,
+             image_length, image_url) = slot
+            if slot_version != version or expires < now:
+                return None
+
+            # Unlocked: at worst a concurrent write's time is overwritten.
+            USED.pack_into(self.mm, offset + USED_OFFSET, now)
+            return UserCard(id, username[:username_length].decode('utf-8'),
+                            image_url[:image_length].decode('utf-8') or None,
+                            messages, following, followers, likes)
+        return None
+
+    def put(self, card, version):
+        """Store `card`, loaded when its user was at `version`.
+
+        Returns False if the card doesn't fit in a slot.
+        """
+
+        username = card.username.encode('utf-8')
+        image_url = (card.image_url or '').encode('utf-8')
+        if len(username) > 64 or len(image_url) > 256:
+            return False
+
+        now = time.time()
+        base = self.bucket_offset(card.id)
+        with self.locked(base, WAYS * SLOT_SIZE):
+            offset = self.victim(base, card.id, now)
+            sequence = SEQUENCE.unpack_from(self.mm, offset)[0]
+
+            SEQUENCE.pack_into(self.mm, offset, (sequence + 1) & 0xffffffff)
+            SLOT.pack_into(self.mm, offset, (sequence + 1) & 0xffffffff,
+                           card.id, version, now + self.ttl, now,
+                           card.messages, card.following, card.followers,
+                           card.likes, len(username), username,
+                           len(image_url), image_url)
+            SEQUENCE.pack_into(self.mm, offset, (sequence + 2) & 0xffffffff)
+        return True
+
+    def victim(self, base, user_id, now):
+        """The slot in the bucket at `base` to store `user_id`'s card in.
+
+        The user's own slot if they have one, else an empty, expired or
+        invalidated one, else the least recently read.
+        """
+
+        oldest = None
+        for offset in range(base, base + WAYS * SLOT_SIZE, SLOT_SIZE):
+            (_, id, version, expires,
+             used) = SLOT.unpack_from(self.mm, offset)[:5]
+            if id == user_id or id == 0:
+                return offset
+            if expires < now or version != self.version(id):
+                return offset
+            if oldest is None or used < oldest[0]:
+                oldest = (used, offset)
+        return oldest[1]
+
+    @contextmanager
+    def locked(self, offset, length):
+        """Hold an exclusive lock on a byte range, across processes."""
+
+        # Record locks are per process, so threads also take self.lock.
+        with self.lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, length, offset)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, length, offset)
+
+
+def load(user_ids):
+    """Cards for the users in `user_ids`, counted in one query."""
+
+    def count(column, *conditions):
+        return (db.select([db.func.count()])
+                .where(db.and_(column == User.id, *conditions))
+                .as_scalar())
+
+    rows = (db.session
+            .query(User.id, User.username, User.image_url,
+                   count(Message.user_id, Message.deleted_at.is_(None)),
+                   count(Follows.user_following_id),
+                   count(Follows.user_being_followed_id),
+                   count(Likes.user_id))
+            .filter(User.id.in_(user_ids)))
+
+    return [UserCard(*row) for row in rows]
+
+
+class UserCards:
+    """Read-through cache of user cards in a shared `CardTable`."""
+
+    def __init__(self, path, slots=32768, ttl=60):
+        self.table = CardTable(path, slots, ttl)
+
+    def get(self, user_id):
+        """User `user_id`'s card, or None if there's no such user."""
+
+        return self.get_many([user_id]).get(user_id)
+
+    def get_many(self, user_ids):
+        """A dict of the cards of the users in `user_ids` that exist."""
+
+        cards = {}
+        versions = {}
+        for user_id in set(user_ids):
+            card = self.table.get(user_id)
+            if card is not None:
+                cards[user_id] = card
+            else:
+                # Read before loading, so a change committed while we
+                # load leaves what we store already invalidated.
+                versions[user_id] = self.table.version(user_id)
+
+        if versions:
+            for card in load(list(versions)):
+                self.table.put(card, versions[card.id])
+                cards[card.id] = card
+
+        return cards
+
+    def invalidate(self, user_ids):
+        """Make every worker reload the cards of `user_ids`.
+
+        Call after the change is committed.
+        """
+
+        for user_id in set(user_ids):
+            self.table.invalidate(user_id)
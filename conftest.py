@@ -0,0 +1,125 @@
+"""pytest setup: a database per worker and a transaction per test.
+
+Install requirements-dev.txt and run the suite in parallel with
+
+    python -m pytest -n auto
+
+Each pytest-xdist worker gets its own database (warbler-test-gw0, ...),
+created on first use; without xdist it's warbler-test. Every test runs
+inside a transaction that is rolled back when it finishes. The app's
+commits and rollbacks only release or roll back a SAVEPOINT within it,
+so tests never see each other's data and nothing needs deleting.
+
+The `user`, `message`, `follow` and `dm` fixtures are the functions in
+factories.py.
+"""
+
+import os
+import tempfile
+
+import pytest
+from sqlalchemy import create_engine, event, text
+
+WORKER = os.environ.get('PYTEST_XDIST_WORKER')
+TEST_DATABASE = 'warbler-test' + (f'-{WORKER}' if WORKER else '')
+
+
+def create_database(name):
+    """Create database `name` if it doesn't exist yet."""
+
+    engine = create_engine('postgresql:///postgres',
+                           isolation_level='AUTOCOMMIT')
+    with engine.connect() as connection:
+        exists = connection.execute(
+            text("SELECT 1 FROM pg_database WHERE datname = :name"),
+            name=name).scalar()
+        if not exists:
+            connection.execute(f'CREATE DATABASE "{name}"')
+    engine.dispose()
+
+
+create_database(TEST_DATABASE)
+
+# Set before the app is imported (here, ahead of any test module), so the
+# app connects to this worker's database and hashes passwords cheaply.
+os.environ['DATABASE_URL'] = f"postgresql:///{TEST_DATABASE}"
+os.environ['BCRYPT_LOG_ROUNDS'] = '4'
+# Cards cached by an earlier run could belong to since rolled back users.
+os.environ['USER_CARDS_PATH'] = os.path.join(tempfile.mkdtemp(), 'cards')
+
+from app import app  # noqa: E402
+from models import db  # noqa: E402
+import factories  # noqa: E402
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+@pytest.fixture(autouse=True)
+def transaction():
+    """Run the test in a transaction that's rolled back afterwards."""
+
+    connection = db.engine.connect()
+    outer = connection.begin()
+
+    session_options = dict(db.session.session_factory.kw)
+    db.session.remove()
+    # `binds` too, or Flask-SQLAlchemy routes model queries to the engine.
+    db.session.configure(bind=connection, binds={})
+
+    # Keep one app context (and so one session) for the whole test, rather
+    # than having each request's teardown replace the session.
+    context = app.app_context()
+    context.push()
+
+    db.session.begin_nested()
+    test_session = db.session()
+
+    # Sessions in other threads (e.g. groupcommit.py's) share the
+    # connection, but manage their own savepoints.
+    @event.listens_for(db.session, 'after_transaction_end')
+    def restart_savepoint(session, transaction):
+        if session is not test_session:
+            return
+        if transaction.nested and not transaction._parent.nested:
+            session.expire_all()
+            session.begin_nested()
+
+    try:
+        yield
+    finally:
+        event.remove(db.session, 'after_transaction_end', restart_savepoint)
+        # Roll back the savepoint too, not just the outer transaction.
+        db.session.rollback()
+        db.session.remove()
+        context.pop()
+
+        outer.rollback()
+        connection.close()
+
+        db.session.session_factory.kw.clear()
+        db.session.session_factory.kw.update(session_options)
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+@pytest.fixture
+def user():
+    return factories.user
+
+
+@pytest.fixture
+def message():
+    return factories.message
+
+
+@pytest.fixture
+def follow():
+    return factories.follow
+
+
+@pytest.fixture
+def dm():
+    return factories.dm
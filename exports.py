@@ -0,0 +1,218 @@
+"""Per-user data exports: a zip of NDJSON files, made in the background.
+
+A user (or an admin, for support) asks for an export, which adds a
+pending DataExport. `flask export-data` runs an `Exporter`, which claims
+pending exports one at a time and writes the user's profile, messages,
+likes, follows, followers and DMs to <directory>/<export id>.zip, one
+file per section and one JSON object per line. The user's exports page
+links to the zip once it's done.
+
+Rows are read from server-side cursors (`yield_per`) as plain column
+tuples, never ORM objects, and written straight into the zip, so an
+account with millions of rows takes as little memory as one with a
+handful.
+
+An export is claimed (marked running) in a short transaction of its own,
+so the exporter holds no lock or transaction id while it reads, and
+doesn't hold back the outbox (see outbox.horizon). If an exporter dies
+mid-export, the export is claimed again once it's been running
+`stale_after` seconds.
+"""
+
+import json
+import logging
+import os
+import time
+import zipfile
+from datetime import datetime, timedelta
+
+from models import db, DataExport, DirectMessage, Follows, Likes, Message
+from models import User
+
+log = logging.getLogger(__name__)
+
+
+def sections(user_id):
+    """(File name, query) for each part of `user_id`'s export."""
+
+    followed = db.aliased(User)
+    follower = db.aliased(User)
+    author = db.aliased(User)
+
+    return [
+        ('profile.ndjson', db.session
+         .query(User.id, User.username, User.email, User.image_url,
+                User.header_image_url, User.bio, User.location)
+         .filter(User.id == user_id)),
+
+        ('messages.ndjson', db.session
+         .query(Message.id, Message.text, Message.timestamp)
+         .filter(Message.user_id == user_id, Message.deleted_at.is_(None))
+         .order_by(Message.id)),
+
+        ('likes.ndjson', db.session
+         .query(Likes.message_id, author.username.label('author'),
+                Message.text, Message.timestamp)
+         .join(Message, Message.id == Likes.message_id)
+         .join(author, author.id == Message.user_id)
+         .filter(Likes.user_id == user_id, Message.deleted_at.is_(None))
+         .order_by(Likes.message_id)),
+
+        ('following.ndjson', db.session
+         .query(followed.id, followed.username,
+                Follows.created_at.label('followed_at'))
+         .join(followed, followed.id == Follows.user_being_followed_id)
+         .filter(Follows.user_following_id == user_id)
+         .order_by(Follows.created_at, Follows.user_being_followed_id)),
+
+        ('followers.ndjson', db.session
+         .query(follower.id, follower.username,
+                Follows.created_at.label('followed_at'))
+         .join(follower, follower.id == Follows.user_following_id)
+         .filter(Follows.user_being_followed_id == user_id)
+         .order_by(Follows.created_at, Follows.user_following_id)),
+
+        # By conversation, then time, as the DM indexes are.
+        ('direct_messages_sent.ndjson', db.session
+         .query(DirectMessage.id, DirectMessage.user_to_id,
+                DirectMessage.msg, DirectMessage.timestamp)
+         .filter(DirectMessage.user_from_id == user_id)
+         .order_by(DirectMessage.user_to_id, DirectMessage.id)),
+
+        ('direct_messages_received.ndjson', db.session
+         .query(DirectMessage.id, DirectMessage.user_from_id,
+                DirectMessage.msg, DirectMessage.timestamp)
+         .filter(DirectMessage.user_to_id == user_id)
+         .order_by(DirectMessage.user_from_id, DirectMessage.id)),
+    ]
+
+
+def encode(value):
+    """JSON for the values json doesn't handle itself (timestamps)."""
+
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Can't export {value!r}")
+
+
+def write(user_id, path, batch_size=1000):
+    """Write `user_id`'s export to a zip at `path`.
+
+    Returns the number of rows written, by file name.
+    """
+
+    counts = {}
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, query in sections(user_id):
+            counts[name] = 0
+            # Sizes aren't known up front, and may pass 2GB.
+            with archive.open(name, 'w', force_zip64=True) as f:
+                for row in query.yield_per(batch_size):
+                    f.write(json.dumps(row._asdict(), default=encode)
+                            .encode() + b'\n')
+                    counts[name] += 1
+
+    db.session.rollback()
+    return counts
+
+
+class Exporter:
+    """Makes the pending exports' zips in `directory`."""
+
+    def __init__(self, directory, batch_size=1000, interval=1.0,
+                 stale_after=3600, retention_hours=168):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.batch_size = batch_size
+        self.interval = interval
+        self.stale_after = timedelta(seconds=stale_after)
+        self.retention = timedelta(hours=retention_hours)
+
+    def path(self, export_id):
+        return os.path.join(self.directory, f'{export_id}.zip')
+
+    def claim(self):
+        """Mark the oldest waiting export running.
+
+        Returns its (id, user id), or None if nothing is waiting.
+        """
+
+        stale = datetime.utcnow() - self.stale_after
+        export = (db.session
+                  .query(DataExport.id, DataExport.user_id)
+                  .filter(db.or_(DataExport.status == 'pending',
+                                 db.and_(DataExport.status == 'running',
+                                         DataExport.started_at < stale)))
+                  .order_by(DataExport.id)
+                  .with_for_update(skip_locked=True)
+                  .first())
+
+        if export is not None:
+            self.finish(export.id, status='running',
+                        started_at=datetime.utcnow())
+        else:
+            db.session.rollback()
+        return export
+
+    def finish(self, export_id, **values):
+        (DataExport.query
+         .filter_by(id=export_id)
+         .update(values, synchronize_session=False))
+        db.session.commit()
+
+    def export(self, export_id, user_id):
+        """Make one export's zip, and mark it done (or failed).
+
+        Returns the rows written, by file name, or None if it failed.
+        """
+
+        path = self.path(export_id)
+        tmp = f'{path}.tmp'
+        try:
+            counts = write(user_id, tmp, self.batch_size)
+            os.replace(tmp, path)
+        except Exception:
+            db.session.rollback()
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            log.exception("Export %s failed", export_id)
+            self.finish(export_id, status='failed',
+                        finished_at=datetime.utcnow())
+            return None
+
+        self.finish(export_id, status='done', finished_at=datetime.utcnow(),
+                    size=os.path.getsize(path))
+        return counts
+
+    def expire(self, older_than):
+        """Delete exports finished before `older_than`, and stray zips.
+
+        A zip is stray once its export is gone, e.g. with its user.
+        Returns how many zips were deleted.
+        """
+
+        (DataExport.query
+         .filter(DataExport.finished_at < older_than)
+         .delete(synchronize_session=False))
+        db.session.commit()
+
+        exports = {f'{id}.zip' for id, in db.session.query(DataExport.id)}
+        db.session.rollback()
+
+        deleted = 0
+        for name in os.listdir(self.directory):
+            if name.endswith('.zip') and name not in exports:
+                os.unlink(os.path.join(self.directory, name))
+                deleted += 1
+        return deleted
+
+    def run(self):
+        """Export forever, pausing `interval` seconds whenever idle."""
+
+        while True:
+            export = self.claim()
+            if export is not None:
+                self.export(*export)
+            else:
+                self.expire(datetime.utcnow() - self.retention)
+                time.sleep(self.interval)
@@ -0,0 +1,58 @@
+"""Factories for test data.
+
+Each function makes one row with unique defaults, adds it to the session
+and flushes, so it has its id straight away. Keyword arguments override
+the defaults.
+"""
+
+import itertools
+
+from models import db, bcrypt, User, Message, Follows, DirectMessage
+
+# Factory users' password, hashed once at the lowest work factor.
+PASSWORD = "password"
+PASSWORD_HASH = bcrypt.generate_password_hash(PASSWORD, 4).decode('UTF-8')
+
+_sequence = itertools.count(1)
+
+
+def user(**kwargs):
+    """A user that can log in with PASSWORD."""
+
+    n = next(_sequence)
+    kwargs.setdefault('username', f"factory{n}")
+    kwargs.setdefault('email', f"factory{n}@test.com")
+    kwargs.setdefault('password', PASSWORD_HASH)
+
+    return add(User(**kwargs))
+
+
+def message(user=None, **kwargs):
+    """A message by `user` (a new user if not given)."""
+
+    kwargs.setdefault('text', f"warble {next(_sequence)}")
+    kwargs.setdefault('user_id', (user or globals()['user']()).id)
+
+    return add(Message(**kwargs))
+
+
+def follow(follower, followed):
+    """Have `follower` follow `followed`."""
+
+    return add(Follows(user_following_id=follower.id,
+                       user_being_followed_id=followed.id))
+
+
+def dm(sender, recipient, **kwargs):
+    """A direct message from `sender` to `recipient`."""
+
+    kwargs.setdefault('msg', f"dm {next(_sequence)}")
+
+    return add(DirectMessage(user_from_id=sender.id,
+                             user_to_id=recipient.id, **kwargs))
+
+
+def add(obj):
+    db.session.add(obj)
+    db.session.flush()
+    return obj
@@ -0,0 +1,165 @@
+"""Group commit for new messages and direct messages.
+
+With GROUP_COMMIT on, `messages_add` and the DM route hand their insert
+to a `GroupCommitWriter` instead of committing it themselves. Its thread
+takes the first write waiting, collects whatever else arrives in the
+next `window` seconds (up to `max_batch` writes), and inserts them all
+with one multi-row INSERT per table in a single transaction. Under a
+burst that's one commit, and one WAL flush, for the whole batch instead
+of one per request.
+
+`post_message` and `send_dm` block until the transaction holding their
+row has committed (or failed, which raises in the caller), so a response
+is still only sent once its write is durable. The batch is written in a
+savepoint; if that fails it's redone one write per savepoint, so one bad
+row (say, a DM to a user who was just deleted) only fails its own
+request and the rest still share a commit.
+
+Batches only form from concurrent requests in the same process, so this
+pays off with threaded workers (gunicorn's gthread), not one-request-at-
+a-time sync workers.
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import tags
+from ids import next_id
+from models import db, User, Message, DirectMessage, Notification
+from models import OutboxEvent
+
+
+class Write:
+    """A row waiting for the writer, and the caller waiting for it."""
+
+    def __init__(self, table, values):
+        self.table = table
+        self.values = values
+        self.done = Future()
+
+
+class GroupCommitWriter:
+    """Background thread that commits concurrent inserts together."""
+
+    def __init__(self, app, window=0.002, max_batch=200):
+        self.app = app
+        self.window = window
+        self.max_batch = max_batch
+
+        self.queue = None
+        self.thread = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def post_message(self, user_id, text):
+        """Insert a message. Returns its id once it's committed."""
+
+        id = next_id()
+        self.submit(Message.__table__,
+                    {"id": id, "user_id": user_id, "text": text})
+        return id
+
+    def send_dm(self, user_from_id, user_to_id, msg):
+        """Insert a DM and its notification, like User.send_dm.
+
+        Returns the DM's id once it's committed.
+        """
+
+        id = next_id()
+        self.submit(DirectMessage.__table__,
+                    {"id": id, "user_from_id": user_from_id,
+                     "user_to_id": user_to_id, "msg": msg})
+        return id
+
+    def submit(self, table, values):
+        write = Write(table, values)
+        self.start().put(write)
+        # Re-raises whatever the write failed with.
+        return write.done.result()
+
+    def start(self):
+        """The queue of the thread for this process, starting it if needed."""
+
+        with self.lock:
+            # A thread started before a fork doesn't exist in the child.
+            if self.pid != os.getpid():
+                self.queue = queue.Queue()
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+                self.pid = os.getpid()
+            return self.queue
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            self.flush(batch)
+
+    def flush(self, batch):
+        """Write `batch` in one transaction and tell each caller how it went."""
+
+        failed = {}
+        with self.app.app_context():
+            try:
+                try:
+                    with db.session.begin_nested():
+                        self.write(batch)
+                except Exception:
+                    # Redo it one write at a time, still in the same
+                    # transaction, so a bad row only fails its own request.
+                    for write in batch:
+                        try:
+                            with db.session.begin_nested():
+                                self.write([write])
+                        except Exception as exc:
+                            failed[write] = exc
+
+                db.session.commit()
+            except Exception as exc:
+                db.session.rollback()
+                for write in batch:
+                    write.done.set_exception(exc)
+                return
+
+        for write in batch:
+            if write in failed:
+                write.done.set_exception(failed[write])
+            else:
+                write.done.set_result(write.values["id"])
+
+    def write(self, batch):
+        messages = [write.values for write in batch
+                    if write.table is Message.__table__]
+        dms = [write.values for write in batch
+               if write.table is DirectMessage.__table__]
+
+        if messages:
+            db.session.execute(Message.__table__.insert().values(messages))
+            tags.index([(message["id"], message["text"])
+                        for message in messages])
+            OutboxEvent.emit('message.created', [
+                {"id": message["id"], "user_id": message["user_id"]}
+                for message in messages])
+
+        if dms:
+            db.session.execute(DirectMessage.__table__.insert().values(dms))
+            OutboxEvent.emit('dm.sent', [
+                {key: dm[key] for key in ("id", "user_from_id", "user_to_id")}
+                for dm in dms])
+            for dm in dms:
+                Notification.notify(
+                    'dm', dm["user_from_id"],
+                    db.select([User.id, db.cast(db.null(), db.BigInteger)])
+                    .where(User.id == dm["user_to_id"]))
@@ -0,0 +1,40 @@
+"""Gunicorn settings (read automatically from the working directory)."""
+
+import os
+
+from ids import HOST_WORKERS, WEB_WORKERS, host_id
+
+
+def pre_fork(server, worker):
+    """Pick the worker's id for time-ordered ids (see ids.py).
+
+    The lowest one no live worker holds, so a respawned worker reuses a
+    dead one's rather than sharing a live one's. Set WARBLER_HOST_ID
+    (0-31) to a different value on each host when running more than one.
+    """
+
+    held = {other.warbler_slot for other in server.WORKERS.values()}
+    free = [slot for slot in range(WEB_WORKERS) if slot not in held]
+    if not free:
+        raise RuntimeError(f"More than {WEB_WORKERS} workers")
+    worker.warbler_slot = free[0]
+
+
+def post_fork(server, worker):
+    """Hand the worker the id pre_fork picked."""
+
+    os.environ['WARBLER_WORKER_ID'] = str(
+        host_id() * HOST_WORKERS + worker.warbler_slot)
+
+
+def post_worker_init(worker):
+    """Load every template before the worker takes requests.
+
+    They come from the compiled template cache (see templating.py), so
+    this is quick, and the first requests don't pay for it.
+    """
+
+    from app import app
+    from templating import preload
+
+    preload(app.jinja_env)
@@ -0,0 +1,156 @@
+"""Time-ordered 64-bit ids for messages and direct messages.
+
+Snowflake-style layout, most significant bits first:
+
+    41 bits  milliseconds since EPOCH
+    10 bits  worker id
+    12 bits  per-millisecond sequence
+
+so ids sort in creation order, can be generated by any worker without
+talking to the database, and `ORDER BY id` gives a timeline on a single
+indexed key. Ids from before the switch (small serial numbers) sort before
+every generated id.
+
+Each host (WARBLER_HOST_ID, 0-31) has HOST_WORKERS worker ids. The
+first WEB_WORKERS go to gunicorn's workers: gunicorn.conf.py gives each
+new worker the lowest one no live worker holds, in WARBLER_WORKER_ID.
+Any other process (a flask command, say) claims one of the rest by
+locking its file in LOCK_DIR, and holds it until it exits.
+"""
+
+import fcntl
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+EPOCH = datetime(2010, 1, 1, tzinfo=timezone.utc)
+EPOCH_MS = int(EPOCH.timestamp() * 1000)
+
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+
+MAX_WORKER = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+HOST_WORKERS = 32
+WEB_WORKERS = 24
+
+LOCK_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+def id_for_time(when, worker=0, sequence=0):
+    """The id for `when` (an aware or naive-UTC datetime) and position."""
+
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    ms = int(when.timestamp() * 1000) - EPOCH_MS
+    if ms < 0:
+        raise ValueError(f"{when} is before the id epoch")
+
+    return (ms << (WORKER_BITS + SEQUENCE_BITS) |
+            worker << SEQUENCE_BITS |
+            sequence)
+
+
+def time_of(id):
+    """The naive UTC datetime a generated id was created at."""
+
+    ms = (id >> (WORKER_BITS + SEQUENCE_BITS)) + EPOCH_MS
+    return datetime.utcfromtimestamp(ms / 1000)
+
+
+class SnowflakeGenerator:
+    """Generates unique, increasing ids for one worker."""
+
+    def __init__(self, worker):
+        if not 0 <= worker <= MAX_WORKER:
+            raise ValueError(f"worker must be between 0 and {MAX_WORKER}")
+
+        self.worker = worker
+        self.last_ms = -1
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            # Never go backwards, even if the clock does.
+            ms = max(int(time.time() * 1000) - EPOCH_MS, self.last_ms)
+
+            if ms == self.last_ms:
+                self.sequence = (self.sequence + 1) & MAX_SEQUENCE
+                if self.sequence == 0:
+                    # 4096 ids this millisecond; wait for the next one.
+                    while ms <= self.last_ms:
+                        ms = int(time.time() * 1000) - EPOCH_MS
+                    ms = max(ms, self.last_ms + 1)
+            else:
+                self.sequence = 0
+
+            self.last_ms = ms
+
+            return (ms << (WORKER_BITS + SEQUENCE_BITS) |
+                    self.worker << SEQUENCE_BITS |
+                    self.sequence)
+
+
+def host_id():
+    """This host's number, from WARBLER_HOST_ID."""
+
+    return (int(os.environ.get('WARBLER_HOST_ID', 0)) %
+            ((MAX_WORKER + 1) // HOST_WORKERS))
+
+
+# The open lock file holding this process's claimed worker id.
+_claimed = None
+
+
+def claim_worker_id():
+    """Lock a free non-gunicorn worker id on this host, and return it.
+
+    The lock goes with the process (lockf locks aren't inherited), so the
+    id is free again once it exits, however it exits.
+    """
+
+    global _claimed
+
+    first = host_id() * HOST_WORKERS
+    for worker in range(first + WEB_WORKERS, first + HOST_WORKERS):
+        f = open(os.path.join(LOCK_DIR, f'warbler-worker-{worker}.lock'), 'a')
+        try:
+            fcntl.lockf(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            continue
+        _claimed = f
+        return worker
+
+    raise RuntimeError(f"All {HOST_WORKERS - WEB_WORKERS} worker ids for "
+                       f"processes outside gunicorn are taken")
+
+
+def worker_id():
+    """This process's worker id (see module docstring)."""
+
+    worker = os.environ.get('WARBLER_WORKER_ID')
+    if worker is not None:
+        return int(worker) & MAX_WORKER
+    return claim_worker_id()
+
+
+_generator = None
+_generator_pid = None
+
+
+def next_id():
+    """A new id. Used as the default for id columns."""
+
+    global _generator, _generator_pid
+
+    # A generator created before a fork would hand out the parent's ids.
+    if _generator_pid != os.getpid():
+        _generator = SnowflakeGenerator(worker_id())
+        _generator_pid = os.getpid()
+
+    return _generator()
@@ -0,0 +1,311 @@
+"""Resizing proxy for user avatars and header images.
+
+Templates link images through `/images/<size>?url=...&sig=...` (see
+`resized`), and the proxy fetches the original once, shrinks it to one of
+a few fixed sizes and keeps the result in a size-bounded disk cache. The
+signature is an HMAC of the URL, so the proxy only fetches URLs the
+templates linked to.
+"""
+
+import hashlib
+import hmac
+import http.client
+import io
+import ipaddress
+import os
+import socket
+import ssl
+import tempfile
+import threading
+from urllib.parse import urljoin, urlparse
+
+from flask import current_app, url_for
+from PIL import Image, ImageOps
+
+# Named sizes used by the templates, at twice their CSS size for HiDPI
+# screens. Avatars are cropped to squares; headers keep their aspect ratio
+# and are only limited in width.
+SIZES = {
+    'avatar-sm': (96, 96),      # .timeline-image, navbar
+    'avatar-md': (140, 140),    # .card-image
+    'avatar-lg': (400, 400),    # #profile-avatar
+    'header-sm': (700, None),   # .card-hero
+    'header-lg': (1920, None),  # #warbler-hero
+}
+
+# What to show for users without an image, matching the User model defaults.
+DEFAULT_IMAGES = {
+    'avatar': "/static/images/default-pic.png",
+    'header': "/static/images/warbler-hero.jpg",
+}
+
+MAX_SOURCE_BYTES = 10 * 1024 * 1024
+
+# Redirects followed when fetching an image; each hop is checked again.
+MAX_REDIRECTS = 3
+
+REDIRECTS = (301, 302, 303, 307, 308)
+
+
+class ImageError(Exception):
+    """The source image couldn't be fetched or decoded."""
+
+
+def sign(url):
+    """The signature `resized` gives `url`, keyed on the app's secret key."""
+
+    key = current_app.secret_key
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+    return hmac.new(key, url.encode('utf-8'),
+                    hashlib.sha256).hexdigest()[:32]
+
+
+def public_address(host, port):
+    """The address to connect to for `host`.
+
+    Refuses hosts with any private, loopback or link-local address, so
+    the proxy can't be pointed at internal services.
+    """
+
+    try:
+        addresses = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        raise ImageError(str(e))
+
+    for *_, sockaddr in addresses:
+        if not ipaddress.ip_address(sockaddr[0]).is_global:
+            raise ImageError(f"Refusing to fetch internal address: {host}")
+
+    return addresses[0][4][0]
+
+
+class PinnedHTTPConnection(http.client.HTTPConnection):
+    """An HTTP connection to `address`, whatever `host` resolves to now."""
+
+    def __init__(self, host, address, **kwargs):
+        super().__init__(host, **kwargs)
+        self.address = address
+
+    def connect(self):
+        self.sock = socket.create_connection((self.address, self.port),
+                                             self.timeout)
+
+
+class PinnedHTTPSConnection(http.client.HTTPSConnection):
+    """An HTTPS connection to `address`, with `host`'s certificate."""
+
+    def __init__(self, host, address, **kwargs):
+        self.ssl_context = ssl.create_default_context()
+        super().__init__(host, context=self.ssl_context, **kwargs)
+        self.address = address
+
+    def connect(self):
+        sock = socket.create_connection((self.address, self.port),
+                                        self.timeout)
+        self.sock = self.ssl_context.wrap_socket(sock,
+                                                 server_hostname=self.host)
+
+
+def fetch_url(url, timeout=5):
+    """Default fetcher: download `url` over HTTP(S).
+
+    Connects to the address `public_address` checked, rather than letting
+    the host be looked up again, and checks every redirect the same way.
+    """
+
+    for _ in range(MAX_REDIRECTS + 1):
+        parsed = urlparse(url)
+        if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+            raise ImageError(f"Not an http(s) URL: {url}")
+
+        try:
+            port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        except ValueError as e:
+            raise ImageError(str(e))
+
+        connection = (PinnedHTTPSConnection if parsed.scheme == 'https'
+                      else PinnedHTTPConnection)(
+            parsed.hostname, public_address(parsed.hostname, port),
+            port=port, timeout=timeout)
+        path = (parsed.path or '/') + (f'?{parsed.query}'
+                                       if parsed.query else '')
+
+        try:
+            connection.request('GET', path,
+                               headers={'User-Agent': 'Warbler'})
+            resp = connection.getresponse()
+            location = resp.getheader('Location')
+            if resp.status in REDIRECTS and location:
+                url = urljoin(url, location)
+                continue
+            if resp.status != 200:
+                raise ImageError(f"HTTP {resp.status}: {url}")
+            data = resp.read(MAX_SOURCE_BYTES + 1)
+        except (OSError, http.client.HTTPException) as e:
+            raise ImageError(str(e))
+        finally:
+            connection.close()
+
+        if len(data) > MAX_SOURCE_BYTES:
+            raise ImageError(f"Image too large: {url}")
+
+        return data
+
+    raise ImageError(f"Too many redirects: {url}")
+
+
+def resize(data, size):
+    """Shrink image bytes to the named size. Returns (bytes, mimetype)."""
+
+    width, height = SIZES[size]
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        image = ImageOps.exif_transpose(image)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise ImageError(str(e))
+
+    if height:
+        image = ImageOps.fit(image, (width, height), Image.LANCZOS)
+    else:
+        image.thumbnail((width, width * 4), Image.LANCZOS)
+
+    out = io.BytesIO()
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image.save(out, 'PNG', optimize=True)
+        return out.getvalue(), 'image/png'
+
+    image.convert('RGB').save(out, 'JPEG', quality=85, optimize=True,
+                              progressive=True)
+    return out.getvalue(), 'image/jpeg'
+
+
+class ImageCache:
+    """Disk cache of resized images with least-recently-used eviction.
+
+    Entries are stored under a hash of their key and touched on every hit,
+    so file modification times order them by last use. When the total size
+    passes `max_bytes` the oldest files are removed until it drops back to
+    90% of the limit. The directory can be shared by every worker.
+    """
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = None
+        self.lock = threading.Lock()
+
+    def path(self, key):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def get(self, key):
+        """Path of the cached entry for `key`, or None."""
+
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, data):
+        """Store `data` under `key` and return its path."""
+
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+        with self.lock:
+            if self.size is None:
+                self.size = sum(size for _, size, _ in self.entries())
+            else:
+                self.size += len(data)
+
+            if self.size > self.max_bytes:
+                self.evict()
+
+        return path
+
+    def entries(self):
+        """(path, bytes, last used) for every cached file."""
+
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def evict(self):
+        """Remove least recently used files until under 90% of the limit."""
+
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        self.size = sum(size for _, size, _ in entries)
+
+        for path, size, _ in entries:
+            if self.size <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+
+
+class ImageProxy:
+    """Fetches, resizes and caches images by (source URL, size name).
+
+    `fetcher` takes a URL and returns the image bytes; tests swap in a
+    local stand-in. URLs under `/static/` are read straight from
+    `static_folder` instead.
+    """
+
+    def __init__(self, cache, fetcher=fetch_url, static_folder=None):
+        self.cache = cache
+        self.fetcher = fetcher
+        self.static_folder = static_folder
+
+    def read_source(self, url):
+        if url.startswith('/static/') and self.static_folder:
+            root = os.path.realpath(self.static_folder)
+            path = os.path.realpath(
+                os.path.join(root, url[len('/static/'):]))
+            if not path.startswith(root + os.sep):
+                raise ImageError(f"Not a static file: {url}")
+            try:
+                with open(path, 'rb') as f:
+                    return f.read()
+            except OSError as e:
+                raise ImageError(str(e))
+
+        return self.fetcher(url)
+
+    def get(self, url, size):
+        """Return (path, mimetype) of `url` resized to `size`."""
+
+        key = f"{size}\n{url}"
+        path = self.cache.get(key)
+
+        if path is None:
+            data, _ = resize(self.read_source(url), size)
+            path = self.cache.put(key, data)
+
+        with open(path, 'rb') as f:
+            png = f.read(8) == b'\x89PNG\r\n\x1a\n'
+
+        return path, 'image/png' if png else 'image/jpeg'
+
+
+def resized(url, size):
+    """URL of `url` (a user's image_url or header_image_url) at `size`."""
+
+    url = url or DEFAULT_IMAGES[size.split('-')[0]]
+    return url_for('image_proxy', size=size, url=url, sig=sign(url))
@@ -0,0 +1,74 @@
+"""Apply the SQL files in migrations/ that haven't been applied yet.
+
+`migrate` runs each file once, in name order, and records it in the
+schema_migrations table. Like psql, it runs a file's statements one at a
+time outside any transaction: files wrap what must be atomic in
+BEGIN/COMMIT, and can build indexes CONCURRENTLY. Every file is written
+to be re-runnable (IF NOT EXISTS and the like), so a database that
+db.create_all() made already up to date can have them all applied.
+
+New tables and indexes go in models.py too, so db.create_all() makes
+them for new databases; the file brings existing ones up to date.
+"""
+
+import os
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'migrations')
+
+# Held while migrating, so two deploys can't apply a file at once.
+LOCK_ID = 0x77617262
+
+CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        name TEXT PRIMARY KEY,
+        applied_at TIMESTAMP NOT NULL DEFAULT timezone('utc', now())
+    )"""
+
+
+def statements(sql):
+    """The statements in migration file text, without comments."""
+
+    lines = [line for line in sql.splitlines()
+             if not line.lstrip().startswith('--')]
+    return [statement.strip() for statement in '\n'.join(lines).split(';')
+            if statement.strip()]
+
+
+def migrate(engine, directory=MIGRATIONS):
+    """Apply the pending migrations in `directory`. Returns their names."""
+
+    names = sorted(name for name in os.listdir(directory)
+                   if name.endswith('.sql'))
+
+    applied = []
+    with engine.connect() as connection:
+        connection = connection.execution_options(
+            isolation_level='AUTOCOMMIT')
+        connection.execute(f"SELECT pg_advisory_lock({LOCK_ID})")
+        try:
+            connection.execute(CREATE_TABLE)
+            done = {name for name, in connection.execute(
+                "SELECT name FROM schema_migrations")}
+
+            for name in names:
+                if name in done:
+                    continue
+                with open(os.path.join(directory, name)) as f:
+                    for statement in statements(f.read()):
+                        connection.execute(statement)
+                connection.execute(
+                    "INSERT INTO schema_migrations (name) VALUES (%(name)s)",
+                    {'name': name})
+                applied.append(name)
+        except Exception:
+            # A statement that failed between a file's BEGIN and COMMIT
+            # leaves its transaction aborted, which would fail the
+            # unlock too (hiding this error). ROLLBACK outside a
+            # transaction is only a warning.
+            connection.execute("ROLLBACK")
+            connection.execute(f"SELECT pg_advisory_unlock({LOCK_ID})")
+            raise
+        connection.execute(f"SELECT pg_advisory_unlock({LOCK_ID})")
+
+    return applied
@@ -0,0 +1,37 @@
+-- Switch messages and direct messages to time-ordered 64-bit ids (ids.py)
+-- and give their timestamps real server-side defaults.
+--
+-- run like:
+--
+--    psql warbler -f migrations/0001_snowflake_ids.sql
+--
+-- Existing rows keep their serial ids. Those are smaller than any
+-- generated id and were handed out in insertion order, so ordering by id
+-- still puts them in the order they were written, before every new row.
+-- Their timestamps can't be repaired: the old default was evaluated once
+-- per process, so the stored values are the worker start times.
+
+BEGIN;
+
+ALTER TABLE messages ALTER COLUMN id DROP DEFAULT;
+ALTER TABLE messages ALTER COLUMN id TYPE BIGINT;
+DROP SEQUENCE IF EXISTS messages_id_seq;
+
+ALTER TABLE likes ALTER COLUMN message_id TYPE BIGINT;
+ALTER TABLE trending_likes ALTER COLUMN message_id TYPE BIGINT;
+
+ALTER TABLE direct_messages ALTER COLUMN id DROP DEFAULT;
+ALTER TABLE direct_messages ALTER COLUMN id TYPE BIGINT;
+DROP SEQUENCE IF EXISTS direct_messages_id_seq;
+
+ALTER TABLE messages
+    ALTER COLUMN timestamp SET DEFAULT timezone('utc', now());
+ALTER TABLE direct_messages
+    ALTER COLUMN timestamp SET DEFAULT timezone('utc', now());
+
+CREATE INDEX IF NOT EXISTS ix_messages_user_id_id
+    ON messages (user_id, id);
+CREATE INDEX IF NOT EXISTS ix_direct_messages_from_to_id
+    ON direct_messages (user_from_id, user_to_id, id);
+
+COMMIT;
@@ -0,0 +1,16 @@
+-- Unread counters for the notifications table (models.Notification).
+--
+-- run like:
+--
+--    psql warbler -f migrations/0002_notifications.sql
+--
+-- The notifications table itself is new, so db.create_all() creates it.
+-- Existing users start with nothing unread.
+
+BEGIN;
+
+ALTER TABLE users
+    ADD COLUMN IF NOT EXISTS unread_dms INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS unread_notifications INTEGER NOT NULL DEFAULT 0;
+
+COMMIT;
@@ -0,0 +1,21 @@
+-- Record when each follow was made, for follower/following pages ordered
+-- by follow recency (models.Follows.page).
+--
+-- run like:
+--
+--    psql warbler -f migrations/0003_follows_created_at.sql
+--
+-- Existing follows get the time the migration runs; among themselves
+-- they're ordered by user id. The indexes are built CONCURRENTLY, so
+-- this mustn't run inside a transaction, and follows stays writable
+-- while they build.
+
+ALTER TABLE follows
+    ADD COLUMN IF NOT EXISTS created_at TIMESTAMP NOT NULL
+    DEFAULT timezone('utc', now());
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_follows_followed_created_at
+    ON follows (user_being_followed_id, created_at, user_following_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_follows_following_created_at
+    ON follows (user_following_id, created_at, user_being_followed_id);
@@ -0,0 +1,23 @@
+-- Indexes for the hot queries that had none: who liked a message (and
+-- the cascade when one is deleted), the DM conversations a user has
+-- received, and substring search on usernames.
+--
+-- run like:
+--
+--    flask migrate
+--
+-- or psql warbler -f migrations/0004_hot_path_indexes.sql. The indexes
+-- are built CONCURRENTLY, so this mustn't run inside a transaction, and
+-- the tables stay writable while they build. If a build fails, drop the
+-- INVALID index it leaves behind before running this again.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_likes_message_id_user_id
+    ON likes (message_id, user_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_direct_messages_to_from_id
+    ON direct_messages (user_to_id, user_from_id, id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_username_trgm
+    ON users USING gin (username gin_trgm_ops);
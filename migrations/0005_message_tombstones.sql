@@ -0,0 +1,21 @@
+-- Soft delete for messages: deleted ones get a deleted_at and are hidden
+-- until `flask purge-messages` removes them (models.Message.purge).
+--
+-- run like:
+--
+--    flask migrate
+--
+-- Adding a nullable column without a default doesn't rewrite the table.
+-- The timeline index is replaced by one that includes deleted_at, so
+-- deleted messages are skipped from the index alone. The indexes are
+-- built CONCURRENTLY, so this mustn't run inside a transaction.
+
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_user_id_id_deleted_at
+    ON messages (user_id, id, deleted_at);
+
+DROP INDEX CONCURRENTLY IF EXISTS ix_messages_user_id_id;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_deleted_at
+    ON messages (deleted_at) WHERE deleted_at IS NOT NULL;
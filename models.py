@@ -4,6 +4,10 @@ from datetime import datetime
 
 from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import JSONB, insert
+
+from ids import next_id
 
 bcrypt = Bcrypt()
 db = SQLAlchemy()
@@ -18,7 +22,21 @@ class DirectMessage(db.Model):
 
     __tablename__ = 'direct_messages'
 
-    id = db.Column(db.Integer, primary_key=True)
+    __table_args__ = (
+        # Seeks down one side of a conversation, newest first.
+        db.Index('ix_direct_messages_from_to_id',
+                 'user_from_id', 'user_to_id', 'id'),
+        # And down the other, for the conversations a user has received.
+        db.Index('ix_direct_messages_to_from_id',
+                 'user_to_id', 'user_from_id', 'id'),
+    )
+
+    id = db.Column(
+        db.BigInteger,
+        primary_key=True,
+        autoincrement=False,
+        default=next_id,
+    )
 
     user_from_id = db.Column(
         db.Integer,
@@ -34,7 +52,8 @@ class DirectMessage(db.Model):
 
     timestamp = db.Column(
         db.DateTime,
-        default=datetime.utcnow()
+        default=datetime.utcnow,
+        server_default=db.text("timezone('utc', now())"),
     )
 
 # app.py -> text_msg = MsgWithinDM("HELLO", creator = g.user.id)
@@ -61,12 +80,122 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # Set by the database, since follow() inserts from a SELECT.
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        server_default=db.text("timezone('utc', now())"),
+    )
+
+    # For follower and following pages, newest follows first.
+    __table_args__ = (
+        db.Index('ix_follows_followed_created_at', 'user_being_followed_id',
+                 'created_at', 'user_following_id'),
+        db.Index('ix_follows_following_created_at', 'user_following_id',
+                 'created_at', 'user_being_followed_id'),
+    )
+
+    @classmethod
+    def page(cls, user_id, viewer_id, followers=False, before=None,
+             limit=60):
+        """One page of the users `user_id` follows (or their followers).
+
+        Newest follow first, as card rows with two more columns:
+        followed_at, when the follow was made, and viewer_follows,
+        whether `viewer_id` follows that user. `before` is a
+        (followed_at, user id) pair from the end of the previous page.
+        """
+
+        if followers:
+            listed, other = cls.user_following_id, cls.user_being_followed_id
+        else:
+            listed, other = cls.user_being_followed_id, cls.user_following_id
+
+        viewer_follow = db.aliased(cls)
+        query = (db.session
+                 .query(User.id, User.username, User.image_url,
+                        User.header_image_url, User.bio,
+                        cls.created_at.label('followed_at'),
+                        viewer_follow.user_following_id.isnot(None)
+                        .label('viewer_follows'))
+                 .select_from(cls)
+                 .join(User, User.id == listed)
+                 .outerjoin(viewer_follow, db.and_(
+                     viewer_follow.user_being_followed_id == User.id,
+                     viewer_follow.user_following_id == viewer_id))
+                 .filter(other == user_id))
+
+        if before:
+            query = query.filter(db.tuple_(cls.created_at, listed) <
+                                 db.tuple_(*before))
+
+        return (query
+                .order_by(cls.created_at.desc(), listed.desc())
+                .limit(limit)
+                .all())
+
+    @classmethod
+    def follow(cls, follower_id, user_ids):
+        """Have `follower_id` follow every existing user in `user_ids`.
+
+        Issues a single INSERT ... SELECT ... ON CONFLICT DO NOTHING, so
+        following someone twice is a no-op and the follower's existing
+        follows are never loaded. Returns the ids of the newly followed
+        users.
+        """
+
+        if not user_ids:
+            return []
+
+        followed = db.select([
+            db.literal(follower_id, db.Integer),
+            User.id,
+        ]).where(db.and_(User.id.in_(user_ids), User.id != follower_id))
+
+        stmt = (insert(cls.__table__)
+                .from_select(['user_following_id', 'user_being_followed_id'],
+                             followed)
+                .on_conflict_do_nothing()
+                .returning(cls.user_being_followed_id))
+
+        followed = [id for id, in db.session.execute(stmt)]
+        OutboxEvent.emit('follow.added', [
+            {"follower_id": follower_id, "followed_id": id}
+            for id in followed])
+        return followed
+
+    @classmethod
+    def unfollow(cls, follower_id, user_ids):
+        """Have `follower_id` stop following every user in `user_ids`.
+
+        Returns the ids of the users no longer followed.
+        """
+
+        if not user_ids:
+            return []
+
+        stmt = (cls.__table__.delete()
+                .where(db.and_(cls.user_following_id == follower_id,
+                               cls.user_being_followed_id.in_(user_ids)))
+                .returning(cls.user_being_followed_id))
+
+        unfollowed = [id for id, in db.session.execute(stmt)]
+        OutboxEvent.emit('follow.removed', [
+            {"follower_id": follower_id, "followed_id": id}
+            for id in unfollowed])
+        return unfollowed
+
 
 class Likes(db.Model):
     """ Connection of user <-> liked messages """
 
     __tablename__ = 'likes'
 
+    __table_args__ = (
+        # Who liked a message, and the cascade when one is deleted.
+        db.Index('ix_likes_message_id_user_id', 'message_id', 'user_id'),
+    )
+
     user_id = db.Column(
         db.Integer,
         db.ForeignKey('users.id', ondelete="cascade"),
@@ -74,9 +203,121 @@ class Likes(db.Model):
     )
 
     message_id = db.Column(
+        db.BigInteger,
+        db.ForeignKey('messages.id', ondelete="cascade"),
+        primary_key=True,
+    )
+
+    @classmethod
+    def like(cls, user_id, message_ids):
+        """Have `user_id` like every message in `message_ids`.
+
+        Messages written by the user themselves (and ids that don't exist
+        or are deleted) are skipped, and liking a message twice is a no-op.
+        Returns the ids of the newly liked messages.
+        """
+
+        if not message_ids:
+            return []
+
+        liked = db.select([
+            db.literal(user_id, db.Integer),
+            Message.id,
+        ]).where(db.and_(Message.id.in_(message_ids),
+                         Message.user_id != user_id,
+                         Message.deleted_at.is_(None)))
+
+        stmt = (insert(cls.__table__)
+                .from_select(['user_id', 'message_id'], liked)
+                .on_conflict_do_nothing()
+                .returning(cls.message_id))
+
+        liked = [id for id, in db.session.execute(stmt)]
+        OutboxEvent.emit('like.added', [
+            {"user_id": user_id, "message_id": id} for id in liked])
+        return liked
+
+    @classmethod
+    def unlike(cls, user_id, message_ids):
+        """Remove `user_id`'s likes of `message_ids`.
+
+        Returns the ids of the messages no longer liked.
+        """
+
+        if not message_ids:
+            return []
+
+        stmt = (cls.__table__.delete()
+                .where(db.and_(cls.user_id == user_id,
+                               cls.message_id.in_(message_ids)))
+                .returning(cls.message_id))
+
+        unliked = [id for id, in db.session.execute(stmt)]
+        OutboxEvent.emit('like.removed', [
+            {"user_id": user_id, "message_id": id} for id in unliked])
+        return unliked
+
+
+class TrendingBucket(db.Model):
+    """Net likes a message got during one trending time bucket."""
+
+    __tablename__ = 'trending_likes'
+
+    message_id = db.Column(
+        db.BigInteger,
+        db.ForeignKey('messages.id', ondelete="cascade"),
+        primary_key=True,
+    )
+
+    bucket = db.Column(
+        db.Integer,
+        primary_key=True,
+        index=True,
+    )
+
+    likes = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+
+class MessageTag(db.Model):
+    """A hashtag used in a message."""
+
+    __tablename__ = 'message_tags'
+
+    tag = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    # Indexed for the cascade when a message is deleted.
+    message_id = db.Column(
+        db.BigInteger,
+        db.ForeignKey('messages.id', ondelete="cascade"),
+        primary_key=True,
+        index=True,
+    )
+
+
+class Mention(db.Model):
+    """A user @mentioned in a message."""
+
+    __tablename__ = 'mentions'
+
+    user_id = db.Column(
         db.Integer,
+        db.ForeignKey('users.id', ondelete="cascade"),
+        primary_key=True,
+    )
+
+    # Indexed for the cascade when a message is deleted.
+    message_id = db.Column(
+        db.BigInteger,
         db.ForeignKey('messages.id', ondelete="cascade"),
         primary_key=True,
+        index=True,
     )
 
 
@@ -85,6 +326,13 @@ class User(db.Model):
 
     __tablename__ = 'users'
 
+    __table_args__ = (
+        # Substring search on usernames (LIKE '%...%'); needs pg_trgm.
+        db.Index('ix_users_username_trgm', 'username',
+                 postgresql_using='gin',
+                 postgresql_ops={'username': 'gin_trgm_ops'}),
+    )
+
     id = db.Column(
         db.Integer,
         primary_key=True,
@@ -112,18 +360,20 @@ class User(db.Model):
         default="/static/images/warbler-hero.jpg"
     )
 
-    bio = db.Column(
+    # Deferred: only loaded when accessed (or undeferred by group), so
+    # queries for user cards and timelines don't carry them.
+    bio = db.deferred(db.Column(
         db.Text,
-    )
+    ), group='profile')
 
-    location = db.Column(
+    location = db.deferred(db.Column(
         db.Text,
-    )
+    ), group='profile')
 
-    password = db.Column(
+    password = db.deferred(db.Column(
         db.Text,
         nullable=False,
-    )
+    ), group='credentials')
 
     admin = db.Column(
         db.Boolean,
@@ -131,9 +381,38 @@ class User(db.Model):
         default=False
     )
 
-    liked_messages = db.relationship('Message', secondary='likes')
+    # Unread notifications, kept up to date by Notification.notify and
+    # Notification.mark_read so the navbar badges never need a count.
+    unread_dms = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    unread_notifications = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
 
-    messages = db.relationship('Message', cascade="all, delete", passive_deletes=True, order_by='Message.timestamp.desc()')
+    liked_messages = db.relationship(
+        'Message',
+        secondary='likes',
+        primaryjoin='User.id == Likes.user_id',
+        secondaryjoin='and_(Likes.message_id == Message.id, '
+                      'Message.deleted_at.is_(None))',
+    )
+
+    messages = db.relationship(
+        'Message',
+        primaryjoin='and_(User.id == Message.user_id, '
+                    'Message.deleted_at.is_(None))',
+        cascade="all, delete",
+        passive_deletes=True,
+        order_by='Message.id.desc()',
+    )
     """
     relationship.primaryjoin argument, as well as the relationship.
     secondaryjoin argument in the case when a “secondary” table is used.
@@ -169,20 +448,50 @@ class User(db.Model):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
     def is_followed_by(self, other_user):
-        """Is this user followed by `other_user`?"""
+        """Is this user followed by `other_user` (a User or card row)?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
+        found_user_list = [user for user in self.followers if user.id == other_user.id]
         return len(found_user_list) == 1
 
     def is_following(self, other_user):
-        """Is this user following `other_use`?"""
+        """Is this user following `other_use` (a User or card row)?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
+        found_user_list = [user for user in self.following if user.id == other_user.id]
         return len(found_user_list) == 1
 
+    @classmethod
+    def cards(cls, viewer_id=None):
+        """Query for just the columns a user card shows.
+
+        Yields lightweight named rows (row.id, row.username, ...) instead
+        of User instances, so listing many users skips the password hash,
+        email and other columns and the cost of building ORM objects.
+        With a `viewer_id`, rows have a viewer_follows column too, as
+        Follows.page's do, so cards can show Follow or Unfollow without
+        loading who the viewer follows.
+        """
+
+        query = db.session.query(cls.id, cls.username, cls.image_url,
+                                 cls.header_image_url, cls.bio)
+        if viewer_id is None:
+            return query
+
+        return (query
+                .add_columns(Follows.user_following_id.isnot(None)
+                             .label('viewer_follows'))
+                .outerjoin(Follows, db.and_(
+                    Follows.user_being_followed_id == cls.id,
+                    Follows.user_following_id == viewer_id)))
+
     def send_dm(self, other_user, msg):
-        new_dm = DirectMessage(user_from_id=self.id, user_to_id=other_user, msg=msg)
+        new_dm = DirectMessage(id=next_id(), user_from_id=self.id, user_to_id=other_user, msg=msg)
         db.session.add(new_dm)
+        OutboxEvent.emit('dm.sent', [{"id": new_dm.id, "user_from_id": self.id,
+                                      "user_to_id": other_user}])
+        Notification.notify(
+            'dm', self.id,
+            db.select([User.id, db.cast(db.null(), db.BigInteger)])
+            .where(User.id == other_user))
         return new_dm
 
     @classmethod
@@ -204,6 +513,48 @@ class User(db.Model):
         db.session.add(user)
         return user
 
+    @classmethod
+    def delete(cls, user_id):
+        """Delete user `user_id` and everything that goes with them.
+
+        Their likes, the likes of their messages and their follows both
+        ways are deleted here rather than by the cascade, so each gets
+        its outbox event, as do their messages. A final user.deleted
+        event stands for the rest (their DMs and notifications).
+        Returns whether there was such a user.
+        """
+
+        messages = db.select([Message.id]).where(Message.user_id == user_id)
+
+        stmt = (Likes.__table__.delete()
+                .where(db.or_(Likes.user_id == user_id,
+                              Likes.message_id.in_(messages)))
+                .returning(Likes.user_id, Likes.message_id))
+        OutboxEvent.emit('like.removed', [
+            {"user_id": liker_id, "message_id": message_id}
+            for liker_id, message_id in db.session.execute(stmt)])
+
+        stmt = (Follows.__table__.delete()
+                .where(db.or_(Follows.user_following_id == user_id,
+                              Follows.user_being_followed_id == user_id))
+                .returning(Follows.user_following_id,
+                           Follows.user_being_followed_id))
+        OutboxEvent.emit('follow.removed', [
+            {"follower_id": follower_id, "followed_id": followed_id}
+            for follower_id, followed_id in db.session.execute(stmt)])
+
+        # Deleted ones already had their event.
+        OutboxEvent.emit('message.deleted', [
+            {"id": message_id, "user_id": user_id}
+            for message_id, in db.session.execute(
+                messages.where(Message.deleted_at.is_(None)))])
+
+        deleted = db.session.execute(
+            cls.__table__.delete().where(cls.id == user_id)).rowcount
+        if deleted:
+            OutboxEvent.emit('user.deleted', [{"id": user_id}])
+        return bool(deleted)
+
     @classmethod
     def authenticate(cls, username, password):
         """Find user with `username` and `password`.
@@ -215,7 +566,10 @@ class User(db.Model):
         If can't find matching user (or if password is wrong), returns False.
         """
 
-        user = cls.query.filter_by(username=username).first()
+        user = (cls.query
+                .options(db.undefer_group('credentials'))
+                .filter_by(username=username)
+                .first())
 
         if user:
             is_auth = bcrypt.check_password_hash(user.password, password)
@@ -225,14 +579,32 @@ class User(db.Model):
         return False
 
 
+# So db.create_all() can build ix_users_username_trgm.
+event.listen(User.__table__, 'before_create',
+             db.DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+
+
 class Message(db.Model):
     """An individual message ("warble")."""
 
     __tablename__ = 'messages'
 
+    __table_args__ = (
+        # Timelines: an author's messages, newest first. deleted_at is in
+        # the index so deleted ones are skipped without reading the table.
+        db.Index('ix_messages_user_id_id_deleted_at',
+                 'user_id', 'id', 'deleted_at'),
+        # Just the deleted ones, for the purge.
+        db.Index('ix_messages_deleted_at', 'deleted_at',
+                 postgresql_where=db.text('deleted_at IS NOT NULL')),
+    )
+
+    # Time-ordered (see ids.py), so ordering by id orders by time.
     id = db.Column(
-        db.Integer,
+        db.BigInteger,
         primary_key=True,
+        autoincrement=False,
+        default=next_id,
     )
 
     text = db.Column(
@@ -243,7 +615,8 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
+        server_default=db.text("timezone('utc', now())"),
     )
 
     user_id = db.Column(
@@ -252,10 +625,465 @@ class Message(db.Model):
         nullable=False,
     )
 
+    # Set when the message is deleted. Reads skip it from then on, and
+    # `purge` removes it (and its likes) later.
+    deleted_at = db.Column(db.DateTime)
+
     user = db.relationship('User')
 
     liked_by = db.relationship('User', secondary='likes')
 
+    @classmethod
+    def soft_delete(cls, message_id):
+        """Mark message `message_id` deleted.
+
+        Returns its author's id, or None if there was no such message
+        (or it was already deleted).
+        """
+
+        stmt = (cls.__table__.update()
+                .values(deleted_at=db.func.timezone('utc', db.func.now()))
+                .where(db.and_(cls.id == message_id,
+                               cls.deleted_at.is_(None)))
+                .returning(cls.user_id))
+
+        author_id = db.session.execute(stmt).scalar()
+        if author_id is not None:
+            OutboxEvent.emit('message.deleted', [
+                {"id": message_id, "user_id": author_id}])
+        return author_id
+
+    @classmethod
+    def purge(cls, deleted_before, limit):
+        """Remove up to `limit` messages deleted before `deleted_before`.
+
+        Their likes go first, each with its like.removed event, so the
+        cascade has nothing left to find. Returns the ids removed.
+        """
+
+        ids = [id for id, in db.session
+               .query(cls.id)
+               .filter(cls.deleted_at < deleted_before)
+               .order_by(cls.deleted_at)
+               .limit(limit)]
+        if not ids:
+            return []
+
+        stmt = (Likes.__table__.delete()
+                .where(Likes.message_id.in_(ids))
+                .returning(Likes.user_id, Likes.message_id))
+        OutboxEvent.emit('like.removed', [
+            {"user_id": user_id, "message_id": message_id}
+            for user_id, message_id in db.session.execute(stmt)])
+        stmt = (cls.__table__.delete()
+                .where(cls.id.in_(ids))
+                .returning(cls.id))
+
+        return [id for id, in db.session.execute(stmt)]
+
+
+class Notification(db.Model):
+    """Something that happened to a user: a DM, like or follow."""
+
+    __tablename__ = 'notifications'
+
+    __table_args__ = (
+        # A user's notifications, newest first.
+        db.Index('ix_notifications_user_id_id', 'user_id', 'id'),
+        # Just the unread ones, for marking them read.
+        db.Index('ix_notifications_unread', 'user_id',
+                 postgresql_where=db.text('NOT read')),
+    )
+
+    KINDS = ('dm', 'like', 'follow')
+
+    id = db.Column(
+        db.BigInteger,
+        primary_key=True,
+    )
+
+    # Who the notification is for.
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete="cascade"),
+        nullable=False,
+    )
+
+    kind = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    # Who sent the DM, liked the message or followed.
+    actor_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete="cascade"),
+        nullable=False,
+        index=True,
+    )
+
+    # The liked message, for likes.
+    message_id = db.Column(
+        db.BigInteger,
+        db.ForeignKey('messages.id', ondelete="cascade"),
+        index=True,
+    )
+
+    read = db.Column(
+        db.Boolean,
+        nullable=False,
+        default=False,
+        server_default=db.false(),
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        server_default=db.text("timezone('utc', now())"),
+    )
+
+    actor = db.relationship('User', foreign_keys=[actor_id])
+
+    message = db.relationship('Message')
+
+    @staticmethod
+    def counter(kind):
+        return User.unread_dms if kind == 'dm' else User.unread_notifications
+
+    @classmethod
+    def notify(cls, kind, actor_id, recipients):
+        """Notify users that `actor_id` did `kind` to them.
+
+        `recipients` selects (user_id, message_id) pairs. The notifications
+        are inserted and each recipient's unread counter bumped in one
+        statement, in the caller's transaction. Users are never notified
+        of their own actions. Returns the ids of the users notified.
+        """
+
+        user_id, message_id = recipients.alias('recipients').c
+        inserted = (insert(cls.__table__)
+                    .from_select(
+                        ['user_id', 'message_id', 'kind', 'actor_id'],
+                        db.select([
+                            user_id,
+                            message_id,
+                            db.literal(kind, db.Text),
+                            db.literal(actor_id, db.Integer),
+                        ]).where(user_id != actor_id))
+                    .returning(cls.user_id)
+                    .cte('inserted'))
+
+        counts = (db.select([inserted.c.user_id,
+                             db.func.count().label('count')])
+                  .group_by(inserted.c.user_id)
+                  .alias('counts'))
+
+        counter = cls.counter(kind)
+        stmt = (User.__table__.update()
+                .values({counter.key: counter + counts.c.count})
+                .where(User.id == counts.c.user_id)
+                .returning(User.id))
+
+        return [id for id, in db.session.execute(stmt)]
+
+    @classmethod
+    def mark_read(cls, user_id, kinds, actor_id=None):
+        """Mark all `user_id`'s unread notifications of `kinds` read.
+
+        Optionally only those from `actor_id` (e.g. one DM thread). The
+        counters go down by however many were marked. Returns that number.
+        """
+
+        marked = (cls.__table__.update()
+                  .values(read=True)
+                  .where(db.and_(cls.user_id == user_id,
+                                 cls.kind.in_(kinds),
+                                 cls.read.is_(False)))
+                  .returning(cls.kind))
+        if actor_id is not None:
+            marked = marked.where(cls.actor_id == actor_id)
+
+        counters = [cls.counter(kind).key
+                    for kind, in db.session.execute(marked)]
+        if not counters:
+            return 0
+
+        column = User.__table__.c
+        db.session.execute(
+            User.__table__.update()
+            .values({key: db.func.greatest(
+                         column[key] - counters.count(key), 0)
+                     for key in set(counters)})
+            .where(User.id == user_id))
+
+        return len(counters)
+
+
+class RequestProfile(db.Model):
+    """A sampling profile of one request, taken on an admin's request."""
+
+    __tablename__ = 'request_profiles'
+
+    id = db.Column(
+        db.BigInteger,
+        primary_key=True,
+        autoincrement=False,
+        default=next_id,
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete="set null"),
+    )
+
+    method = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    path = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    status = db.Column(
+        db.Integer,
+    )
+
+    duration_ms = db.Column(
+        db.Float,
+        nullable=False,
+    )
+
+    db_ms = db.Column(
+        db.Float,
+        nullable=False,
+    )
+
+    template_ms = db.Column(
+        db.Float,
+        nullable=False,
+    )
+
+    python_ms = db.Column(
+        db.Float,
+        nullable=False,
+    )
+
+    samples = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    # Collapsed stacks ("frame;frame;frame count" lines) for flame graphs.
+    collapsed = db.deferred(db.Column(
+        db.Text,
+        nullable=False,
+    ))
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        server_default=db.text("timezone('utc', now())"),
+    )
+
+    user = db.relationship('User')
+
+
+class OutboxEvent(db.Model):
+    """A change to messages, likes, follows or DMs (see outbox.py).
+
+    Written in the same transaction as the change, so an event exists
+    exactly when the change was committed.
+    """
+
+    __tablename__ = 'outbox'
+
+    __table_args__ = (
+        # Dispatch order.
+        db.Index('ix_outbox_txid_id', 'txid', 'id'),
+    )
+
+    # Time-ordered, so events from one transaction keep their order.
+    id = db.Column(
+        db.BigInteger,
+        primary_key=True,
+        autoincrement=False,
+        default=next_id,
+    )
+
+    # The writing transaction, which decides when an event can be
+    # dispatched: see outbox.horizon.
+    txid = db.Column(
+        db.BigInteger,
+        nullable=False,
+        server_default=db.text('txid_current()'),
+    )
+
+    # e.g. 'like.added'; see KINDS.
+    kind = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    data = db.Column(
+        JSONB,
+        nullable=False,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        server_default=db.text("timezone('utc', now())"),
+    )
+
+    KINDS = ('message.created', 'message.deleted', 'like.added',
+             'like.removed', 'follow.added', 'follow.removed', 'dm.sent',
+             'user.deleted')
+
+    @classmethod
+    def emit(cls, kind, rows):
+        """Record a `kind` event for each dict in `rows`, in this transaction."""
+
+        if rows:
+            db.session.execute(cls.__table__.insert().values(
+                [{"id": next_id(), "kind": kind, "data": row}
+                 for row in rows]))
+
+
+class OutboxCheckpoint(db.Model):
+    """How far through the outbox one consumer has got."""
+
+    __tablename__ = 'outbox_checkpoints'
+
+    consumer = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    # The last event delivered.
+    txid = db.Column(
+        db.BigInteger,
+        nullable=False,
+    )
+
+    event_id = db.Column(
+        db.BigInteger,
+        nullable=False,
+    )
+
+
+class DailyStats(db.Model):
+    """One UTC day's activity, rolled up by analytics.py."""
+
+    __tablename__ = 'daily_stats'
+
+    day = db.Column(
+        db.Date,
+        primary_key=True,
+    )
+
+    messages = db.Column(db.Integer, nullable=False)
+
+    # Users who posted at least once.
+    posters = db.Column(db.Integer, nullable=False)
+
+    # Users who posted, liked, followed or sent a DM.
+    active_users = db.Column(db.Integer, nullable=False)
+
+    likes = db.Column(db.Integer, nullable=False)
+
+    follows = db.Column(db.Integer, nullable=False)
+
+    dms = db.Column(db.Integer, nullable=False)
+
+
+class DailyTopPoster(db.Model):
+    """One of a day's most prolific posters, rolled up by analytics.py."""
+
+    __tablename__ = 'daily_top_posters'
+
+    day = db.Column(
+        db.Date,
+        primary_key=True,
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete="cascade"),
+        primary_key=True,
+    )
+
+    messages = db.Column(db.Integer, nullable=False)
+
+
+class DataExport(db.Model):
+    """A zip of everything one user has posted, liked, followed and sent.
+
+    Made in the background by exports.py; `status` goes from 'pending'
+    to 'running' to 'done' (or 'failed').
+    """
+
+    __tablename__ = 'data_exports'
+
+    __table_args__ = (
+        # A user's exports, newest first.
+        db.Index('ix_data_exports_user_id_id', 'user_id', 'id'),
+        # Just the ones still to be made, for the exporter.
+        db.Index('ix_data_exports_unfinished', 'id',
+                 postgresql_where=db.text(
+                     "status IN ('pending', 'running')")),
+    )
+
+    id = db.Column(
+        db.BigInteger,
+        primary_key=True,
+        autoincrement=False,
+        default=next_id,
+    )
+
+    # Whose data.
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete="cascade"),
+        nullable=False,
+    )
+
+    # Who asked for it: the user, or an admin for support.
+    requested_by = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete="set null"),
+    )
+
+    status = db.Column(
+        db.Text,
+        nullable=False,
+        default='pending',
+        server_default='pending',
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        server_default=db.text("timezone('utc', now())"),
+    )
+
+    started_at = db.Column(
+        db.DateTime,
+    )
+
+    finished_at = db.Column(
+        db.DateTime,
+    )
+
+    # Of the zip, once it's done.
+    size = db.Column(
+        db.BigInteger,
+    )
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
@@ -265,6 +1093,7 @@ def connect_db(app):
 
     db.app = app
     db.init_app(app)
+    bcrypt.init_app(app)
 
 
 # my message with to-user you
@@ -0,0 +1,156 @@
+"""Transactional outbox: change events for whatever keeps derived data.
+
+Writes to messages, likes, follows and DMs also insert an `OutboxEvent`
+in the same transaction (Likes.like, Follows.follow, User.send_dm and so
+on), so there's an event for every committed change and none for rolled
+back ones. That includes what goes when a user is deleted (User.delete)
+or a message purged: each like, follow and message gets its removed or
+deleted event, and a final user.deleted event covers the user's DMs.
+
+Consumers are functions registered with `consumer`. A `Dispatcher`
+(`flask dispatch-events`) hands each one the events in commit order, in
+batches, and records how far it got in outbox_checkpoints after every
+batch, so a restarted dispatcher carries on where it stopped. A consumer
+is called in the transaction that records its checkpoint, so whatever it
+writes to the database commits with it, exactly once. Anything else it
+does may be repeated: it's sent a batch again if it raised, or if the
+dispatcher died before committing.
+
+`reset` forgets a consumer's checkpoint, so it's sent every event still
+in the outbox and can rebuild its data from scratch.
+
+Events are ordered by the id of the transaction that wrote them. One is
+only dispatched once every transaction that started before it has
+finished (see `horizon`), so a slow transaction committing late can't
+slip an event in behind a checkpoint.
+"""
+
+import logging
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from models import db, OutboxEvent, OutboxCheckpoint
+
+log = logging.getLogger(__name__)
+
+Event = namedtuple('Event', 'txid id kind data')
+
+# Consumer name -> function taking a list of Events.
+consumers = {}
+
+
+def consumer(name):
+    """Decorator registering a function to be sent batches of events."""
+
+    def register(handler):
+        consumers[name] = handler
+        return handler
+    return register
+
+
+def horizon():
+    """Transactions with ids below this have all committed or aborted."""
+
+    return db.session.execute(
+        "SELECT txid_snapshot_xmin(txid_current_snapshot())").scalar()
+
+
+def reset(name):
+    """Have consumer `name` start again from the oldest event."""
+
+    OutboxCheckpoint.query.filter_by(consumer=name).delete()
+    db.session.commit()
+
+
+def prune(older_than):
+    """Delete events older than `older_than` that every consumer has had.
+
+    Returns how many were deleted.
+    """
+
+    events = OutboxEvent.query.filter(OutboxEvent.created_at < older_than)
+
+    if consumers:
+        started, oldest = (db.session
+                           .query(db.func.count(), db.func.min(
+                               OutboxCheckpoint.txid))
+                           .filter(OutboxCheckpoint.consumer.in_(
+                               list(consumers)))
+                           .one())
+        # One that hasn't had anything yet still needs every event.
+        if started < len(consumers):
+            return 0
+        events = events.filter(OutboxEvent.txid < oldest)
+
+    deleted = events.delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+class Dispatcher:
+    """Delivers outbox events to the registered consumers."""
+
+    def __init__(self, batch_size=500, interval=1.0, retention_hours=168):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.retention = timedelta(hours=retention_hours)
+
+    def dispatch(self):
+        """Send every consumer the events it hasn't had. Returns how many."""
+
+        limit = horizon()
+        sent = 0
+        for name, handler in sorted(consumers.items()):
+            while True:
+                count = self.deliver(name, handler, limit)
+                sent += count
+                if count < self.batch_size:
+                    break
+        return sent
+
+    def deliver(self, name, handler, limit):
+        """Send consumer `name` its next batch. Returns the batch's size."""
+
+        # Locked, so two dispatchers never send a consumer the same batch.
+        checkpoint = (OutboxCheckpoint.query
+                      .filter_by(consumer=name)
+                      .with_for_update()
+                      .first())
+        after = ((checkpoint.txid, checkpoint.event_id) if checkpoint
+                 else (-1, -1))
+
+        events = [Event(*row) for row in db.session
+                  .query(OutboxEvent.txid, OutboxEvent.id,
+                         OutboxEvent.kind, OutboxEvent.data)
+                  .filter(db.tuple_(OutboxEvent.txid, OutboxEvent.id) >
+                          db.tuple_(*after),
+                          OutboxEvent.txid < limit)
+                  .order_by(OutboxEvent.txid, OutboxEvent.id)
+                  .limit(self.batch_size)]
+        if not events:
+            db.session.rollback()
+            return 0
+
+        try:
+            handler(events)
+        except Exception:
+            db.session.rollback()
+            log.exception("Outbox consumer %s failed; will retry", name)
+            return 0
+
+        if checkpoint is None:
+            checkpoint = OutboxCheckpoint(consumer=name)
+            db.session.add(checkpoint)
+        checkpoint.txid, checkpoint.event_id = events[-1].txid, events[-1].id
+        db.session.commit()
+
+        return len(events)
+
+    def run(self):
+        """Dispatch forever, pausing `interval` seconds whenever idle."""
+
+        while True:
+            if not self.dispatch():
+                prune(datetime.utcnow() - self.retention)
+                time.sleep(self.interval)
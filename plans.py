@@ -0,0 +1,326 @@
+"""Query plan assertions, for tests that keep hot queries on their indexes.
+
+`capture_queries` records the SQL a block of code (say, a test client
+request) runs, and `explain` asks Postgres how it would run one of those
+statements, as a `Plan`. Plans can then be checked with the assert_*
+methods, which fail with the whole plan in the message.
+
+Plans depend on table statistics, so explain against a realistically
+sized, ANALYZEd dataset; on a near-empty table every plan is a
+sequential scan.
+
+`unindexed_filters` needs no data: it reads a statement's WHERE clauses
+and the indexes declared in models.py, and lists the columns it filters
+on that no index could find rows by. `capture_statements` records the
+statements to check.
+"""
+
+import json
+import re
+from contextlib import contextmanager
+
+from sqlalchemy import Table, event
+from sqlalchemy.sql import operators, visitors
+from sqlalchemy.sql.elements import (BinaryExpression, BooleanClauseList,
+                                     ClauseElement, ColumnClause, Grouping,
+                                     TextClause)
+
+from models import db
+
+# Scans that read only the rows their index condition matches.
+INDEX_SCANS = {'Index Scan', 'Index Only Scan', 'Bitmap Index Scan'}
+
+# Comparisons with a value that an index on the column can seek by.
+SEEKABLE = {operators.eq, operators.in_op, operators.lt, operators.le,
+            operators.gt, operators.ge, operators.between_op,
+            operators.like_op}
+
+
+class Plan:
+    """A Postgres query plan, from EXPLAIN (FORMAT JSON)."""
+
+    def __init__(self, plan, statement=None, leading_columns=None):
+        self.root = plan
+        self.statement = statement
+        # Index name -> its first column.
+        self.leading_columns = leading_columns or {}
+
+    def nodes(self, node=None):
+        """Every node in the plan, depth first."""
+
+        node = node or self.root
+        yield node
+        for child in node.get('Plans', ()):
+            yield from self.nodes(child)
+
+    @property
+    def rows(self):
+        """Estimated number of rows the query returns."""
+
+        return self.root['Plan Rows']
+
+    def scans(self, table):
+        """The nodes that read `table` (for bitmap scans, the index part)."""
+
+        scans = []
+        for node in self.nodes():
+            if node.get('Relation Name') == table:
+                if node['Node Type'] == 'Bitmap Heap Scan':
+                    scans.extend(child for child in self.nodes(node)
+                                 if child['Node Type'] == 'Bitmap Index Scan')
+                else:
+                    scans.append(node)
+        return scans
+
+    def indexes(self, table):
+        """Names of the indexes used to read `table`."""
+
+        return {node['Index Name'] for node in self.scans(table)
+                if 'Index Name' in node}
+
+    def fail(self, message):
+        raise AssertionError(f"{message}\n\n{self.statement}\n\n{self}")
+
+    def assert_index_lookup(self, table, index=None, columns=()):
+        """Assert `table` is only read through index conditions.
+
+        A sequential scan fails, and so does walking a whole index: an
+        index scan with no Index Cond (used just for its order), or with
+        one that doesn't constrain the index's first column. If `index`
+        is given, that index must be one of those used. Each of
+        `columns` must be in every index condition; when several indexes
+        (say, a primary key and a secondary index on the same columns)
+        serve equally well, that checks the lookup without depending on
+        which one the statistics favour.
+        """
+
+        scans = self.scans(table)
+        if not scans:
+            self.fail(f"{table} isn't scanned")
+
+        for node in scans:
+            if node['Node Type'] not in INDEX_SCANS:
+                self.fail(f"{node['Node Type']} on {table}")
+            if 'Index Cond' not in node:
+                self.fail(f"{node['Index Name']} on {table} is scanned "
+                          f"without an index condition")
+            leading = self.leading_columns.get(node['Index Name'])
+            if leading and not re.search(rf'\b{leading}\b',
+                                         node['Index Cond']):
+                self.fail(f"{node['Index Name']} on {table} is scanned "
+                          f"without a condition on {leading}")
+            for column in columns:
+                if not re.search(rf'\b{column}\b', node['Index Cond']):
+                    self.fail(f"{node['Index Name']} on {table} is scanned "
+                              f"without a condition on {column}")
+
+        if index is not None and index not in self.indexes(table):
+            self.fail(f"{index} isn't used for {table}")
+
+    def assert_rows_at_most(self, rows):
+        """Assert the planner expects at most `rows` rows back."""
+
+        if self.rows > rows:
+            self.fail(f"Expected at most {rows} rows, plan estimates "
+                      f"{self.rows}")
+
+    def __str__(self):
+        return '\n'.join(self.lines(self.root, 0))
+
+    def lines(self, node, depth):
+        detail = ', '.join(
+            f"{key}: {node[key]}"
+            for key in ('Relation Name', 'Index Name', 'Index Cond',
+                        'Recheck Cond', 'Filter')
+            if key in node)
+        yield (f"{'  ' * depth}-> {node['Node Type']} "
+               f"(rows={node['Plan Rows']} cost={node['Total Cost']}) "
+               f"{detail}")
+        for child in node.get('Plans', ()):
+            yield from self.lines(child, depth + 1)
+
+
+class Queries(list):
+    """(statement, parameters) pairs recorded by `capture_queries`."""
+
+    def matching(self, *fragments):
+        """The one recorded statement containing all of `fragments`."""
+
+        found = [query for query in self
+                 if all(fragment in query[0] for fragment in fragments)]
+        if len(found) != 1:
+            raise AssertionError(
+                f"{len(found)} queries contain {fragments}:\n\n" +
+                '\n\n'.join(statement for statement, _ in self))
+        return found[0]
+
+
+@contextmanager
+def capture_queries():
+    """Record the SELECTs run on the database inside the block."""
+
+    queries = Queries()
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            queries.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield queries
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+
+def explain(query, disable=()):
+    """The Plan for a (statement, parameters) pair.
+
+    `disable` names planner methods to avoid if it can (e.g. 'seqscan'
+    for enable_seqscan). For a table small enough that reading it all is
+    honestly cheapest, avoiding 'seqscan' and 'indexscan' leaves only
+    bitmap scans, which need an index condition: that shows whether an
+    index could find the rows at all.
+    """
+
+    statement, parameters = query
+    cursor = db.session.connection().connection.cursor()
+    try:
+        for method in disable:
+            cursor.execute(f"SET LOCAL enable_{method} = off")
+        cursor.execute("EXPLAIN (FORMAT JSON) " + statement, parameters)
+        result = cursor.fetchone()[0]
+        for method in disable:
+            cursor.execute(f"RESET enable_{method}")
+    finally:
+        cursor.close()
+
+    if isinstance(result, str):
+        result = json.loads(result)
+    plan = Plan(result[0]['Plan'], statement)
+
+    indexes = {node['Index Name'] for node in plan.nodes()
+               if 'Index Name' in node}
+    if indexes:
+        plan.leading_columns = dict(db.session.execute(
+            """SELECT idx.relname, attribute.attname
+               FROM pg_index
+               JOIN pg_class idx ON idx.oid = pg_index.indexrelid
+               JOIN pg_attribute attribute
+                 ON attribute.attrelid = pg_index.indrelid
+                AND attribute.attnum = pg_index.indkey[0]
+               WHERE idx.relname IN :names""",
+            {'names': tuple(indexes)}).fetchall())
+
+    return plan
+
+
+@contextmanager
+def capture_statements():
+    """Record the SQLAlchemy statements (not text SQL) run in the block."""
+
+    statements = []
+
+    def record(conn, clauseelement, multiparams, params):
+        if (isinstance(clauseelement, ClauseElement) and
+                not isinstance(clauseelement, TextClause)):
+            statements.append(clauseelement)
+
+    event.listen(db.engine, 'before_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_execute', record)
+
+
+def unindexed_filters(statement):
+    """(table, columns) pairs for filters no index supports.
+
+    A table filtered on (compared with a value, not another column) needs
+    an index, primary key or unique constraint leading with one of the
+    filtered columns. Each branch of an OR needs its own, unless the
+    conditions ANDed with the OR already have one.
+    """
+
+    found = set()
+    for element in visitors.iterate(statement, {}):
+        where = getattr(element, '_whereclause', None)
+        if where is not None:
+            for table, columns in unsupported(where).items():
+                found.add((base_table(table).name, tuple(sorted(columns))))
+    return sorted(found)
+
+
+def unsupported(clause):
+    """Table -> filtered columns, for tables `clause` can't seek in."""
+
+    filtered = {}
+    branches = []
+    for term in conjuncts(clause):
+        if (isinstance(term, BooleanClauseList) and
+                term.operator is operators.or_):
+            branches.extend(term.clauses)
+            continue
+        column = seek_column(term)
+        if column is not None:
+            filtered.setdefault(column.table, set()).add(column.name)
+
+    missing = {}
+    for table, columns in filtered.items():
+        leading = leading_columns(table)
+        if leading is not None and not columns & leading:
+            missing[table] = columns
+
+    for branch in branches:
+        for table, columns in unsupported(branch).items():
+            if table not in filtered or table in missing:
+                missing.setdefault(table, set()).update(columns)
+
+    return missing
+
+
+def conjuncts(clause):
+    """The terms ANDed together in `clause`."""
+
+    while isinstance(clause, Grouping):
+        clause = clause.element
+    if (isinstance(clause, BooleanClauseList) and
+            clause.operator is operators.and_):
+        for term in clause.clauses:
+            yield from conjuncts(term)
+    else:
+        yield clause
+
+
+def seek_column(term):
+    """The column `term` compares with a value, if an index could help."""
+
+    if (not isinstance(term, BinaryExpression) or
+            term.operator not in SEEKABLE):
+        return None
+
+    for column, value in ((term.left, term.right), (term.right, term.left)):
+        if (isinstance(column, ColumnClause) and
+                isinstance(base_table(column.table), Table) and
+                not any(isinstance(element, ColumnClause)
+                        for element in visitors.iterate(value, {}))):
+            return column
+    return None
+
+
+def base_table(table):
+    """The Table behind an alias of one (e.g. from db.aliased)."""
+
+    return getattr(table, 'original', table)
+
+
+def leading_columns(table):
+    """First columns of `table`'s indexes and keys (None if not a Table)."""
+
+    table = base_table(table)
+    if not isinstance(table, Table):
+        return None
+
+    keys = [table.primary_key] + list(table.indexes) + [
+        constraint for constraint in table.constraints
+        if isinstance(constraint, db.UniqueConstraint)]
+    return {list(key.columns)[0].name for key in keys if len(key.columns)}
@@ -0,0 +1,139 @@
+"""Sampling profiler for single requests.
+
+A `Profiler` runs a background thread that snapshots the profiled
+thread's stack every `interval` seconds. Each sample is filed under
+"db" if it's inside SQLAlchemy or the database driver, "template" if
+it's inside Jinja, and "python" otherwise, and the result is written in
+the collapsed-stack format flamegraph.pl and speedscope read, with the
+microseconds spent in each stack:
+
+    db;dispatch_request (flask);homepage (app.py:702);...;execute (psycopg2) 1250
+
+Samples are weighted by the time since the previous one. While the
+profiled thread runs Python it holds the GIL and the sampler only gets
+in every few milliseconds; while it waits on the database it doesn't,
+so counting samples would overstate database time.
+
+Nothing runs unless a profiler is started, so unprofiled requests pay
+nothing.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+CATEGORIES = ('db', 'template', 'python')
+
+DB_MODULES = ('sqlalchemy', 'psycopg2', 'flask_sqlalchemy')
+TEMPLATE_MODULES = ('jinja2',)
+
+
+def package_of(filename):
+    """The top-level package a frame's file belongs to, if any."""
+
+    parts = filename.replace(os.sep, '/').split('/')
+    if 'site-packages' in parts:
+        return parts[parts.index('site-packages') + 1].split('.')[0]
+    return None
+
+
+def category(frames):
+    """Which of CATEGORIES a stack (outermost frame first) counts towards.
+
+    Decided by the innermost frame that's in the database layer or a
+    template, so a query run by a lazy load inside a template is "db".
+    """
+
+    for frame in reversed(frames):
+        package = package_of(frame.f_code.co_filename)
+        if package in DB_MODULES:
+            return 'db'
+        if package in TEMPLATE_MODULES or frame.f_code.co_filename.endswith(
+                '.html'):
+            return 'template'
+    return 'python'
+
+
+def label(frame):
+    code = frame.f_code
+    package = package_of(code.co_filename)
+    if package:
+        return f"{code.co_name} ({package})"
+    return (f"{code.co_name} "
+            f"({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+
+
+class Profiler:
+    """Samples one thread's stack until stopped."""
+
+    def __init__(self, thread_id=None, interval=0.002, max_samples=50000,
+                 root='dispatch_request'):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.max_samples = max_samples
+        # Frames outside the outermost call of this function are left out.
+        self.root = root
+
+        # Seconds per stack and per category.
+        self.stacks = Counter()
+        self.times = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.sampled_at = None
+        self.duration = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.started_at = self.sampled_at = time.perf_counter()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.duration = time.perf_counter() - self.started_at
+        return self
+
+    def run(self):
+        while (not self.stopped.wait(self.interval) and
+               self.samples < self.max_samples):
+            self.sample()
+
+    def sample(self):
+        now = time.perf_counter()
+        elapsed, self.sampled_at = now - self.sampled_at, now
+
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+
+        frames = []
+        while frame is not None:
+            frames.append(frame)
+            frame = frame.f_back
+        frames.reverse()
+
+        for i, frame in enumerate(frames):
+            if frame.f_code.co_name == self.root:
+                frames = frames[i:]
+                break
+
+        kind = category(frames)
+        self.stacks[';'.join([kind] + [label(f) for f in frames])] += elapsed
+        self.times[kind] += elapsed
+        self.samples += 1
+
+    def seconds(self, kind):
+        """Estimated wall time spent in `kind` (one of CATEGORIES)."""
+
+        return self.times[kind]
+
+    def collapsed(self):
+        """The samples in collapsed-stack format, one stack per line."""
+
+        return '\n'.join(f"{stack} {round(seconds * 1e6)}"
+                         for stack, seconds in self.stacks.most_common())
@@ -1,7 +1,9 @@
 """Seed database with sample data from CSV Files."""
 
 from csv import DictReader
+from datetime import datetime
 from app import db
+from ids import id_for_time
 from models import User, Message, Follows
 
 db.drop_all()
@@ -11,7 +13,13 @@ with open('generator/users.csv') as users:
     db.session.bulk_insert_mappings(User, DictReader(users))
 
 with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
+    # Give sample messages ids from their own timestamps, so they sort
+    # by when they were "written" rather than when they were seeded.
+    messages = list(DictReader(messages))
+    for sequence, message in enumerate(messages):
+        timestamp = datetime.fromisoformat(message['timestamp'])
+        message['id'] = id_for_time(timestamp, sequence=sequence % 4096)
+    db.session.bulk_insert_mappings(Message, messages)
 
 with open('generator/follows.csv') as follows:
     db.session.bulk_insert_mappings(Follows, DictReader(follows))
@@ -0,0 +1,85 @@
+"""Streamed template rendering and on-the-fly gzip for large pages."""
+
+import zlib
+
+from flask import Response, current_app, stream_with_context
+from werkzeug.datastructures import Headers
+
+# Template output fragments gathered into each streamed chunk.
+STREAM_BUFFER = 100
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript')
+
+
+def stream_template(template_name, **context):
+    """Like render_template, but sends the page as it renders.
+
+    Pass iterables that fetch lazily (e.g. a query with `yield_per`) and
+    rows are rendered and sent as they come off the cursor, instead of
+    the whole page being built in memory first. The request context stays
+    open until the last chunk is sent.
+    """
+
+    app = current_app._get_current_object()
+    app.update_template_context(context)
+
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(STREAM_BUFFER)
+
+    return Response(stream_with_context(stream), mimetype='text/html')
+
+
+class GzipMiddleware:
+    """WSGI middleware that gzips text responses chunk by chunk.
+
+    Each chunk the app yields is compressed and flushed straight away, so
+    streamed pages keep streaming. Responses that already have a
+    Content-Encoding (like precompressed assets) or are smaller than
+    `min_size` are passed through untouched.
+    """
+
+    def __init__(self, app, level=6, min_size=500):
+        self.app = app
+        self.level = level
+        self.min_size = min_size
+
+    def __call__(self, environ, start_response):
+        accepts_gzip = 'gzip' in environ.get('HTTP_ACCEPT_ENCODING', '')
+        compress = []
+
+        def gzip_start_response(status, headers, exc_info=None):
+            headers = Headers(headers)
+            content_type = headers.get('Content-Type', '')
+            length = headers.get('Content-Length', type=int)
+
+            if (content_type.startswith(COMPRESSIBLE_TYPES) and
+                    'Content-Encoding' not in headers):
+                if 'accept-encoding' not in headers.get('Vary', '').lower():
+                    headers.add('Vary', 'Accept-Encoding')
+
+                if (accepts_gzip and not status.startswith(('204', '304')) and
+                        (length is None or length >= self.min_size)):
+                    headers['Content-Encoding'] = 'gzip'
+                    headers.remove('Content-Length')
+                    headers.remove('ETag')
+                    compress.append(True)
+
+            return start_response(status, headers.to_wsgi_list(), exc_info)
+
+        app_iter = self.app(environ, gzip_start_response)
+
+        if not compress:
+            return app_iter
+        return self.compressed(app_iter)
+
+    def compressed(self, app_iter):
+        gzip = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+        try:
+            for chunk in app_iter:
+                if chunk:
+                    yield gzip.compress(chunk) + gzip.flush(zlib.Z_SYNC_FLUSH)
+            yield gzip.flush()
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
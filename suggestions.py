@@ -0,0 +1,346 @@
+""""Who to follow" suggestions from an in-memory index of the follow graph.
+
+`flask build-follow-graph` builds the index from the follows table and
+saves it to files that every worker maps into memory (`FollowGraph.save`
+and `open`), so no request ever waits for a rebuild, and the workers on
+a host share one copy.
+"""
+
+import glob
+import io
+import os
+import shutil
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from models import db
+
+ARRAYS = ('user_ids', 'indptr', 'indices', 'follower_counts', 'popular')
+
+# One row of COPY ... (FORMAT binary) output for two int4 columns: the
+# field count, then each field's length and value, all big-endian.
+COPY_ROW = np.dtype([('fields', '>i2'),
+                     ('follower_length', '>i4'), ('follower', '>i4'),
+                     ('followed_length', '>i4'), ('followed', '>i4')])
+COPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+
+
+class FollowGraph:
+    """Read-only CSR adjacency index of who follows whom.
+
+    `user_ids` is the sorted array of every user id that appears in the
+    graph; the other arrays are indexed by position in it. The users that
+    the user at position `i` follows are `indices[indptr[i]:indptr[i + 1]]`
+    (sorted, as positions), and `follower_counts[i]` is how many users
+    follow them.
+    """
+
+    def __init__(self, user_ids, indptr, indices, follower_counts,
+                 popular=None):
+        self.user_ids = user_ids
+        self.indptr = indptr
+        self.indices = indices
+        self.follower_counts = follower_counts
+
+        if popular is None:
+            by_popularity = np.argsort(-follower_counts, kind='stable')
+            popular = user_ids[by_popularity[:100]]
+        self.popular = popular
+
+        # When the edges were read (time.time()), if they came from the
+        # database.
+        self.built_at = None
+
+    @classmethod
+    def from_edges(cls, followers, followed):
+        """Build the index from parallel arrays of follower/followed ids."""
+
+        followers = np.asarray(followers, dtype=np.int64)
+        followed = np.asarray(followed, dtype=np.int64)
+
+        user_ids = np.unique(np.concatenate([followers, followed]))
+        src = np.searchsorted(user_ids, followers)
+        dst = np.searchsorted(user_ids, followed)
+
+        order = np.lexsort((dst, src))
+        src = src[order]
+        dst = dst[order].astype(np.int32)
+
+        indptr = np.zeros(len(user_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=len(user_ids)), out=indptr[1:])
+
+        follower_counts = np.bincount(
+            dst, minlength=len(user_ids)).astype(np.int32)
+
+        return cls(user_ids, indptr, dst, follower_counts)
+
+    @classmethod
+    def load(cls):
+        """Build the index from the follows table.
+
+        The edges are copied out in Postgres's binary format and read
+        straight into arrays, with no Python object per edge.
+        """
+
+        built_at = time.time()
+        buffer = io.BytesIO()
+        # On the session's connection, so it sees the same transaction as
+        # everything else.
+        cursor = db.session.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                "COPY (SELECT user_following_id, user_being_followed_id "
+                "FROM follows) TO STDOUT WITH (FORMAT binary)", buffer)
+        finally:
+            cursor.close()
+
+        data = buffer.getbuffer()
+        if bytes(data[:len(COPY_SIGNATURE)]) != COPY_SIGNATURE:
+            raise ValueError("Not COPY binary output")
+        # Signature, flags, then a header extension of the given length;
+        # a two byte trailer at the end.
+        start = len(COPY_SIGNATURE) + 8 + int.from_bytes(
+            data[len(COPY_SIGNATURE) + 4:len(COPY_SIGNATURE) + 8], 'big')
+        rows = np.frombuffer(data[start:len(data) - 2], dtype=COPY_ROW)
+
+        graph = cls.from_edges(rows['follower'], rows['followed'])
+        graph.built_at = built_at
+        del rows, data
+        return graph
+
+    def save(self, path):
+        """Save the index for `open`, replacing what's at `path`.
+
+        Each build goes in a directory of its own, and `path` is a symlink
+        switched to the new one, so workers never see half a build. Older
+        builds are removed; workers still mapping one keep it until they
+        move on.
+        """
+
+        built_at = self.built_at or time.time()
+        directory = f"{path}.{int(built_at * 1e9)}"
+        os.makedirs(directory)
+        for name in ARRAYS:
+            np.save(os.path.join(directory, f'{name}.npy'),
+                    getattr(self, name))
+
+        link = f"{path}.link-{os.getpid()}"
+        os.symlink(directory, link)
+        os.replace(link, path)
+
+        for old in glob.glob(f"{glob.escape(path)}.[0-9]*"):
+            if old != directory:
+                shutil.rmtree(old, ignore_errors=True)
+
+    @classmethod
+    def open(cls, directory):
+        """The index saved in `directory`, mapped into memory."""
+
+        graph = cls(*[np.load(os.path.join(directory, f'{name}.npy'),
+                              mmap_mode='r')
+                      for name in ARRAYS])
+        graph.built_at = int(directory.rsplit('.', 1)[1]) / 1e9
+        return graph
+
+    @property
+    def nbytes(self):
+        """Memory held by the index arrays."""
+
+        return (self.user_ids.nbytes + self.indptr.nbytes +
+                self.indices.nbytes + self.follower_counts.nbytes +
+                self.popular.nbytes)
+
+    def __len__(self):
+        """Number of edges in the graph."""
+
+        return len(self.indices)
+
+    def position(self, user_id):
+        """Position of `user_id` in the index, or None if not present."""
+
+        pos = np.searchsorted(self.user_ids, user_id)
+        if pos < len(self.user_ids) and self.user_ids[pos] == user_id:
+            return int(pos)
+        return None
+
+    def following(self, user_id):
+        """Ids of the users `user_id` follows."""
+
+        pos = self.position(user_id)
+        if pos is None:
+            return np.empty(0, dtype=np.int64)
+        return self.user_ids[self.indices[self.indptr[pos]:self.indptr[pos + 1]]]
+
+    def follows(self, follower_id, followed_id):
+        """Does the index contain the edge follower -> followed?"""
+
+        src = self.position(follower_id)
+        dst = self.position(followed_id)
+        if src is None or dst is None:
+            return False
+
+        row = self.indices[self.indptr[src]:self.indptr[src + 1]]
+        i = np.searchsorted(row, dst)
+        return bool(i < len(row) and row[i] == dst)
+
+    def friends_of_friends(self, user_ids):
+        """Positions reached in one hop from `user_ids`, with repeats."""
+
+        positions = [self.position(id) for id in user_ids]
+        positions = np.array([p for p in positions if p is not None],
+                             dtype=np.int64)
+
+        starts = self.indptr[positions]
+        lengths = self.indptr[positions + 1] - starts
+        if not lengths.sum():
+            return np.empty(0, dtype=np.int64)
+
+        # Offsets into `indices` for every hop, without a Python loop:
+        # each run restarts at its row's start.
+        ends = np.cumsum(lengths)
+        offsets = np.arange(ends[-1]) - np.repeat(ends - lengths - starts,
+                                                  lengths)
+        return self.indices[offsets]
+
+
+class SuggestionEngine:
+    """Ranks users to follow from the FollowGraph saved at `path`.
+
+    Every `check_every` seconds it looks for a newer build there and maps
+    it in. Follows and unfollows this worker has seen are kept as small
+    per-follower overlays, with when they happened, and applied at query
+    time, so its own users' suggestions stay current between builds;
+    other workers' users see them once a build includes them. Without a
+    `path`, set `graph` directly.
+    """
+
+    def __init__(self, path=None, check_every=10, popularity_weight=0.25):
+        self.path = path
+        self.check_every = check_every
+        self.popularity_weight = popularity_weight
+
+        self.graph = None
+        self.source = None
+        self.checked_at = None
+        # Follower id -> {followed id: time.time() of the change}.
+        self.added = defaultdict(dict)
+        self.removed = defaultdict(dict)
+        self.lock = threading.Lock()
+
+    def follow_added(self, follower_id, followed_id):
+        """Record a new follow since the last rebuild."""
+
+        with self.lock:
+            self.removed[follower_id].pop(followed_id, None)
+            self.added[follower_id][followed_id] = time.time()
+
+    def follow_removed(self, follower_id, followed_id):
+        """Record a removed follow since the last rebuild."""
+
+        with self.lock:
+            self.added[follower_id].pop(followed_id, None)
+            self.removed[follower_id][followed_id] = time.time()
+
+    def reset(self):
+        """Throw away the graph so the next lookup opens it again."""
+
+        with self.lock:
+            self.graph = None
+            self.source = None
+            self.checked_at = None
+            self.added.clear()
+            self.removed.clear()
+
+    def refresh(self):
+        """Map in a newer build of the graph, if there is one."""
+
+        now = time.monotonic()
+        if self.path is None or (self.checked_at is not None and
+                                 now - self.checked_at < self.check_every):
+            return
+        self.checked_at = now
+
+        source = os.path.realpath(self.path)
+        if source == self.source or not os.path.isdir(source):
+            return
+
+        graph = FollowGraph.open(source)
+        # Changes from before the build read the edges are in it; later
+        # ones may not be, but applying one it already has is a no-op.
+        with self.lock:
+            self.graph = graph
+            self.source = source
+            for overlay in (self.added, self.removed):
+                for follower_id in list(overlay):
+                    changes = {followed_id: at for followed_id, at
+                               in overlay[follower_id].items()
+                               if at >= graph.built_at}
+                    if changes:
+                        overlay[follower_id] = changes
+                    else:
+                        del overlay[follower_id]
+
+    def following(self, user_id):
+        """Ids `user_id` follows, including changes since the last rebuild."""
+
+        following = set(self.graph.following(user_id).tolist())
+        following.update(self.added.get(user_id, ()))
+        following.difference_update(self.removed.get(user_id, ()))
+        return following
+
+    def suggest(self, user_id, limit=5):
+        """Return up to `limit` (user id, mutual follows) pairs for `user_id`.
+
+        Candidates are the users followed by the people `user_id` follows,
+        scored by how many of them follow the candidate, boosted by the
+        candidate's overall follower count. Any remaining slots are filled
+        with the most-followed users.
+        """
+
+        self.refresh()
+
+        with self.lock:
+            graph = self.graph
+            if graph is None:
+                return []
+            following = self.following(user_id)
+
+            hops = graph.friends_of_friends(following)
+            positions, counts = np.unique(hops, return_counts=True)
+            mutuals = dict(zip(graph.user_ids[positions].tolist(),
+                               counts.tolist()))
+
+            for follower_id in following & set(self.added):
+                for candidate in self.added[follower_id]:
+                    if not graph.follows(follower_id, candidate):
+                        mutuals[candidate] = mutuals.get(candidate, 0) + 1
+            for follower_id in following & set(self.removed):
+                for candidate in self.removed[follower_id]:
+                    if graph.follows(follower_id, candidate):
+                        mutuals[candidate] -= 1
+
+        excluded = following | {user_id}
+        scored = []
+        for candidate, mutual in mutuals.items():
+            if mutual <= 0 or candidate in excluded:
+                continue
+            pos = graph.position(candidate)
+            popularity = graph.follower_counts[pos] if pos is not None else 0
+            score = mutual + self.popularity_weight * np.log1p(popularity)
+            scored.append((score, candidate, mutual))
+
+        scored.sort(reverse=True)
+        suggestions = [(candidate, mutual)
+                       for _, candidate, mutual in scored[:limit]]
+
+        chosen = {candidate for candidate, _ in suggestions}
+        for candidate in graph.popular.tolist():
+            if len(suggestions) >= limit:
+                break
+            if candidate not in excluded and candidate not in chosen:
+                suggestions.append((candidate, 0))
+
+        return suggestions
@@ -0,0 +1,89 @@
+"""Hashtags and @mentions, pulled out of warbles when they're written.
+
+Each `#tag` becomes a (tag, message_id) row in `message_tags` and each
+`@username` of an existing user a (user_id, message_id) row in
+`mentions`. Both tables' primary keys lead with the tag or user, so a
+tag or mention feed is an index range scan, newest first, with a
+`before` id keyset for older pages.
+"""
+
+import re
+
+from sqlalchemy.dialects.postgresql import insert
+
+from models import db, User, Message, MessageTag, Mention
+
+# Not preceded by a word character, so "a#b" and "me@example.com" don't count.
+HASHTAG = re.compile(r'(?<![\w#])#(\w{1,100})')
+MENTION = re.compile(r'(?<![\w@])@(\w+)')
+
+
+def hashtags(text):
+    """The distinct, lower-cased hashtags in `text`."""
+
+    return {tag.lower() for tag in HASHTAG.findall(text)}
+
+
+def mentions(text):
+    """The distinct usernames @mentioned in `text`."""
+
+    return set(MENTION.findall(text))
+
+
+def index(messages):
+    """Record the hashtags and mentions in `messages` (id, text) pairs.
+
+    Runs in the caller's transaction. Indexing a message twice is a
+    no-op, and mentions of usernames that don't exist are skipped.
+    """
+
+    tag_rows = []
+    mention_rows = []
+    for id, text in messages:
+        tag_rows.extend({"tag": tag, "message_id": id}
+                        for tag in hashtags(text))
+        mention_rows.extend((id, username) for username in mentions(text))
+
+    if tag_rows:
+        db.session.execute(insert(MessageTag.__table__)
+                           .values(tag_rows)
+                           .on_conflict_do_nothing())
+
+    if mention_rows:
+        user_ids = dict(db.session
+                        .query(User.username, User.id)
+                        .filter(User.username.in_(
+                            {username for _, username in mention_rows})))
+        rows = [{"user_id": user_ids[username], "message_id": id}
+                for id, username in mention_rows if username in user_ids]
+        if rows:
+            db.session.execute(insert(Mention.__table__)
+                               .values(rows)
+                               .on_conflict_do_nothing())
+
+
+def tagged(tag, before=None):
+    """Query for messages tagged `tag`, newest first."""
+
+    return feed(MessageTag, MessageTag.tag == tag.lower(), before)
+
+
+def mentioning(user_id, before=None):
+    """Query for messages that mention `user_id`, newest first."""
+
+    return feed(Mention, Mention.user_id == user_id, before)
+
+
+def feed(model, condition, before):
+    message_id = model.message_id
+    query = (Message
+             .query
+             .join(model, message_id == Message.id)
+             .filter(condition, Message.deleted_at.is_(None)))
+
+    # Filter and order on the index column, not messages.id, so Postgres
+    # walks the index and stops after one page.
+    if before:
+        query = query.filter(message_id < before)
+
+    return query.order_by(message_id.desc())
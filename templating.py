@@ -0,0 +1,56 @@
+"""Compiled templates kept on disk, so new workers don't recompile them.
+
+Jinja compiles each template to Python code the first time a worker
+renders it. `BytecodeCache` stores that code in a directory shared by
+every worker, and `flask build-templates` (run before gunicorn starts)
+fills it for every template, so a fresh worker only has to load it.
+
+An entry is only used if its checksum matches a hash of the template's
+current source, and Jinja also rejects entries written by another Jinja
+or Python version; anything stale is recompiled and rewritten on first
+use. Gunicorn has each new worker `preload` every template (see
+gunicorn.conf.py), so its first requests find them already loaded.
+"""
+
+import os
+import tempfile
+
+from jinja2 import FileSystemBytecodeCache
+
+# Files under templates/ (and blueprints') that are templates.
+EXTENSIONS = ('html', 'txt', 'xml')
+
+
+class BytecodeCache(FileSystemBytecodeCache):
+    """A FileSystemBytecodeCache whose writes are atomic.
+
+    Workers compiling the same template at once each write a complete
+    file and rename it into place, so none can read a half-written one.
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        super().__init__(directory)
+
+    def dump_bytecode(self, bucket):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                bucket.write_bytecode(f)
+            os.replace(tmp, self._get_cache_filename(bucket))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+
+def preload(env):
+    """Load every template into `env`, compiling any that need it.
+
+    Compiled code goes to `env`'s bytecode cache, and the templates stay
+    in its in-memory cache. Returns the number of templates.
+    """
+
+    names = env.list_templates(extensions=EXTENSIONS)
+    for name in names:
+        env.get_template(name)
+    return len(names)
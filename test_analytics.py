@@ -0,0 +1,80 @@
+"""Daily analytics rollup tests."""
+
+# run these tests like:
+#
+#    python -m pytest test_analytics.py
+
+
+from datetime import datetime, timedelta
+
+import analytics
+from app import CURR_USER_KEY
+from ids import id_for_time
+from models import db, DailyStats, DailyTopPoster, Follows, Likes
+from models import OutboxEvent
+
+
+def test_rollup(user, message, dm):
+    now = datetime.utcnow()
+    today = now.date()
+
+    poster, other, fan = user(), user(), user()
+    warbles = [message(poster) for _ in range(3)]
+    message(other)
+    message(fan, id=id_for_time(now - timedelta(days=1)))
+    dm(fan, poster)
+    Follows.follow(fan.id, [poster.id, other.id])
+    Likes.like(other.id, [warbles[0].id])
+
+    analytics.rollup(today)
+
+    stats = DailyStats.query.get(today)
+    assert (stats.messages, stats.posters, stats.active_users, stats.likes,
+            stats.follows, stats.dms) == (4, 2, 3, 1, 2, 1)
+    assert [(top.user_id, top.messages) for top in DailyTopPoster.query
+            .filter_by(day=today)
+            .order_by(DailyTopPoster.messages.desc())] == [(poster.id, 3),
+                                                            (other.id, 1)]
+
+    # Rolling a day up again replaces it.
+    message(other)
+    analytics.rollup(today)
+    db.session.expire_all()
+    assert DailyStats.query.get(today).messages == 5
+
+
+def test_pending_and_dashboard(client, user, message):
+    now = datetime.utcnow()
+    yesterday = now.date() - timedelta(days=1)
+
+    # Nothing before the outbox started, and not its first, partial day.
+    assert analytics.pending(now, 3) == []
+    started = now - timedelta(days=2)
+    db.session.add(OutboxEvent(id=id_for_time(started),
+                               kind='message.created', data={}))
+    db.session.flush()
+    assert analytics.pending(now, 3)[0] == (started + timedelta(days=1)
+                                            ).date()
+
+    db.session.add(OutboxEvent(id=id_for_time(now - timedelta(days=10)),
+                               kind='message.created', data={}))
+    db.session.flush()
+    assert analytics.pending(now, 3)[0] == now.date() - timedelta(days=3)
+
+    admin = user(admin=True)
+    message(admin, id=id_for_time(now - timedelta(days=1)))
+    for day in analytics.pending(now, 3):
+        analytics.rollup(day)
+
+    assert analytics.pending(now, 3) == []
+
+    days, top = analytics.dashboard(2)
+    assert [day.day for day in days] == [yesterday,
+                                         yesterday - timedelta(days=1)]
+    assert top == [(admin.id, 1)]
+
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = admin.id
+
+    html = client.get("/admin/analytics").get_data(as_text=True)
+    assert f"@{admin.username}" in html
@@ -0,0 +1,87 @@
+"""Static asset pipeline tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_assets.py
+
+
+import gzip
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from assets import build
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app, assets
+
+
+class AssetsTestCase(TestCase):
+    """Test building and serving fingerprinted assets."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.static = os.path.join(self.tmp.name, 'static')
+        shutil.copytree(app.static_folder, self.static)
+
+        self.manifest = build(self.static)
+
+        self.dist = assets.dist
+        assets.dist = os.path.join(self.static, 'dist')
+        assets.load()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        assets.dist = self.dist
+        assets.load()
+        self.tmp.cleanup()
+
+    def test_build(self):
+        """Are files fingerprinted and stylesheet references rewritten?"""
+
+        css = self.manifest['stylesheets/style.css']
+        png = self.manifest['images/nav-bg.png']
+
+        self.assertRegex(css, r'^stylesheets/style\.[0-9a-f]{12}\.css$')
+        self.assertTrue(os.path.isfile(os.path.join(assets.dist, css + '.gz')))
+        self.assertFalse(os.path.isfile(os.path.join(assets.dist, png + '.gz')))
+
+        with open(os.path.join(assets.dist, css)) as f:
+            self.assertIn(f'url("/static/dist/{png}")', f.read())
+
+    def test_serve_compressed(self):
+        """Is the gzip copy served to clients that accept it?"""
+
+        url = '/static/dist/' + self.manifest['stylesheets/style.css']
+
+        resp = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content_encoding, 'gzip')
+        self.assertEqual(resp.mimetype, 'text/css')
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        self.assertIn('immutable', resp.headers['Cache-Control'])
+        self.assertIn(b'.navbar', gzip.decompress(resp.data))
+
+        resp = self.client.get(url)
+
+        self.assertIsNone(resp.content_encoding)
+        self.assertIn(b'.navbar', resp.data)
+
+    def test_asset_url(self):
+        """Do pages link to the fingerprinted stylesheet?"""
+
+        resp = self.client.get('/login')
+
+        self.assertIn('/static/dist/' + self.manifest['stylesheets/style.css'],
+                      resp.get_data(as_text=True))
@@ -0,0 +1,185 @@
+"""Statement timeout, circuit breaker and stale page tests."""
+
+# run these tests like:
+#
+#    python -m pytest test_breaker.py
+
+
+from contextlib import contextmanager
+
+import pytest
+from flask import g
+from sqlalchemy import event
+
+import app as warbler
+from app import app, object_cache
+from breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from models import db, User
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+@contextmanager
+def slow_database(seconds):
+    """Have every query take `seconds` longer.
+
+    Just SELECTs: a slow SET or SAVEPOINT would fail the test's own
+    transaction handling rather than the request's query.
+    """
+
+    def slow(conn, cursor, statement, parameters, context, executemany):
+        if not statement.lstrip().startswith('SELECT'):
+            return statement, parameters
+        return f"SELECT pg_sleep({seconds}); {statement}", parameters
+
+    event.listen(db.engine, 'before_cursor_execute', slow, retval=True)
+    try:
+        yield
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', slow)
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    breaker = CircuitBreaker(threshold=2, reset_after=10, clock=Clock())
+    monkeypatch.setattr(warbler, 'db_breaker', breaker)
+    warbler.stale_pages.clear()
+    return breaker
+
+
+@pytest.fixture
+def short_timeout(monkeypatch):
+    """A 50ms statement timeout for profile pages."""
+
+    monkeypatch.setattr(warbler.users_show, 'statement_timeout', 50)
+    monkeypatch.setitem(app.config, 'DB_STATEMENT_TIMEOUT_MS', 50)
+
+
+def restart_in_request():
+    """Commit, so the next transaction begins in a request.
+
+    The test's transaction began outside any request, where the app
+    doesn't set a statement timeout.
+    """
+
+    with app.test_request_context('/'):
+        g.statement_timeout = 50
+        db.session.commit()
+
+
+def test_breaker():
+    clock = Clock()
+    breaker = CircuitBreaker(threshold=2, reset_after=10, clock=clock)
+
+    breaker.failure()
+    breaker.success()
+    breaker.failure()
+    assert breaker.state == CLOSED and breaker.allow()
+
+    breaker.failure()
+    assert breaker.state == OPEN and not breaker.allow()
+
+    clock.now = 10
+    assert breaker.allow() and breaker.state == HALF_OPEN
+    # Only the one trial request.
+    assert not breaker.allow()
+
+    breaker.failure()
+    assert breaker.state == OPEN
+    clock.now = 19
+    assert not breaker.allow()
+
+    clock.now = 20
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.state == CLOSED and breaker.allow()
+
+
+def test_route_timeout():
+    with app.test_request_context('/'):
+        g.statement_timeout = 123
+        # Start a new (nested) transaction within the request.
+        db.session.commit()
+        timeout = db.session.execute("SHOW statement_timeout").scalar()
+
+    assert timeout == '123ms'
+    assert warbler.homepage.statement_timeout == warbler.READ_TIMEOUT_MS
+
+
+def test_stale_page(client, user, breaker, short_timeout):
+    author = user()
+    # Commits expire `author`, and reloading it would begin a transaction
+    # outside any request (so without the statement timeout).
+    author_id, username = author.id, author.username
+    db.session.commit()
+
+    resp = client.get(f'/users/{author_id}')
+    assert resp.status_code == 200
+    assert 'Warning' not in resp.headers
+
+    object_cache.invalidate(User, author_id)
+    restart_in_request()
+    with slow_database(0.2):
+        resp = client.get(f'/users/{author_id}')
+
+    assert resp.status_code == 200
+    assert resp.headers['Warning'] == '110 - "Response is Stale"'
+    assert f'@{username}' in str(resp.data)
+    assert breaker.failures == 1
+
+    # Never rendered, so there's nothing stale to serve.
+    with slow_database(0.2):
+        resp = client.get('/users/0')
+
+    assert resp.status_code == 503
+    assert breaker.state == OPEN
+
+
+def test_slow_queries_open_breaker(client, breaker, short_timeout):
+    """Do timeouts count up, though the SET before each query works?"""
+
+    restart_in_request()
+    with slow_database(0.2):
+        for _ in range(2):
+            assert client.get('/users/0').status_code == 503
+
+    assert breaker.state == OPEN
+    assert client.get('/users/0').status_code == 503
+    assert breaker.failures == 2
+
+
+def test_request_closes_breaker(client, user, breaker):
+    author_id = user().id
+    db.session.commit()
+    breaker.failure()
+
+    assert client.get(f'/users/{author_id}').status_code == 200
+    assert breaker.failures == 0
+
+
+def test_open_breaker(client, user, breaker):
+    username = user().username
+    db.session.commit()
+    breaker.failure()
+    breaker.failure()
+
+    def fail(*args):
+        raise AssertionError("used the database")
+
+    event.listen(db.engine, 'before_cursor_execute', fail)
+    try:
+        resp = client.post('/login', data={'username': username,
+                                           'password': 'password'})
+        static = client.get('/static/stylesheets/style.css')
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', fail)
+
+    assert resp.status_code == 503
+    assert resp.headers['Retry-After'] == '10'
+    assert static.status_code == 200
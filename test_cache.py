@@ -0,0 +1,173 @@
+"""Object cache tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_cache.py
+
+
+import os
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+from cache import ObjectCache
+from models import db, User, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY, object_cache
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ObjectCacheTestCase(TestCase):
+    """Test read-through caching of users and messages."""
+
+    def setUp(self):
+        User.query.delete()
+        Message.query.delete()
+
+        self.client = app.test_client()
+
+        user = User(username="cached", email="cached@test.com",
+                    password="HASHED_PASSWORD", bio="original bio")
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+
+        msg = Message(text="cached message", user_id=self.user_id)
+        db.session.add(msg)
+        db.session.commit()
+        self.msg_id = msg.id
+
+        object_cache.clear()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_read_through(self):
+        """Is a cached user served without its password hash?"""
+
+        cache = ObjectCache(db.session)
+        user = cache.get(User, self.user_id, groups=('profile',))
+        db.session.expunge_all()
+
+        # Changed behind the cache's back, so a hit still has the old bio.
+        User.query.filter_by(id=self.user_id).update({"bio": "changed"})
+        db.session.commit()
+        db.session.expunge_all()
+
+        user = cache.get(User, self.user_id, groups=('profile',))
+        self.assertEqual(user.bio, "original bio")
+        self.assertNotIn("password", user.__dict__)
+        self.assertIsNone(cache.get(User, -1))
+
+        cache.invalidate(User, self.user_id)
+        db.session.expunge_all()
+        self.assertEqual(cache.get(User, self.user_id).bio, "changed")
+
+    def test_coalesced_misses(self):
+        """Do concurrent misses on one key load it only once?"""
+
+        cache = ObjectCache(db.session)
+        loads = []
+
+        def load():
+            loads.append(1)
+            time.sleep(0.1)
+            return "value"
+
+        results = []
+        threads = [threading.Thread(
+                       target=lambda: results.append(cache.fetch("k", load)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(loads, [1])
+        self.assertEqual(results, ["value"] * 5)
+
+    def test_shared_invalidation(self):
+        """Does invalidating in one worker's cache reach the others?"""
+
+        with tempfile.TemporaryDirectory() as tmp:
+            worker_1 = ObjectCache(db.session, shared_dir=tmp)
+            worker_2 = ObjectCache(db.session, shared_dir=tmp)
+
+            loads = []
+            worker_1.fetch("k", lambda: "first")
+            self.assertEqual(
+                worker_2.fetch("k", lambda: loads.append(1) or "second"),
+                "first")
+            self.assertEqual(loads, [])
+
+            worker_1.get(Message, self.msg_id)
+            Message.query.filter_by(id=self.msg_id).update({"text": "edited"})
+            db.session.commit()
+            worker_1.invalidate(Message, self.msg_id)
+            db.session.expunge_all()
+
+            self.assertEqual(worker_2.get(Message, self.msg_id).text,
+                             "edited")
+
+    def test_shared_versions(self):
+        """Do invalidations reach other workers without a shared store?"""
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'versions')
+            worker_1 = ObjectCache(db.session, versions_path=path)
+            worker_2 = ObjectCache(db.session, versions_path=path)
+
+            self.assertEqual(worker_2.get(Message, self.msg_id).text,
+                             "cached message")
+            Message.query.filter_by(id=self.msg_id).update({"text": "edited"})
+            db.session.commit()
+            worker_1.invalidate(Message, self.msg_id)
+            db.session.expunge_all()
+
+            self.assertEqual(worker_2.get(Message, self.msg_id).text,
+                             "edited")
+
+    def test_views_invalidate(self):
+        """Do profile edits and deletes show up straight away?"""
+
+        resp = self.client.get(f"/users/{self.user_id}")
+        self.assertIn("original bio", resp.get_data(as_text=True))
+        resp = self.client.get(f"/messages/{self.msg_id}")
+        self.assertIn("cached message", resp.get_data(as_text=True))
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            c.post(f"/messages/{self.msg_id}/delete")
+
+        resp = self.client.get(f"/messages/{self.msg_id}")
+        self.assertEqual(resp.status_code, 404)
+
+        User.query.filter_by(id=self.user_id).update({"admin": True})
+        db.session.commit()
+        object_cache.invalidate(User, self.user_id)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            c.post(f"/admin/edit/users/{self.user_id}",
+                   data={"username": "cached", "email": "cached@test.com",
+                         "bio": "new bio"})
+
+        resp = self.client.get(f"/users/{self.user_id}")
+        self.assertIn("new bio", resp.get_data(as_text=True))
@@ -0,0 +1,150 @@
+"""Shared user card cache tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_cards.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from cards import CardTable, UserCard, SEQUENCE
+from models import db, User, Message, Follows
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY, user_cards
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+def card(id, username=None):
+    return UserCard(id, username or f"user{id}", None, 1, 2, 3, 4)
+
+
+class CardTableTestCase(TestCase):
+    """Test the shared-memory table itself."""
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'cards')
+
+    def test_shared(self):
+        """Do cards and invalidations reach other workers' mappings?"""
+
+        worker1 = CardTable(self.path, slots=64)
+        worker2 = CardTable(self.path, slots=64)
+
+        worker1.put(card(7), worker1.version(7))
+        self.assertEqual(worker2.get(7), card(7))
+
+        worker2.invalidate(7)
+        self.assertIsNone(worker1.get(7))
+
+    def test_eviction(self):
+        """Does a full bucket evict its least recently read card?"""
+
+        table = CardTable(self.path, slots=8)
+        for id in range(1, 9):
+            table.put(card(id), 0)
+        for id in range(2, 9):
+            table.get(id)
+
+        table.put(card(9), 0)
+
+        self.assertIsNone(table.get(1))
+        self.assertEqual([table.get(id) for id in range(2, 10)],
+                         [card(id) for id in range(2, 10)])
+
+    def test_write_in_progress(self):
+        """Is a slot that's mid-write read as a miss?"""
+
+        table = CardTable(self.path, slots=8)
+        table.put(card(1), 0)
+        SEQUENCE.pack_into(table.mm, table.bucket_offset(1), 3)
+
+        self.assertIsNone(table.get(1))
+
+    def test_too_long(self):
+        """Are cards that don't fit a slot left out?"""
+
+        table = CardTable(self.path, slots=8)
+
+        self.assertFalse(table.put(card(1, "x" * 65), 0))
+        self.assertIsNone(table.get(1))
+
+    def test_layout_change(self):
+        """Is a file with a different layout replaced?"""
+
+        CardTable(self.path, slots=8).put(card(1), 0)
+        table = CardTable(self.path, slots=16)
+
+        self.assertEqual(table.slots, 16)
+        self.assertIsNone(table.get(1))
+
+
+class UserCardsTestCase(TestCase):
+    """Test cards loaded from the database and their invalidation."""
+
+    def setUp(self):
+        User.query.delete()
+        Message.query.delete()
+
+        self.client = app.test_client()
+
+        users = [User(username=f"carded{i}", email=f"carded{i}@test.com",
+                      password="HASHED_PASSWORD") for i in range(2)]
+        db.session.add_all(users)
+        db.session.commit()
+        self.user_ids = [user.id for user in users]
+
+        db.session.add(Message(text="hello", user_id=self.user_ids[0]))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_read_through(self):
+        """Are counts loaded once and then served from the table?"""
+
+        card = user_cards.get(self.user_ids[0])
+        self.assertEqual((card.username, card.messages, card.followers),
+                         ("carded0", 1, 0))
+
+        db.session.add(Message(text="unseen", user_id=self.user_ids[0]))
+        db.session.commit()
+        self.assertEqual(user_cards.get(self.user_ids[0]).messages, 1)
+
+        user_cards.invalidate([self.user_ids[0]])
+        self.assertEqual(user_cards.get(self.user_ids[0]).messages, 2)
+
+        self.assertIsNone(user_cards.get(-1))
+
+    def test_views_invalidate(self):
+        """Do follows show up in both users' counts straight away?"""
+
+        follower, followed = self.user_ids
+        user_cards.get_many(self.user_ids)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = follower
+
+            c.post(f"/users/follow/{followed}")
+            self.assertEqual(Follows.query.count(), 1)
+
+            resp = c.get("/")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("@carded0", resp.get_data(as_text=True))
+        self.assertEqual(user_cards.get(follower).following, 1)
+        self.assertEqual(user_cards.get(followed).followers, 1)
@@ -0,0 +1,111 @@
+"""Per-user data export tests."""
+
+# run these tests like:
+#
+#    python -m pytest test_exports.py
+
+
+import io
+import json
+import os
+import zipfile
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as warbler
+from app import CURR_USER_KEY
+from exports import Exporter
+from models import db, DataExport, Likes, Message
+
+
+@pytest.fixture
+def exporter(monkeypatch, tmp_path):
+    exporter = Exporter(str(tmp_path), batch_size=2)
+    monkeypatch.setattr(warbler, 'exporter', exporter)
+    return exporter
+
+
+def read(data):
+    """{File name: list of rows} from an export's zip."""
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        return {name: [json.loads(line) for line in
+                       archive.read(name).decode().splitlines()]
+                for name in archive.namelist()}
+
+
+def test_export(client, exporter, user, message, follow, dm):
+    owner, friend = user(), user()
+    warbles = [message(owner) for _ in range(5)]
+    Message.soft_delete(warbles[0].id)
+    liked = message(friend)
+    Likes.like(owner.id, [liked.id])
+    follow(owner, friend)
+    dm(owner, friend)
+    dm(friend, owner)
+    db.session.commit()
+
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = owner.id
+
+    client.post(f'/users/{owner.id}/exports')
+    # Not another while one's waiting.
+    client.post(f'/users/{owner.id}/exports')
+    export_id, = [id for id, in db.session.query(DataExport.id)
+                  .filter_by(user_id=owner.id)]
+
+    assert exporter.claim() == (export_id, owner.id)
+    assert exporter.claim() is None
+    counts = exporter.export(export_id, owner.id)
+    assert counts['messages.ndjson'] == 4
+
+    html = client.get(f'/users/{owner.id}/exports').get_data(as_text=True)
+    assert f'/exports/{export_id}' in html
+
+    resp = client.get(f'/exports/{export_id}')
+    assert resp.status_code == 200
+    files = read(resp.data)
+
+    assert files['profile.ndjson'][0]['username'] == owner.username
+    assert [row['id'] for row in files['messages.ndjson']] == [
+        warble.id for warble in warbles[1:]]
+    assert files['likes.ndjson'][0]['author'] == friend.username
+    assert files['following.ndjson'][0]['id'] == friend.id
+    assert files['followers.ndjson'] == []
+    assert len(files['direct_messages_sent.ndjson']) == 1
+    assert files['direct_messages_received.ndjson'][0]['user_from_id'] == (
+        friend.id)
+    datetime.fromisoformat(files['messages.ndjson'][0]['timestamp'])
+
+
+def test_private(client, exporter, user):
+    owner, other = user(), user()
+    export = DataExport(user_id=owner.id, status='done')
+    db.session.add(export)
+    db.session.commit()
+
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = other.id
+
+    assert client.get(f'/exports/{export.id}').status_code == 404
+    resp = client.post(f'/users/{owner.id}/exports')
+    assert resp.status_code == 302
+    assert DataExport.query.filter_by(user_id=owner.id).count() == 1
+
+
+def test_expire(exporter, user):
+    owner = user()
+    now = datetime.utcnow()
+    old = DataExport(user_id=owner.id, status='done',
+                     finished_at=now - timedelta(days=30))
+    new = DataExport(user_id=owner.id, status='done', finished_at=now)
+    db.session.add_all([old, new])
+    db.session.commit()
+
+    for name in (old.id, new.id, 'gone'):
+        open(exporter.path(name), 'w').close()
+
+    assert exporter.expire(now - timedelta(days=7)) == 2
+    assert os.listdir(exporter.directory) == [f'{new.id}.zip']
+    assert DataExport.query.filter_by(user_id=owner.id).count() == 1
@@ -0,0 +1,131 @@
+"""Group commit tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_groupcommit.py
+
+
+import os
+import threading
+from unittest import TestCase
+
+from sqlalchemy.exc import IntegrityError
+
+from groupcommit import GroupCommitWriter
+from models import db, User, Message, DirectMessage, MessageTag
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class RecordingWriter(GroupCommitWriter):
+    """Writer that records the size of each batch."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batches = []
+
+    def flush(self, batch):
+        self.batches.append(len(batch))
+        super().flush(batch)
+
+
+class GroupCommitTestCase(TestCase):
+    """Test batched inserts of messages and DMs."""
+
+    def setUp(self):
+        User.query.delete()
+        Message.query.delete()
+
+        self.client = app.test_client()
+
+        users = [User(username=f"batched{i}", email=f"batched{i}@test.com",
+                      password="HASHED_PASSWORD") for i in range(2)]
+        db.session.add_all(users)
+        db.session.commit()
+        self.user_ids = [user.id for user in users]
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['GROUP_COMMIT'] = False
+
+    def concurrently(self, calls):
+        """Run each call in its own thread; return results or exceptions."""
+
+        results = [None] * len(calls)
+
+        def run(i, call):
+            try:
+                results[i] = call()
+            except Exception as exc:
+                results[i] = exc
+
+        threads = [threading.Thread(target=run, args=(i, call))
+                   for i, call in enumerate(calls)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_batched(self):
+        """Are concurrent writes committed together?"""
+
+        sender, recipient = self.user_ids
+        writer = RecordingWriter(app, window=0.2)
+
+        ids = self.concurrently(
+            [lambda i=i: writer.post_message(sender, f"#batch {i}")
+             for i in range(5)] +
+            [lambda: writer.send_dm(sender, recipient, "hi")])
+
+        self.assertEqual(sum(writer.batches), 6)
+        self.assertLess(len(writer.batches), 6)
+        self.assertEqual(
+            Message.query.filter(Message.id.in_(ids[:5])).count(), 5)
+        self.assertEqual(MessageTag.query.filter_by(tag="batch").count(), 5)
+        self.assertEqual(DirectMessage.query.get(ids[5]).msg, "hi")
+        self.assertEqual(User.query.get(recipient).unread_dms, 1)
+
+    def test_failed_write(self):
+        """Does a bad row fail only its own caller?"""
+
+        sender, recipient = self.user_ids
+        writer = RecordingWriter(app, window=0.2)
+
+        results = self.concurrently([
+            lambda: writer.send_dm(sender, recipient, "fine"),
+            lambda: writer.send_dm(sender, -1, "nobody"),
+            lambda: writer.post_message(sender, "also fine"),
+        ])
+
+        self.assertIsInstance(results[1], IntegrityError)
+        self.assertIsNotNone(DirectMessage.query.get(results[0]))
+        self.assertIsNotNone(Message.query.get(results[2]))
+        self.assertEqual(writer.batches, [3])
+
+    def test_route(self):
+        """Does posting through the route use the writer when it's on?"""
+
+        app.config['GROUP_COMMIT'] = True
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_ids[0]
+
+            resp = c.post("/messages/new", data={"text": "grouped"})
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(Message.query.one().text, "grouped")
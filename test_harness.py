@@ -0,0 +1,48 @@
+"""Test harness tests: factories and per-test rollback (pytest only)."""
+
+# run these tests like:
+#
+#    python -m pytest test_harness.py
+
+
+import pytest
+
+from app import CURR_USER_KEY
+from models import db, User, Message, DirectMessage
+
+
+def test_factories(user, message, follow, dm):
+    alice, bob = user(), user(bio="bird person")
+    msg = message(alice)
+    follow(bob, alice)
+    dm(alice, bob)
+
+    assert bob.bio == "bird person"
+    assert msg.user_id == alice.id
+    assert bob.is_following(alice)
+    assert DirectMessage.query.filter_by(user_to_id=bob.id).count() == 1
+    assert User.authenticate(alice.username, "password")
+
+
+@pytest.mark.parametrize('run', [1, 2])
+def test_rolled_back(run, client, user):
+    """Is committed data gone by the next test, even after an app rollback?"""
+
+    assert User.query.filter_by(username="isolated").count() == 0
+
+    isolated = User(username="isolated", email="isolated@test.com",
+                    password="HASHED_PASSWORD")
+    db.session.add(isolated)
+    db.session.commit()
+
+    # A failed signup rolls back the app's session; the user above stays.
+    client.post("/signup", data={"username": "isolated",
+                                 "email": "isolated@test.com",
+                                 "password": "password"})
+    assert User.query.filter_by(username="isolated").count() == 1
+
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = isolated.id
+    client.post("/messages/new", data={"text": "committed by the app"})
+
+    assert Message.query.filter_by(user_id=isolated.id).count() == 1
@@ -0,0 +1,93 @@
+"""Message id tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_ids.py
+
+
+import os
+import runpy
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from types import SimpleNamespace
+from unittest import TestCase
+
+import ids
+from ids import SnowflakeGenerator, id_for_time, time_of, MAX_WORKER
+from ids import HOST_WORKERS, WEB_WORKERS
+
+
+class SnowflakeTestCase(TestCase):
+    """Test time-ordered id generation."""
+
+    def test_increasing(self):
+        """Are generated ids unique and increasing?"""
+
+        generate = SnowflakeGenerator(3)
+        ids = [generate() for _ in range(10000)]
+
+        self.assertEqual(ids, sorted(set(ids)))
+
+    def test_time_round_trip(self):
+        when = datetime(2020, 6, 1, 12, 30, 15, 250000)
+        id = id_for_time(when, worker=7, sequence=42)
+
+        self.assertEqual(time_of(id), when)
+        self.assertLess(id, id_for_time(datetime(2020, 6, 1, 12, 30, 16)))
+        self.assertLess(id, 2 ** 63)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            SnowflakeGenerator(MAX_WORKER + 1)
+        with self.assertRaises(ValueError):
+            id_for_time(datetime(2000, 1, 1))
+
+
+class WorkerIdTestCase(TestCase):
+    """Test that live processes never share a worker id."""
+
+    def setUp(self):
+        self.lock_dir = ids.LOCK_DIR
+        self.claimed = ids._claimed
+        ids.LOCK_DIR = tempfile.mkdtemp()
+
+    def tearDown(self):
+        if ids._claimed is not self.claimed:
+            ids._claimed.close()
+        ids.LOCK_DIR = self.lock_dir
+        ids._claimed = self.claimed
+
+    def test_claim(self):
+        """Do other processes get ids apart from gunicorn's and ours?"""
+
+        first = ids.host_id() * HOST_WORKERS + WEB_WORKERS
+        self.assertEqual(ids.claim_worker_id(), first)
+
+        child = subprocess.run(
+            [sys.executable, '-c',
+             'import ids, sys; ids.LOCK_DIR = sys.argv[1]; '
+             'print(ids.claim_worker_id())', ids.LOCK_DIR],
+            check=True, capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(int(child.stdout), first + 1)
+
+    def test_gunicorn_slots(self):
+        """Does a respawned worker take the dead one's id, not a live one's?"""
+
+        config = runpy.run_path(os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py'))
+        server = SimpleNamespace(WORKERS={})
+
+        for pid in range(3):
+            worker = SimpleNamespace()
+            config['pre_fork'](server, worker)
+            server.WORKERS[pid] = worker
+        self.assertEqual([worker.warbler_slot
+                          for worker in server.WORKERS.values()], [0, 1, 2])
+
+        del server.WORKERS[0]
+        respawned = SimpleNamespace()
+        config['pre_fork'](server, respawned)
+        self.assertEqual(respawned.warbler_slot, 0)
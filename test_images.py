@@ -0,0 +1,189 @@
+"""Image proxy tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_images.py
+
+
+import io
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import TestCase, mock
+
+from PIL import Image
+
+import images
+from images import ImageCache, ImageError, fetch_url, resized
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app, image_proxy_cache
+
+
+def png(width, height):
+    """Bytes of a solid-colour PNG."""
+
+    out = io.BytesIO()
+    Image.new('RGB', (width, height), 'teal').save(out, 'PNG')
+    return out.getvalue()
+
+
+class ImageProxyTestCase(TestCase):
+    """Test the resizing image proxy, with a local stand-in fetcher."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        image_proxy_cache.directory = self.tmp.name
+        image_proxy_cache.size = None
+
+        self.fetched = []
+        app.config['IMAGE_FETCHER'] = self.fetch
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config['IMAGE_FETCHER'] = None
+        self.tmp.cleanup()
+
+    def fetch(self, url):
+        self.fetched.append(url)
+        if url == "http://example.com/broken.png":
+            raise ImageError("broken")
+        return png(1000, 800)
+
+    def get_image(self, size, url):
+        with app.test_request_context():
+            link = resized(url, size)
+        resp = self.client.get(link)
+        return resp, Image.open(io.BytesIO(resp.data))
+
+    def test_resize_avatar(self):
+        """Are avatars cropped to squares, cached and served for a year?"""
+
+        resp, image = self.get_image("avatar-sm", "http://example.com/a.png")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(image.size, (96, 96))
+        self.assertIn("immutable", resp.headers["Cache-Control"])
+        self.assertIn("max-age=31536000", resp.headers["Cache-Control"])
+        self.assertNotIn("no-store", resp.headers["Cache-Control"])
+
+        self.get_image("avatar-sm", "http://example.com/a.png")
+        self.assertEqual(self.fetched, ["http://example.com/a.png"])
+
+    def test_resize_header(self):
+        """Do headers keep their aspect ratio?"""
+
+        resp, image = self.get_image("header-sm", "http://example.com/h.png")
+
+        self.assertEqual(image.size, (700, 560))
+
+    def test_static_image(self):
+        """Are local static images resized without the fetcher?"""
+
+        resp, image = self.get_image("avatar-md",
+                                     "/static/images/default-pic.png")
+
+        self.assertEqual(image.size, (140, 140))
+        self.assertEqual(self.fetched, [])
+
+    def test_broken_image(self):
+        """Does a failed fetch fall back to the default image briefly?"""
+
+        resp, image = self.get_image("avatar-lg",
+                                     "http://example.com/broken.png")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(image.size, (400, 400))
+        self.assertNotIn("immutable", resp.headers["Cache-Control"])
+
+    def test_unknown_size(self):
+        with app.test_request_context():
+            link = resized("http://example.com/", "avatar-sm")
+        resp = self.client.get(link.replace("avatar-sm", "huge"))
+
+        self.assertEqual(resp.status_code, 404)
+
+    def test_unsigned(self):
+        """Does the proxy refuse URLs the templates didn't link to?"""
+
+        with app.test_request_context():
+            link = resized("http://example.com/a.png", "avatar-sm")
+
+        for url in ("/images/avatar-sm?url=http://example.com/b.png",
+                    link.replace("a.png", "b.png")):
+            self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.fetched, [])
+
+
+class Redirector(BaseHTTPRequestHandler):
+    """Redirects every request to the cloud metadata service."""
+
+    def do_GET(self):
+        self.send_response(302)
+        self.send_header('Location', 'http://169.254.169.254/latest/')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class FetchTestCase(TestCase):
+    """Test the default fetcher's internal address checks."""
+
+    def test_internal_address(self):
+        with mock.patch('socket.getaddrinfo', return_value=[
+                (None, None, None, '', ('10.0.0.1', 80))]):
+            with self.assertRaises(ImageError):
+                fetch_url("http://images.example.com/a.png")
+
+    def test_redirect_to_internal_address(self):
+        """Is each redirect checked, not just the first URL?"""
+
+        server = HTTPServer(('127.0.0.1', 0), Redirector)
+        threading.Thread(target=server.handle_request, daemon=True).start()
+        check = images.public_address
+
+        def public_address(host, port):
+            # Let the test server pass as a public host.
+            if host == 'images.example.com':
+                return '127.0.0.1'
+            return check(host, port)
+
+        try:
+            with mock.patch.object(images, 'public_address', public_address):
+                with self.assertRaisesRegex(ImageError, "internal"):
+                    fetch_url("http://images.example.com:"
+                              f"{server.server_port}/a.png")
+        finally:
+            server.server_close()
+
+
+class ImageCacheTestCase(TestCase):
+    """Test the LRU disk cache."""
+
+    def test_eviction(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ImageCache(tmp, max_bytes=250)
+
+            first = cache.put("first", b"x" * 100)
+            os.utime(first, (0, 0))
+            second = cache.put("second", b"x" * 100)
+            os.utime(second, (1, 1))
+
+            # Using "first" makes "second" the least recently used.
+            self.assertEqual(cache.get("first"), first)
+            cache.put("third", b"x" * 100)
+
+            self.assertIsNotNone(cache.get("first"))
+            self.assertIsNone(cache.get("second"))
+            self.assertIsNotNone(cache.get("third"))
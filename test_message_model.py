@@ -6,6 +6,7 @@
 
 
 import os
+from datetime import datetime, timedelta
 from unittest import TestCase
 
 from models import db, User, Message, Follows, Likes
@@ -76,3 +77,31 @@ class MessageModelTestCase(TestCase):
         db.session.commit()
         self.assertIn(self.user_id, m.liked_by[0].id)
         self.assertIn(m, self.user.liked_messages)
+
+    def test_soft_delete(self):
+        """Are deleted messages hidden, then purged with their likes?"""
+
+        other = User(email="other@test.com", username="other",
+                     password="HASHED_PASSWORD")
+        m = Message(text="message_test", user_id=self.user.id)
+        db.session.add_all([other, m])
+        db.session.commit()
+        Likes.like(other.id, [m.id])
+        db.session.commit()
+
+        self.assertEqual(Message.soft_delete(m.id), self.user.id)
+        self.assertIsNone(Message.soft_delete(m.id))
+        db.session.commit()
+
+        self.assertEqual(self.user.messages, [])
+        self.assertEqual(other.liked_messages, [])
+        self.assertEqual(Likes.like(other.id, [m.id]), [])
+
+        self.assertEqual(Message.purge(datetime.utcnow() - timedelta(hours=1),
+                                       10), [])
+        self.assertEqual(Message.purge(datetime.utcnow() + timedelta(hours=1),
+                                       10), [m.id])
+        db.session.commit()
+
+        self.assertEqual(Likes.query.count(), 0)
+        self.assertEqual(Message.query.count(), 0)
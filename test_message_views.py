@@ -128,9 +128,12 @@ class MessageViewTestCase(TestCase):
             # Make sure it redirects
             self.assertEqual(resp.status_code, 302)
 
-            msgs = Message.query.all()
+            msgs = Message.query.filter(Message.deleted_at.is_(None)).all()
             self.assertEqual(1, len(msgs))
 
+            resp = c.get(f"/messages/{msg.id}")
+            self.assertEqual(resp.status_code, 404)
+
     def test_get_message(self):
         """Can you get a message?"""
 
@@ -173,3 +176,60 @@ class MessageViewTestCase(TestCase):
 
             self.assertEqual(len(msg.liked_by), 1)
             self.assertEqual(self.testuser_2.id, msg.liked_by[0].id)
+
+    def test_like_message_twice(self):
+        """Does liking a message twice leave a single like?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_2.id
+
+            msg = Message.query.one()
+            c.post(f"/messages/{msg.id}/like")
+            resp = c.post(f"/messages/{msg.id}/like")
+
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(Likes.query.count(), 1)
+
+            c.post(f"/messages/{msg.id}/unlike")
+            resp = c.post(f"/messages/{msg.id}/unlike")
+
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(Likes.query.count(), 0)
+
+    def test_like_own_message(self):
+        """Are likes of your own messages ignored?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            msg = Message.query.one()
+            c.post(f"/messages/{msg.id}/like")
+
+            self.assertEqual(Likes.query.count(), 0)
+
+    def test_batch_like(self):
+        """Can you like many messages in one request?"""
+
+        other = Message(text="other", user_id=self.testuser.id)
+        db.session.add(other)
+        db.session.commit()
+
+        ids = [self.msg.id, other.id, 0]
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_2.id
+
+            resp = c.post("/api/messages/like", json={"ids": ids})
+            self.assertEqual(resp.get_json(), {"liked": 2})
+
+            resp = c.post("/api/messages/like", json={"ids": ids})
+            self.assertEqual(resp.get_json(), {"liked": 0})
+
+            resp = c.post("/api/messages/unlike", json={"ids": ids})
+            self.assertEqual(resp.get_json(), {"unliked": 2})
+
+            resp = c.post("/api/messages/like", json={"ids": ["x"]})
+            self.assertEqual(resp.status_code, 400)
@@ -0,0 +1,65 @@
+"""Migration runner tests."""
+
+# run these tests like:
+#
+#    python -m pytest test_migrate.py
+
+
+import uuid
+
+import pytest
+from sqlalchemy.exc import DataError
+
+from migrate import LOCK_ID, migrate, statements
+from models import db
+
+
+def test_statements():
+    sql = """-- A comment; with a semicolon.
+
+    BEGIN;
+
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS ix
+        ON likes (message_id);
+    COMMIT;
+    """
+
+    assert statements(sql) == [
+        "BEGIN",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix\n        ON likes "
+        "(message_id)",
+        "COMMIT",
+    ]
+
+
+def test_migrate(tmp_path):
+    name = f"0001_test_{uuid.uuid4().hex}.sql"
+    (tmp_path / name).write_text("-- Nothing to change.\n\nSELECT 1;\n"
+                                 "SELECT 2;\n")
+    (tmp_path / "README").write_text("not a migration")
+
+    try:
+        assert migrate(db.engine, str(tmp_path)) == [name]
+        assert migrate(db.engine, str(tmp_path)) == []
+    finally:
+        with db.engine.connect() as connection:
+            connection.execute(
+                "DELETE FROM schema_migrations WHERE name = %(name)s",
+                {'name': name})
+
+
+def test_failed_migration(tmp_path):
+    name = f"0001_test_{uuid.uuid4().hex}.sql"
+    (tmp_path / name).write_text("BEGIN;\nSELECT 1 / 0;\nCOMMIT;\n")
+
+    with pytest.raises(DataError, match='division by zero'):
+        migrate(db.engine, str(tmp_path))
+
+    # Unlocked, and nothing recorded.
+    with db.engine.connect() as connection:
+        assert connection.execute(
+            f"SELECT pg_try_advisory_lock({LOCK_ID})").scalar()
+        connection.execute(f"SELECT pg_advisory_unlock({LOCK_ID})")
+        assert not connection.execute(
+            "SELECT count(*) FROM schema_migrations WHERE name = %(name)s",
+            {'name': name}).scalar()
@@ -0,0 +1,100 @@
+"""Notification tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_notifications.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, Message, User, Notification
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class NotificationTestCase(TestCase):
+    """Test notifications and their unread counters."""
+
+    def setUp(self):
+        User.query.delete()
+        Message.query.delete()
+
+        self.client = app.test_client()
+
+        users = [User(username=f"user{i}", email=f"user{i}@test.com",
+                      password="HASHED_PASSWORD")
+                 for i in range(3)]
+        db.session.add_all(users)
+        db.session.commit()
+        self.user_ids = [user.id for user in users]
+
+        msgs = [Message(text=f"message {i}", user_id=self.user_ids[0])
+                for i in range(2)]
+        db.session.add_all(msgs)
+        db.session.commit()
+        self.msg_ids = [msg.id for msg in msgs]
+
+    def as_user(self, i, method, url, **kwargs):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_ids[i]
+
+            return getattr(c, method)(url, **kwargs)
+
+    def counters(self, i):
+        db.session.expire_all()
+        user = User.query.get(self.user_ids[i])
+        return user.unread_notifications, user.unread_dms
+
+    def test_likes_and_follows(self):
+        """Are likes and follows counted, and cleared when seen?"""
+
+        self.as_user(1, "post", f"/messages/{self.msg_ids[0]}/like")
+        self.as_user(1, "post", f"/messages/{self.msg_ids[0]}/like")
+        self.as_user(2, "post", "/api/messages/like",
+                     json={"ids": self.msg_ids})
+        self.as_user(1, "post", f"/users/follow/{self.user_ids[0]}")
+        # Your own actions don't notify you.
+        self.as_user(0, "post", f"/users/follow/{self.user_ids[0]}")
+
+        self.assertEqual(self.counters(0), (4, 0))
+        self.assertEqual(Notification.query.count(), 4)
+
+        html = self.as_user(0, "get", "/").get_data(as_text=True)
+        self.assertIn('badge-primary">4<', html)
+
+        html = self.as_user(0, "get", "/notifications").get_data(as_text=True)
+        self.assertIn("followed you", html)
+        self.assertIn("message 1", html)
+        self.assertNotIn('badge-primary">4<', html)
+
+        self.assertEqual(self.counters(0), (0, 0))
+        self.assertEqual(Notification.query.filter_by(read=False).count(), 0)
+
+    def test_dms(self):
+        """Are DMs counted per thread and cleared when the thread is read?"""
+
+        self.as_user(1, "post", f"/direct_messages/{self.user_ids[0]}",
+                     data={"text": "hi"})
+        self.as_user(2, "post", f"/direct_messages/{self.user_ids[0]}",
+                     data={"text": "hello"})
+
+        self.assertEqual(self.counters(0), (0, 2))
+
+        self.as_user(0, "get", f"/direct_messages/{self.user_ids[1]}")
+
+        self.assertEqual(self.counters(0), (0, 1))
@@ -0,0 +1,148 @@
+"""Outbox and dispatcher tests."""
+
+# run these tests like:
+#
+#    python -m pytest test_outbox.py
+
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import outbox
+from models import db, Follows, Likes, Message, User
+
+
+@pytest.fixture
+def consumers(monkeypatch):
+    """Just the test's consumers, with every event dispatchable.
+
+    The test's own transaction never finishes, so it's always at or
+    above the real horizon.
+    """
+
+    monkeypatch.setattr(outbox, 'consumers', {})
+    monkeypatch.setattr(outbox, 'horizon', lambda: 2 ** 62)
+    return outbox.consumers
+
+
+def test_dispatch(consumers, user, message):
+    seen = []
+    outbox.consumer('test')(seen.extend)
+
+    author, fan = user(), user()
+    Follows.follow(fan.id, [author.id])
+    warble = message(author)
+    Likes.like(fan.id, [warble.id])
+    Message.soft_delete(warble.id)
+    db.session.commit()
+
+    dispatcher = outbox.Dispatcher(batch_size=2)
+    assert dispatcher.dispatch() == 3
+    assert [(event.kind, event.data) for event in seen] == [
+        ('follow.added', {"follower_id": fan.id, "followed_id": author.id}),
+        ('like.added', {"user_id": fan.id, "message_id": warble.id}),
+        ('message.deleted', {"id": warble.id, "user_id": author.id}),
+    ]
+
+    assert dispatcher.dispatch() == 0
+
+    Follows.unfollow(fan.id, [author.id])
+    db.session.commit()
+
+    assert dispatcher.dispatch() == 1
+    assert seen[-1].kind == 'follow.removed'
+
+    # Rebuilding from scratch.
+    outbox.reset('test')
+    del seen[:]
+    assert dispatcher.dispatch() == 4
+    assert len(seen) == 4
+
+
+def test_user_deleted(consumers, user, message):
+    seen = []
+    outbox.consumer('test')(seen.extend)
+
+    # Ids, not objects: the rows are gone once the session expires.
+    author_id, fan_id, friend_id = (user().id for _ in range(3))
+    warble_id = message(user_id=author_id).id
+    gone_id = message(user_id=author_id).id
+    Message.soft_delete(gone_id)
+    Likes.like(fan_id, [warble_id])
+    Follows.follow(fan_id, [author_id])
+    Follows.follow(author_id, [friend_id])
+    db.session.commit()
+    outbox.Dispatcher().dispatch()
+    del seen[:]
+
+    assert User.delete(author_id)
+    db.session.commit()
+    outbox.Dispatcher().dispatch()
+
+    assert sorted((event.kind, sorted(event.data.items()))
+                  for event in seen) == sorted([
+        ('like.removed', sorted({"user_id": fan_id,
+                                 "message_id": warble_id}.items())),
+        ('follow.removed', sorted({"follower_id": fan_id,
+                                   "followed_id": author_id}.items())),
+        ('follow.removed', sorted({"follower_id": author_id,
+                                   "followed_id": friend_id}.items())),
+        ('message.deleted', sorted({"id": warble_id,
+                                    "user_id": author_id}.items())),
+        ('user.deleted', [("id", author_id)]),
+    ])
+    assert not User.delete(author_id)
+
+
+def test_purge_unlikes(consumers, user, message):
+    seen = []
+    outbox.consumer('test')(seen.extend)
+
+    fan_id, warble_id = user().id, message().id
+    Likes.like(fan_id, [warble_id])
+    Message.soft_delete(warble_id)
+    db.session.commit()
+    outbox.Dispatcher().dispatch()
+    del seen[:]
+
+    assert Message.purge(datetime.utcnow() + timedelta(hours=1), 10) == [
+        warble_id]
+    db.session.commit()
+    outbox.Dispatcher().dispatch()
+
+    assert [(event.kind, event.data) for event in seen] == [
+        ('like.removed', {"user_id": fan_id, "message_id": warble_id})]
+
+
+def test_failing_consumer(consumers, user):
+    calls = []
+
+    @outbox.consumer('flaky')
+    def flaky(events):
+        calls.append(events)
+        if len(calls) == 1:
+            raise RuntimeError("down")
+
+    follower, followed = user(), user()
+    Follows.follow(follower.id, [followed.id])
+    db.session.commit()
+
+    dispatcher = outbox.Dispatcher()
+    assert dispatcher.dispatch() == 0
+    assert dispatcher.dispatch() == 1
+    assert calls[0] == calls[1]
+    assert dispatcher.dispatch() == 0
+
+
+def test_rolled_back(consumers, user):
+    seen = []
+    outbox.consumer('test')(seen.extend)
+
+    follower, followed = user(), user()
+    db.session.commit()
+    Follows.follow(follower.id, [followed.id])
+    db.session.rollback()
+
+    assert outbox.Dispatcher().dispatch() == 0
+    assert seen == []
@@ -0,0 +1,192 @@
+"""Query plan regression tests for the hot routes (pytest only).
+
+Each test requests a page against a seeded, ANALYZEd dataset, captures
+the query that matters and checks Postgres would still answer it from
+an index. A failure prints the plan. test_filters_indexed also checks
+every statement the main pages run has an index for what it filters on.
+"""
+
+# run these tests like:
+#
+#    python -m pytest test_plans.py
+
+
+import pytest
+
+from app import CURR_USER_KEY, TIMELINE_PAGE_SIZE, DM_PAGE_SIZE
+from app import FOLLOWS_PAGE_SIZE, timelines
+from models import db, DirectMessage, Notification
+from plans import capture_queries, capture_statements, explain
+from plans import unindexed_filters
+
+USERS = 2000
+FOLLOWS_PER_USER = 25
+MESSAGES = 50000
+DMS = 20000
+
+# Seeded user ids start here, clear of any real ones.
+FIRST_ID = 1000000
+
+
+@pytest.fixture
+def seeded():
+    """Fill the tables (in the test's transaction) and ANALYZE them.
+
+    Returns the id of a seeded user.
+    """
+
+    db.session.execute(f"""
+        INSERT INTO users (id, username, email, password, admin)
+        SELECT {FIRST_ID} + g, 'seed' || g, 'seed' || g || '@test.com', 'x', false
+        FROM generate_series(1, {USERS}) g;
+
+        INSERT INTO follows (user_following_id, user_being_followed_id)
+        SELECT {FIRST_ID} + f, {FIRST_ID} + 1 + (f + n * 37) % {USERS}
+        FROM generate_series(1, {USERS}) f,
+             generate_series(1, {FOLLOWS_PER_USER}) n
+        ON CONFLICT DO NOTHING;
+
+        INSERT INTO messages (id, user_id, text)
+        SELECT g, {FIRST_ID} + 1 + g % {USERS}, 'seeded warble ' || g
+        FROM generate_series(1, {MESSAGES}) g;
+
+        INSERT INTO direct_messages (id, user_from_id, user_to_id, msg)
+        SELECT g, {FIRST_ID} + 1 + g % {USERS},
+               {FIRST_ID} + 1 + (g * 7) % {USERS}, 'dm ' || g
+        FROM generate_series(1, {DMS}) g;
+
+        ANALYZE users;
+        ANALYZE follows;
+        ANALYZE messages;
+        ANALYZE direct_messages;
+    """)
+
+    return FIRST_ID + 1
+
+
+def get(client, user_id, url):
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = user_id
+
+    with capture_queries() as queries:
+        resp = client.get(url)
+        resp.get_data()
+
+    assert resp.status_code == 200
+    return queries
+
+
+def test_timeline(client, seeded):
+    timelines.clear()
+    queries = get(client, seeded, "/")
+
+    # Filling the followed authors' buffers.
+    plan = explain(queries.matching("FROM messages", "author.after"))
+    plan.assert_index_lookup('messages', 'ix_messages_user_id_id_deleted_at')
+
+    plan = explain(queries.matching("FROM messages", "messages.id IN"))
+    plan.assert_index_lookup('messages', 'messages_pkey')
+    plan.assert_rows_at_most(TIMELINE_PAGE_SIZE)
+
+
+def test_timeline_from_sql(client, seeded, monkeypatch):
+    """Paging back past what's buffered."""
+
+    timelines.clear()
+    monkeypatch.setattr(timelines, 'buffer_size', 5)
+    queries = get(client, seeded, "/?before=100")
+
+    plan = explain(queries.matching("FROM messages", "messages.id < "))
+    plan.assert_index_lookup('messages', 'ix_messages_user_id_id_deleted_at')
+    plan.assert_rows_at_most(TIMELINE_PAGE_SIZE)
+
+
+def test_dm_thread(client, seeded):
+    queries = get(client, seeded, f"/direct_messages/{seeded + 7}")
+
+    plan = explain(queries.matching("FROM direct_messages"))
+
+    # Either side's index serves the conversation.
+    plan.assert_index_lookup('direct_messages',
+                             columns=('user_from_id', 'user_to_id'))
+    plan.assert_rows_at_most(DM_PAGE_SIZE)
+
+
+def test_followers(client, seeded):
+    queries = get(client, seeded, f"/users/{seeded}/followers")
+
+    plan = explain(queries.matching("JOIN follows"))
+
+    # Or follows_pkey, which leads with the same column.
+    plan.assert_index_lookup('follows', columns=('user_being_followed_id',))
+    plan.assert_rows_at_most(FOLLOWS_PAGE_SIZE)
+
+
+def test_following(client, seeded):
+    queries = get(client, seeded, f"/users/{seeded}/following")
+
+    plan = explain(queries.matching("JOIN follows"))
+
+    plan.assert_index_lookup('follows', columns=('user_following_id',))
+    plan.assert_rows_at_most(FOLLOWS_PAGE_SIZE)
+
+
+def test_user_search(client, seeded):
+    queries = get(client, seeded, "/users?q=seed123")
+
+    # The seeded users fit in a few pages, which a sequential scan (or a
+    # walk down users_pkey, for the order) can honestly beat the trigram
+    # index on.
+    plan = explain(queries.matching("FROM users", "LIKE"),
+                   disable=('seqscan', 'indexscan'))
+
+    plan.assert_index_lookup('users', 'ix_users_username_trgm')
+    plan.assert_rows_at_most(100)
+
+
+def test_unindexed_filters():
+    kind = Notification.query.filter(Notification.kind == 'like')
+    assert unindexed_filters(kind.statement) == [('notifications', ('kind',))]
+
+    either = Notification.query.filter(
+        db.or_(Notification.user_id == 1, Notification.kind == 'like'))
+    assert unindexed_filters(either.statement) == [('notifications',
+                                                    ('kind',))]
+
+    # The user_id condition finds the rows; the OR just filters them.
+    within = Notification.query.filter(
+        Notification.user_id == 1,
+        db.or_(Notification.kind == 'like', Notification.actor_id == 2))
+    assert unindexed_filters(within.statement) == []
+
+    conversations = DirectMessage.query.filter(
+        db.or_(DirectMessage.user_to_id == 1,
+               DirectMessage.user_from_id == 1))
+    assert unindexed_filters(conversations.statement) == []
+
+
+def test_filters_indexed(client, user, message, follow, dm):
+    me, other = user(), user()
+    follow(me, other)
+    warble = message(other, text=f"hi @{me.username} #plans")
+    dm(other, me)
+
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = me.id
+
+    with capture_statements() as statements:
+        for url in ["/", "/users", "/users?q=fact", f"/users/{other.id}",
+                    f"/users/{other.id}/likes", f"/users/{me.id}/following",
+                    f"/users/{other.id}/followers",
+                    f"/users/{me.id}/mentions", f"/messages/{warble.id}",
+                    "/messages/trending", "/tags/plans", "/notifications",
+                    "/direct_messages", f"/direct_messages/{other.id}",
+                    "/api/users/suggestions"]:
+            resp = client.get(url)
+            resp.get_data()
+            assert resp.status_code == 200, url
+
+    assert statements
+    assert [(str(statement), unindexed_filters(statement))
+            for statement in statements
+            if unindexed_filters(statement)] == []
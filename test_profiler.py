@@ -0,0 +1,105 @@
+"""Request profiler tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_profiler.py
+
+
+import os
+import time
+from unittest import TestCase
+
+from models import db, User, RequestProfile
+from profiler import Profiler
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+
+db.create_all()
+
+
+class ProfilerTestCase(TestCase):
+    """Test sampling and per-request profiles."""
+
+    def setUp(self):
+        User.query.delete()
+        RequestProfile.query.delete()
+
+        self.client = app.test_client()
+
+        users = [User(username=f"user{i}", email=f"user{i}@test.com",
+                      password="HASHED_PASSWORD", admin=(i == 0))
+                 for i in range(2)]
+        db.session.add_all(users)
+        db.session.commit()
+        self.admin_id, self.user_id = [user.id for user in users]
+
+    def get(self, user_id, url, **kwargs):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            return c.get(url, **kwargs)
+
+    def test_categories(self):
+        """Is time split between the database and Python?"""
+
+        def busy(seconds):
+            end = time.perf_counter() + seconds
+            while time.perf_counter() < end:
+                pass
+
+        def dispatch_request():
+            db.session.execute("SELECT pg_sleep(0.1)")
+            busy(0.1)
+
+        profiler = Profiler(interval=0.001).start()
+        dispatch_request()
+        profiler.stop()
+
+        self.assertGreater(profiler.seconds('db'), 0.05)
+        self.assertGreater(profiler.seconds('python'), 0.05)
+        self.assertLessEqual(sum(profiler.times.values()),
+                             profiler.duration)
+
+        lines = profiler.collapsed().splitlines()
+        self.assertTrue(any(line.startswith('db;dispatch_request ')
+                            for line in lines))
+        self.assertTrue(any('busy (test_profiler.py' in line
+                            for line in lines))
+
+    def test_admin_profile(self):
+        """Do admins get a stored profile when they ask for one?"""
+
+        resp = self.get(self.admin_id, "/users?profile=1")
+
+        profile = RequestProfile.query.one()
+        self.assertEqual(resp.headers["X-Profile-URL"],
+                         f"/admin/profiles/{profile.id}")
+        self.assertEqual(profile.path, "/users?profile=1")
+        self.assertEqual(profile.status, 200)
+
+        resp = self.get(self.admin_id, f"/admin/profiles/{profile.id}")
+        self.assertIn("/users?profile=1", resp.get_data(as_text=True))
+
+        resp = self.get(self.admin_id,
+                        f"/admin/profiles/{profile.id}/collapsed")
+        self.assertEqual(resp.mimetype, "text/plain")
+
+    def test_not_triggered(self):
+        """Are other users' and unflagged requests left alone?"""
+
+        resp = self.get(self.user_id, "/users", headers={"X-Profile": "1"})
+        self.assertNotIn("X-Profile-URL", resp.headers)
+
+        self.get(self.admin_id, "/users")
+
+        self.assertEqual(RequestProfile.query.count(), 0)
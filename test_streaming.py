@@ -0,0 +1,130 @@
+"""Streamed rendering and gzip middleware tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_streaming.py
+
+
+import gzip
+import os
+import zlib
+from unittest import TestCase
+
+from models import db, Follows, User
+from streaming import GzipMiddleware
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+
+db.create_all()
+
+
+class GzipMiddlewareTestCase(TestCase):
+    """Test compressing responses chunk by chunk."""
+
+    def wsgi_app(self, chunks, content_type='text/html'):
+        def app(environ, start_response):
+            start_response('200 OK', [('Content-Type', content_type)])
+            return iter(chunks)
+        return GzipMiddleware(app)
+
+    def call(self, app, accept='gzip'):
+        headers = {}
+
+        def start_response(status, response_headers, exc_info=None):
+            headers.update(response_headers)
+
+        body = app({'HTTP_ACCEPT_ENCODING': accept}, start_response)
+        return headers, body
+
+    def test_chunks_flushed(self):
+        """Is every chunk decompressible as soon as it is sent?"""
+
+        app = self.wsgi_app([b'<p>first</p>', b'<p>second</p>'])
+        headers, body = self.call(app)
+
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.assertEqual(decompressor.decompress(next(body)), b'<p>first</p>')
+        self.assertEqual(decompressor.decompress(next(body)), b'<p>second</p>')
+
+    def test_passthrough(self):
+        """Are non-text responses and non-gzip clients left alone?"""
+
+        headers, body = self.call(self.wsgi_app([b'x'], 'image/png'))
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(list(body), [b'x'])
+
+        headers, body = self.call(self.wsgi_app([b'x']), accept='')
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+
+
+class StreamedListTestCase(TestCase):
+    """Test the streamed user list pages."""
+
+    def setUp(self):
+        User.query.delete()
+
+        self.client = app.test_client()
+
+        db.session.add_all([
+            User(username=f"user{i}", email=f"user{i}@test.com",
+                 password="HASHED_PASSWORD")
+            for i in range(30)
+        ])
+        db.session.commit()
+
+    def test_list_users(self):
+        resp = self.client.get("/users",
+                               headers={'Accept-Encoding': 'gzip'})
+        html = gzip.decompress(resp.data).decode('utf-8')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("@user0", html)
+        self.assertIn("@user29", html)
+
+    def test_search_no_results(self):
+        resp = self.client.get("/users?q=nobody")
+
+        self.assertIn("Sorry, no users found", resp.get_data(as_text=True))
+
+    def test_list_users_following(self):
+        """Does each card show whether the viewer follows its user?"""
+
+        viewer, followed = (User.query.filter_by(username=f"user{i}").one()
+                            for i in (0, 1))
+        Follows.follow(viewer.id, [followed.id])
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = viewer.id
+
+            html = c.get("/users").get_data(as_text=True)
+
+        self.assertEqual(html.count("Unfollow"), 1)
+        self.assertIn(f'action="/users/stop-following/{followed.id}"', html)
+        self.assertIn(f'action="/users/follow/{viewer.id}"', html)
+
+    def test_admin_list(self):
+        admin = User.query.filter_by(username="user0").one()
+        admin.admin = True
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = admin.id
+
+            html = c.get("/admin").get_data(as_text=True)
+
+            self.assertIn("@user29", html)
@@ -0,0 +1,144 @@
+"""Who-to-follow suggestion tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_suggestions.py
+
+
+import os
+import tempfile
+import time
+from unittest import TestCase
+
+from models import db, User, Follows
+from suggestions import FollowGraph, SuggestionEngine
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY, suggestion_engine
+
+db.create_all()
+
+
+def engine_for(edges):
+    """A SuggestionEngine over a fixed list of (follower, followed) edges."""
+
+    engine = SuggestionEngine()
+    engine.graph = FollowGraph.from_edges(*zip(*edges))
+    return engine
+
+
+class FollowGraphTestCase(TestCase):
+    """Test the CSR follow-graph index."""
+
+    def test_follow_graph(self):
+        graph = FollowGraph.from_edges([1, 1, 2, 3], [2, 3, 3, 10])
+
+        self.assertEqual(len(graph), 4)
+        self.assertEqual(graph.following(1).tolist(), [2, 3])
+        self.assertEqual(graph.following(10).tolist(), [])
+        self.assertEqual(graph.following(99).tolist(), [])
+        self.assertTrue(graph.follows(2, 3))
+        self.assertFalse(graph.follows(3, 2))
+        self.assertEqual(graph.popular[0], 3)
+
+    def test_friends_of_friends(self):
+        # 1 follows 2 and 3, who both follow 4; 3 also follows 5.
+        engine = engine_for([(1, 2), (1, 3), (2, 4), (3, 4), (3, 5), (6, 5)])
+
+        self.assertEqual(engine.suggest(1, limit=2), [(4, 2), (5, 1)])
+
+    def test_incremental_updates(self):
+        engine = engine_for([(1, 2), (2, 4), (3, 5)])
+        self.assertEqual(engine.suggest(1, limit=1), [(4, 1)])
+
+        engine.follow_added(1, 3)
+        engine.follow_removed(2, 4)
+        self.assertEqual(engine.suggest(1, limit=1), [(5, 1)])
+
+        engine.follow_added(1, 5)
+        self.assertNotIn(5, [id for id, _ in engine.suggest(1)])
+
+    def test_saved_graph(self):
+        """Does an engine map in each new build, keeping newer changes?"""
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'graph')
+            engine = SuggestionEngine(path, check_every=0)
+            self.assertEqual(engine.suggest(1), [])
+
+            graph = FollowGraph.from_edges([1, 2], [2, 4])
+            graph.built_at = time.time()
+            graph.save(path)
+            self.assertEqual(engine.suggest(1, limit=1), [(4, 1)])
+            engine.follow_added(1, 3)
+
+            older = FollowGraph.from_edges([1, 2, 3], [2, 4, 5])
+            older.built_at = graph.built_at - 1
+            older.save(path)
+            # 1's follow of 3 came after the build, so it's still applied.
+            self.assertEqual(sorted(engine.suggest(1, limit=2)),
+                             [(4, 1), (5, 1)])
+            self.assertEqual(len(os.listdir(tmp)), 2)
+
+    def test_popular_fallback(self):
+        engine = engine_for([(2, 3), (4, 3), (5, 3), (2, 4)])
+
+        self.assertEqual(engine.suggest(1, limit=2), [(3, 0), (4, 0)])
+
+
+class SuggestionViewTestCase(TestCase):
+    """Test the suggestion endpoint."""
+
+    def setUp(self):
+        Follows.query.delete()
+        User.query.delete()
+
+        self.client = app.test_client()
+
+        users = [User.signup(username=f"user{i}",
+                             email=f"user{i}@test.com",
+                             password="password",
+                             image_url=None)
+                 for i in range(3)]
+        db.session.commit()
+
+        self.ids = [user.id for user in users]
+        db.session.add_all([
+            Follows(user_following_id=self.ids[0],
+                    user_being_followed_id=self.ids[1]),
+            Follows(user_following_id=self.ids[1],
+                    user_being_followed_id=self.ids[2]),
+        ])
+        db.session.commit()
+
+        FollowGraph.load().save(suggestion_engine.path)
+        db.session.rollback()
+        suggestion_engine.reset()
+
+    def test_suggestions(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.ids[0]
+
+            resp = c.get("/api/users/suggestions")
+            suggestions = resp.get_json()["suggestions"]
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(suggestions[0]["id"], self.ids[2])
+            self.assertEqual(suggestions[0]["mutual_follows"], 1)
+
+            c.post(f"/users/follow/{self.ids[2]}")
+            resp = c.get("/api/users/suggestions")
+
+            self.assertEqual(resp.get_json()["suggestions"], [])
+
+            resp = c.get("/")
+            self.assertEqual(resp.status_code, 200)
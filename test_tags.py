@@ -0,0 +1,122 @@
+"""Hashtag and mention tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_tags.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, Message, User, MessageTag, Mention
+from tags import hashtags, mentions
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+import app as warbler
+from app import app, CURR_USER_KEY
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class TagsTestCase(TestCase):
+    """Test indexing and browsing hashtags and mentions."""
+
+    def setUp(self):
+        User.query.delete()
+        Message.query.delete()
+
+        self.client = app.test_client()
+
+        users = [User(username=f"user{i}", email=f"user{i}@test.com",
+                      password="HASHED_PASSWORD")
+                 for i in range(2)]
+        db.session.add_all(users)
+        db.session.commit()
+        self.user_ids = [user.id for user in users]
+
+    def post(self, text):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_ids[0]
+
+            c.post("/messages/new", data={"text": text})
+
+    def test_parse(self):
+        self.assertEqual(hashtags("#Flask and #flask, not a#b or ##x"),
+                         {"flask"})
+        self.assertEqual(mentions("hi @user1! mail me@example.com"),
+                         {"user1"})
+
+    def test_index_on_write(self):
+        """Are tags and mentions of real users stored with the message?"""
+
+        self.post("Hello #World @user1 @nobody")
+
+        msg = Message.query.one()
+        self.assertEqual([t.tag for t in MessageTag.query], ["world"])
+        self.assertEqual([(m.user_id, m.message_id) for m in Mention.query],
+                         [(self.user_ids[1], msg.id)])
+
+        resp = self.client.get("/tags/World")
+        self.assertIn("Hello #World", resp.get_data(as_text=True))
+
+        resp = self.client.get(f"/users/{self.user_ids[1]}/mentions")
+        self.assertIn("Hello #World", resp.get_data(as_text=True))
+
+        resp = self.client.get(f"/users/{self.user_ids[0]}/mentions")
+        self.assertNotIn("Hello #World", resp.get_data(as_text=True))
+
+    def test_feed_pages(self):
+        """Are older pages fetched with the before keyset?"""
+
+        for i in range(3):
+            self.post(f"post {i} #paged")
+
+        page_size = warbler.TIMELINE_PAGE_SIZE
+        warbler.TIMELINE_PAGE_SIZE = 2
+        try:
+            html = self.client.get("/tags/paged").get_data(as_text=True)
+            self.assertIn("post 2", html)
+            self.assertIn("post 1", html)
+            self.assertNotIn("post 0", html)
+
+            ids = [id for id, in db.session.query(Message.id)
+                   .order_by(Message.id)]
+            self.assertIn(f"/tags/paged?before={ids[1]}", html)
+
+            html = self.client.get(
+                f"/tags/paged?before={ids[1]}").get_data(as_text=True)
+            self.assertIn("post 0", html)
+            self.assertNotIn("post 1", html)
+        finally:
+            warbler.TIMELINE_PAGE_SIZE = page_size
+
+    def test_backfill(self):
+        """Does the backfill command index existing messages?"""
+
+        db.session.add_all([
+            Message(text=f"old #backfill @user{i % 2}",
+                    user_id=self.user_ids[0])
+            for i in range(5)])
+        db.session.commit()
+
+        batch_size = warbler.TAG_BACKFILL_BATCH_SIZE
+        warbler.TAG_BACKFILL_BATCH_SIZE = 2
+        try:
+            result = app.test_cli_runner().invoke(args=["index-tags"])
+        finally:
+            warbler.TAG_BACKFILL_BATCH_SIZE = batch_size
+
+        self.assertIn("Indexed 5 messages.", result.output)
+        self.assertEqual(MessageTag.query.count(), 5)
+        self.assertEqual(Mention.query.count(), 5)
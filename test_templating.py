@@ -0,0 +1,74 @@
+"""Compiled template cache tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_templating.py
+
+
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from jinja2 import Environment, FileSystemLoader
+
+from templating import BytecodeCache, preload
+
+
+class TemplateCacheTestCase(TestCase):
+    """Test compiling templates ahead of time and reusing the code."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.templates = os.path.join(self.tmp.name, 'templates')
+        self.cache = os.path.join(self.tmp.name, 'cache')
+
+        os.makedirs(os.path.join(self.templates, 'users'))
+        self.write('base.html', '<h1>{% block title %}{% endblock %}</h1>')
+        self.write('users/detail.html', '{% extends "base.html" %}'
+                                        '{% block title %}@{{ name }}'
+                                        '{% endblock %}')
+        self.write('notes.md', 'not a template')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, source):
+        with open(os.path.join(self.templates, name), 'w') as f:
+            f.write(source)
+
+    def env(self):
+        """A fresh environment, as a newly started worker would have."""
+
+        return Environment(loader=FileSystemLoader(self.templates),
+                           bytecode_cache=BytecodeCache(self.cache))
+
+    def test_precompile(self):
+        """Does a new environment load templates without compiling them?"""
+
+        self.assertEqual(preload(self.env()), 2)
+        self.assertEqual(len(os.listdir(self.cache)), 2)
+
+        env = self.env()
+        with mock.patch.object(env, 'compile',
+                               side_effect=AssertionError("compiled")):
+            html = env.get_template('users/detail.html').render(name='bob')
+
+        self.assertEqual(html, '<h1>@bob</h1>')
+
+    def test_stale(self):
+        """Is a template recompiled once its source changes?"""
+
+        preload(self.env())
+        self.write('base.html', '<h2>{% block title %}{% endblock %}</h2>')
+
+        env = self.env()
+        with mock.patch.object(env, 'compile', wraps=env.compile) as compile:
+            html = env.get_template('users/detail.html').render(name='bob')
+
+        self.assertEqual(html, '<h2>@bob</h2>')
+        self.assertEqual(compile.call_count, 1)
+
+        env = self.env()
+        with mock.patch.object(env, 'compile',
+                               side_effect=AssertionError("compiled")):
+            env.get_template('base.html')
@@ -0,0 +1,149 @@
+"""Timeline engine tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_timeline.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+from plans import capture_queries
+from timeline import TimelineEngine, page_from_sql
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY, timelines
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class TimelineEngineTestCase(TestCase):
+    """Test timelines merged from per-author buffers."""
+
+    def setUp(self):
+        User.query.delete()
+        Message.query.delete()
+
+        self.client = app.test_client()
+
+        users = [User(username=f"author{i}", email=f"author{i}@test.com",
+                      password="HASHED_PASSWORD") for i in range(3)]
+        db.session.add_all(users)
+        db.session.commit()
+        self.user_ids = [user.id for user in users]
+
+        # Interleaved, so the merge has work to do.
+        msgs = [Message(text=f"message {i}", user_id=self.user_ids[i % 3])
+                for i in range(12)]
+        for msg in msgs:
+            db.session.add(msg)
+            db.session.flush()
+        db.session.commit()
+        self.msg_ids = [msg.id for msg in msgs]
+
+        timelines.clear()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def newest(self, author_indexes, before=None, limit=100):
+        return [(id, self.user_ids[i % 3])
+                for i, id in reversed(list(enumerate(self.msg_ids)))
+                if i % 3 in author_indexes and (before is None or id < before)
+                ][:limit]
+
+    def test_merge(self):
+        """Are pages merged newest first, without queries once warm?"""
+
+        authors = self.user_ids[:2]
+        engine = TimelineEngine()
+
+        self.assertEqual(engine.timeline(authors, limit=5),
+                         self.newest({0, 1}, limit=5))
+
+        with capture_queries() as queries:
+            page = engine.timeline(authors, before=self.msg_ids[7], limit=3)
+        self.assertEqual(page, self.newest({0, 1}, self.msg_ids[7], 3))
+        self.assertEqual(queries, [])
+
+    def test_past_buffers(self):
+        """Does paging back past the buffers fall back to SQL?"""
+
+        engine = TimelineEngine(buffer_size=2)
+        authors = self.user_ids
+
+        self.assertEqual(engine.timeline(authors, limit=4),
+                         self.newest({0, 1, 2}, limit=4))
+        self.assertEqual(engine.timeline(authors, self.msg_ids[5], limit=4),
+                         self.newest({0, 1, 2}, self.msg_ids[5], 4))
+        self.assertEqual(page_from_sql(authors, self.msg_ids[5], 4),
+                         self.newest({0, 1, 2}, self.msg_ids[5], 4))
+
+    def test_eviction(self):
+        """Are least recently used authors evicted?"""
+
+        engine = TimelineEngine(max_authors=2)
+
+        engine.timeline(self.user_ids[:1])
+        engine.timeline(self.user_ids[1:])
+
+        self.assertEqual(set(engine.buffers), set(self.user_ids[1:]))
+        self.assertEqual(engine.timeline(self.user_ids, limit=4),
+                         self.newest({0, 1, 2}, limit=4))
+
+    def test_refresh(self):
+        """Are other workers' messages picked up once a buffer is stale?"""
+
+        engine = TimelineEngine(max_age=0)
+        author = self.user_ids[0]
+        engine.timeline([author])
+
+        msg = Message(text="from another worker", user_id=author)
+        db.session.add(msg)
+        db.session.commit()
+
+        self.assertEqual(engine.timeline([author], limit=1), [(msg.id, author)])
+
+    def test_views(self):
+        """Do posting and deleting update the home timeline straight away?"""
+
+        reader, author = self.user_ids[:2]
+        db.session.add(Follows(user_following_id=reader,
+                               user_being_followed_id=author))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = author
+
+            c.get("/")
+            c.post("/messages/new", data={"text": "brand new"})
+            new_id = Message.query.filter_by(text="brand new").one().id
+            self.assertEqual(timelines.buffers[author].ids[-1], new_id)
+
+            c.post(f"/messages/{self.msg_ids[1]}/delete")
+            self.assertNotIn(self.msg_ids[1], timelines.buffers[author].ids)
+
+            # Deleted behind the engine's back, e.g. by another worker.
+            Message.query.filter_by(id=self.msg_ids[4]).delete()
+            db.session.commit()
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = reader
+            html = c.get("/").get_data(as_text=True)
+
+        self.assertIn("brand new", html)
+        self.assertNotIn("message 1<", html)
+        self.assertNotIn("message 4<", html)
+        self.assertNotIn(self.msg_ids[4], timelines.buffers[author].ids)
@@ -0,0 +1,114 @@
+"""Trending messages tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_trending.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, Message, User, TrendingBucket
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY, trending
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class TrendingTestCase(TestCase):
+    """Test trending messages."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        User.query.delete()
+        Message.query.delete()
+
+        self.client = app.test_client()
+
+        users = [User.signup(username=f"user{i}",
+                             email=f"user{i}@test.com",
+                             password="password",
+                             image_url=None)
+                 for i in range(3)]
+        db.session.commit()
+        self.user_ids = [user.id for user in users]
+
+        msgs = [Message(text=f"message {i}", user_id=self.user_ids[0])
+                for i in range(3)]
+        db.session.add_all(msgs)
+        db.session.commit()
+        self.msg_ids = [msg.id for msg in msgs]
+
+        trending.reset()
+
+    def like(self, user_id, message_id, action="like"):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            c.post(f"/messages/{message_id}/{action}")
+
+    def test_trending_order(self):
+        """Are messages ranked by recent likes?"""
+
+        self.like(self.user_ids[1], self.msg_ids[1])
+        self.like(self.user_ids[2], self.msg_ids[1])
+        self.like(self.user_ids[1], self.msg_ids[2])
+
+        resp = self.client.get("/api/messages/trending")
+        ids = [int(msg["id"]) for msg in resp.get_json()["trending"]]
+
+        self.assertEqual(ids, [self.msg_ids[1], self.msg_ids[2]])
+
+        resp = self.client.get("/messages/trending")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("message 1", resp.get_data(as_text=True))
+
+    def test_unlike(self):
+        """Does unliking take a message back off the list?"""
+
+        self.like(self.user_ids[1], self.msg_ids[0])
+        self.like(self.user_ids[1], self.msg_ids[0])
+        self.like(self.user_ids[1], self.msg_ids[0], "unlike")
+
+        self.assertEqual(TrendingBucket.query.one().likes, 0)
+        self.assertEqual(trending.top(), [])
+
+    def test_decay_and_window(self):
+        """Do older likes count for less, and expired ones not at all?"""
+
+        current = trending.current_bucket()
+        db.session.add_all([
+            TrendingBucket(message_id=self.msg_ids[0], bucket=current,
+                           likes=1),
+            TrendingBucket(message_id=self.msg_ids[1], bucket=current - 1,
+                           likes=1),
+            TrendingBucket(message_id=self.msg_ids[2],
+                           bucket=current - trending.window_buckets,
+                           likes=100),
+        ])
+        db.session.commit()
+
+        top = trending.top()
+
+        self.assertEqual([id for id, _ in top], self.msg_ids[:2])
+        self.assertAlmostEqual(top[0][1], 1)
+        self.assertLess(top[1][1], 1)
+        # Lookups leave the table alone; pruning is a CLI job.
+        self.assertEqual(TrendingBucket.query.count(), 3)
+
+        result = app.test_cli_runner().invoke(args=['prune-trending'])
+        self.assertIn("Pruned 1 trending buckets.", result.output)
+        self.assertEqual(TrendingBucket.query.count(), 2)
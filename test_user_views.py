@@ -6,9 +6,10 @@
 
 
 import os
+from datetime import datetime
 from unittest import TestCase
 
-from models import db, connect_db, Message, User, Likes
+from models import db, connect_db, Message, User, Likes, Follows
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -146,3 +147,93 @@ class UserViewTestCase(TestCase):
             # Make sure it redirects
             self.assertEqual(resp.status_code, 302)
             self.assertEqual(len(first.following), 0)
+
+    def test_remove_missing_follow(self):
+        """Does unfollowing someone you don't follow fail gracefully?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.post("/users/stop-following/0")
+
+            self.assertEqual(resp.status_code, 302)
+
+    def test_batch_follow(self):
+        """Can you follow many users in one request?"""
+
+        ids = [self.testuser.id, self.testuser_2.id, 0]
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.post("/api/users/follow", json={"ids": ids})
+            self.assertEqual(resp.get_json(), {"followed": 1})
+
+            resp = c.post("/api/users/follow", json={"ids": ids})
+            self.assertEqual(resp.get_json(), {"followed": 0})
+
+            resp = c.post("/api/users/stop-following", json={"ids": ids})
+            self.assertEqual(resp.get_json(), {"unfollowed": 1})
+
+    def test_show_following_and_followers(self):
+        """Do the following/followers pages list the right users?"""
+
+        follow = Follows(user_following_id=self.testuser.id,
+                         user_being_followed_id=self.testuser_2.id)
+        db.session.add(follow)
+        db.session.commit()
+
+        ids = (self.testuser.id, self.testuser_2.id)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = ids[0]
+
+            html = c.get(f"/users/{ids[0]}/following").get_data(as_text=True)
+            self.assertIn("@testuser2", html)
+            self.assertIn("Unfollow", html)
+
+            html = c.get(f"/users/{ids[1]}/followers").get_data(as_text=True)
+            self.assertIn('href="/users/%d" class="card-link"' % ids[0], html)
+
+    def test_follows_page(self):
+        """Are follows paged newest first, with the viewer's follow state?"""
+
+        followers = [User(username=f"fan{i}", email=f"fan{i}@test.com",
+                          password="HASHED_PASSWORD") for i in range(3)]
+        db.session.add_all(followers)
+        db.session.commit()
+
+        db.session.add_all(
+            [Follows(user_following_id=fan.id,
+                     user_being_followed_id=self.testuser_2.id,
+                     created_at=datetime(2020, 1, i + 1))
+             for i, fan in enumerate(followers)] +
+            [Follows(user_following_id=self.testuser.id,
+                     user_being_followed_id=followers[1].id)])
+        db.session.commit()
+
+        page = Follows.page(self.testuser_2.id, self.testuser.id,
+                            followers=True, limit=2)
+        self.assertEqual([(row.username, row.viewer_follows) for row in page],
+                         [("fan2", False), ("fan1", True)])
+
+        page = Follows.page(self.testuser_2.id, self.testuser.id,
+                            followers=True, limit=2,
+                            before=(page[-1].followed_at, page[-1].id))
+        self.assertEqual([row.username for row in page], ["fan0"])
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.get(f"/users/{self.testuser_2.id}/followers"
+                         f"?before=2020-01-02T00:00:00_{followers[1].id}")
+            html = resp.get_data(as_text=True)
+            self.assertIn("@fan0", html)
+            self.assertNotIn("@fan1", html)
+
+            resp = c.get(f"/users/{self.testuser_2.id}/followers?before=x")
+            self.assertEqual(resp.status_code, 400)
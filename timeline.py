@@ -0,0 +1,241 @@
+"""Home timelines merged from per-author buffers of recent message ids.
+
+`TimelineEngine` keeps, for each author someone's timeline has needed
+lately, an array of the ids of their newest `buffer_size` messages. A
+timeline page is a k-way merge (heapq.merge) of the buffers of the
+authors a user follows, newest first, so no query touches messages
+until the page's rows are loaded by primary key.
+
+Authors without a buffer are loaded with one query that takes each
+author's newest messages from ix_messages_user_id_id_deleted_at. The
+merge can only be trusted while every buffer reaches back past the end
+of the page; when one doesn't (paging back past what's buffered), the
+page comes from SQL instead, with the same per-author index lookups.
+
+Messages posted and deleted in this process update the buffers
+directly. Other workers' changes are picked up by refreshing buffers
+more than `max_age` seconds old (fetching ids newer than the newest
+buffered one), and ids whose rows turn out to be gone are dropped. The
+`max_authors` least recently used buffers are kept; the rest are
+evicted, so inactive authors cost nothing.
+"""
+
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from itertools import islice
+
+from models import db
+
+# Newest first, per author, from ix_messages_user_id_id_deleted_at.
+RECENT_SQL = """
+    SELECT recent.id, recent.user_id
+    FROM unnest(CAST(:authors AS integer[]), CAST(:after AS bigint[]))
+         AS author(id, after)
+    CROSS JOIN LATERAL (
+        SELECT messages.id, messages.user_id
+        FROM messages
+        WHERE messages.user_id = author.id AND messages.id > author.after
+          AND messages.deleted_at IS NULL
+        ORDER BY messages.id DESC
+        LIMIT :per_author
+    ) AS recent
+"""
+
+PAGE_SQL = """
+    SELECT recent.id, recent.user_id
+    FROM unnest(CAST(:authors AS integer[])) AS author(id)
+    CROSS JOIN LATERAL (
+        SELECT messages.id, messages.user_id
+        FROM messages
+        WHERE messages.user_id = author.id AND messages.id < :before
+          AND messages.deleted_at IS NULL
+        ORDER BY messages.id DESC
+        LIMIT :limit
+    ) AS recent
+    ORDER BY recent.id DESC
+    LIMIT :limit
+"""
+
+# Larger than any message id.
+NEWEST = 2 ** 63 - 1
+
+# Refreshes also fetch ids up to a second older than the newest buffered
+# one, which other workers may have handed out a little later.
+OVERLAP = 1000 << 22
+
+
+def page_from_sql(author_ids, before=None, limit=100):
+    """(id, author id) pairs of the newest `limit` messages by the authors,
+    older than message `before` if given."""
+
+    return [tuple(row) for row in db.session.execute(
+        PAGE_SQL, {"authors": list(author_ids), "before": before or NEWEST,
+                   "limit": limit})]
+
+
+def newest_first(author_id, buffer, before):
+    """(id, author id) pairs for the buffer's ids older than `before`."""
+
+    for id in reversed(buffer.ids):
+        if id < before:
+            yield id, author_id
+
+
+class Buffer:
+    """An author's newest message ids, oldest first."""
+
+    __slots__ = ('ids', 'complete', 'synced_at')
+
+    def __init__(self, ids, complete, synced_at):
+        self.ids = array('q', ids)
+        # Whether these are all of the author's messages.
+        self.complete = complete
+        self.synced_at = synced_at
+
+
+class TimelineEngine:
+    """Timelines merged in memory from per-author recent-message buffers."""
+
+    def __init__(self, buffer_size=100, max_authors=20000, max_age=10):
+        self.buffer_size = buffer_size
+        self.max_authors = max_authors
+        self.max_age = max_age
+
+        self.buffers = OrderedDict()
+        self.lock = threading.Lock()
+
+    def timeline(self, author_ids, before=None, limit=100):
+        """(id, author id) pairs for a page of the authors' messages.
+
+        Newest first, older than message `before` if given.
+        """
+
+        author_ids = set(author_ids)
+        now = time.time()
+
+        with self.lock:
+            after = {id: self.newest(self.buffers[id])
+                     for id in author_ids
+                     if id in self.buffers and
+                     self.buffers[id].synced_at < now - self.max_age}
+            missing = [id for id in author_ids if id not in self.buffers]
+        after.update((id, 0) for id in missing)
+
+        if after:
+            self.load(after, now)
+
+        with self.lock:
+            page = self.merge(author_ids, before, limit)
+        if page is None:
+            page = page_from_sql(author_ids, before, limit)
+        return page
+
+    def newest(self, buffer):
+        """Where to refresh `buffer` from."""
+
+        if not buffer.ids:
+            return 0
+        newest = buffer.ids[-1]
+        # Ids from before snowflake ids are smaller than OVERLAP.
+        return newest - OVERLAP if newest > OVERLAP else newest
+
+    def merge(self, author_ids, before, limit):
+        """The page from the buffers, or None if they don't cover it."""
+
+        buffers = []
+        for id in author_ids:
+            buffer = self.buffers.get(id)
+            if buffer is None:
+                # Evicted since it was loaded.
+                return None
+            self.buffers.move_to_end(id)
+            buffers.append((id, buffer))
+
+        before = before or NEWEST
+        page = list(islice(
+            heapq.merge(*[newest_first(id, buffer, before)
+                          for id, buffer in buffers],
+                        reverse=True),
+            limit))
+
+        # Anything an incomplete buffer is missing is older than its
+        # oldest id, so that has to be older than the page's last one.
+        cutoff = page[-1][0] if len(page) == limit else 0
+        for id, buffer in buffers:
+            if not buffer.complete and (not buffer.ids or
+                                        buffer.ids[0] > cutoff):
+                return None
+        return page
+
+    def load(self, after, now):
+        """Load or refresh buffers: `after` maps author id to the newest
+        message id already buffered (0 for none)."""
+
+        authors = list(after)
+        recent = {id: [] for id in authors}
+        for message_id, author_id in db.session.execute(
+                RECENT_SQL, {"authors": authors,
+                             "after": [after[id] for id in authors],
+                             "per_author": self.buffer_size}):
+            recent[author_id].append(message_id)
+
+        with self.lock:
+            for author_id, ids in recent.items():
+                ids.reverse()
+                buffer = self.buffers.get(author_id)
+                if (buffer is None or not buffer.ids or
+                        len(ids) == self.buffer_size):
+                    # A full fetch may have skipped some, so start over.
+                    buffer = Buffer(ids, after[author_id] == 0 and
+                                    len(ids) < self.buffer_size, now)
+                    self.buffers[author_id] = buffer
+                else:
+                    self.append(buffer, ids)
+                    buffer.synced_at = now
+                self.buffers.move_to_end(author_id)
+
+            while len(self.buffers) > self.max_authors:
+                self.buffers.popitem(last=False)
+
+    def append(self, buffer, ids):
+        for id in ids:
+            if not buffer.ids or id > buffer.ids[-1]:
+                buffer.ids.append(id)
+                continue
+            # Out of order, e.g. from another worker's refresh.
+            i = bisect_left(buffer.ids, id)
+            if i < len(buffer.ids) and buffer.ids[i] == id:
+                continue
+            if i == 0 and not buffer.complete:
+                # Older than anything kept, so among the unbuffered.
+                continue
+            buffer.ids.insert(i, id)
+
+        overflow = len(buffer.ids) - self.buffer_size
+        if overflow > 0:
+            del buffer.ids[:overflow]
+            buffer.complete = False
+
+    def add(self, author_id, message_id):
+        """Record a new message, if its author is buffered."""
+
+        with self.lock:
+            buffer = self.buffers.get(author_id)
+            if buffer is not None:
+                self.append(buffer, [message_id])
+
+    def remove(self, author_id, message_id):
+        """Forget a deleted message."""
+
+        with self.lock:
+            buffer = self.buffers.get(author_id)
+            if buffer is not None and message_id in buffer.ids:
+                buffer.ids.remove(message_id)
+
+    def clear(self):
+        with self.lock:
+            self.buffers.clear()
@@ -0,0 +1,109 @@
+"""Trending warbles, from like counts kept in fixed-size time buckets."""
+
+import threading
+import time
+
+from sqlalchemy.dialects.postgresql import insert
+
+from models import db, TrendingBucket
+
+
+class Trending:
+    """Decayed like scores over a sliding window of time buckets.
+
+    Every like or unlike adds +1/-1 to the message's row for the current
+    bucket in `trending_likes`, so recording one is a single upsert.
+    Buckets older than the window are ignored, and pruned by `flask
+    prune-trending` (run on a schedule, not in requests), which bounds
+    the table at (messages liked in the window) x (buckets per window)
+    rows.
+
+    A message's score is its net likes per bucket, each halved for every
+    `half_life_hours` since the bucket. The top `size` scores are
+    recomputed from the window at most every `ttl` seconds and served from
+    memory in between.
+    """
+
+    def __init__(self, window_hours=24, bucket_minutes=60,
+                 half_life_hours=6, size=50, ttl=60):
+        self.bucket_seconds = bucket_minutes * 60
+        self.window_buckets = max(1, window_hours * 60 // bucket_minutes)
+        self.half_life_buckets = half_life_hours * 60 / bucket_minutes
+        self.size = size
+        self.ttl = ttl
+
+        self.scores = []
+        self.computed_at = None
+        self.lock = threading.Lock()
+
+    def current_bucket(self):
+        """Bucket number for right now."""
+
+        return int(time.time() // self.bucket_seconds)
+
+    def record(self, message_ids, delta=1):
+        """Add `delta` likes to each message in the current bucket.
+
+        Runs in the caller's transaction, so it commits with the like.
+        """
+
+        if not message_ids:
+            return
+
+        stmt = insert(TrendingBucket.__table__).values([
+            {"message_id": id, "bucket": self.current_bucket(), "likes": delta}
+            for id in message_ids
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['message_id', 'bucket'],
+            set_={"likes": TrendingBucket.likes + stmt.excluded.likes})
+
+        db.session.execute(stmt)
+
+    def prune(self):
+        """Delete buckets that have slid out of the window.
+
+        Runs in the caller's transaction. Returns how many were deleted.
+        """
+
+        return (TrendingBucket.query
+                .filter(TrendingBucket.bucket <=
+                        self.current_bucket() - self.window_buckets)
+                .delete(synchronize_session=False))
+
+    def compute(self):
+        """Return the current top (message id, score) pairs from the table."""
+
+        current = self.current_bucket()
+        decay = db.func.power(
+            0.5, (current - TrendingBucket.bucket) / self.half_life_buckets)
+        score = db.func.sum(TrendingBucket.likes * decay).label('score')
+
+        rows = (db.session
+                .query(TrendingBucket.message_id, score)
+                .filter(TrendingBucket.bucket > current - self.window_buckets)
+                .group_by(TrendingBucket.message_id)
+                .having(score > 0)
+                .order_by(score.desc(), TrendingBucket.message_id.desc())
+                .limit(self.size)
+                .all())
+
+        return [(message_id, float(score)) for message_id, score in rows]
+
+    def top(self, limit=None):
+        """Return up to `limit` (message id, score) pairs, best first."""
+
+        with self.lock:
+            now = time.monotonic()
+            if self.computed_at is None or now - self.computed_at > self.ttl:
+                self.scores = self.compute()
+                self.computed_at = now
+
+            return self.scores[:limit or self.size]
+
+    def reset(self):
+        """Forget the cached scores so the next lookup recomputes them."""
+
+        with self.lock:
+            self.scores = []
+            self.computed_at = None